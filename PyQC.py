@@ -2,12 +2,15 @@
 
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import (
+    QImage,
     QKeyEvent,
     QWheelEvent,
     QResizeEvent,
 )
 from PyQt5.QtWidgets import (
     QApplication,
+    QScrollArea,
+    QSplitter,
     QMainWindow,
     QLabel,
     QTableWidgetItem,
@@ -21,19 +24,101 @@ from PyQt5.QtWidgets import (
 )
 
 import argparse
+import concurrent.futures
+import contextlib
+import cProfile
 import csv
+import functools
+import json
 import os
-import pathlib
+import pstats
 import signal
 import sys
-
+import time
+
+import archive
+import compare
+import csvformat
+import decoders
+import dedupe
+import memory
+import overlay
+import pack
+import replay
+import serve
+import shared_cache
+import stats
 import window1
+from image_widget import SaneDefaultsImageLabel, load_together
+from prefetch import MODES as PREFETCH_MODES, Prefetcher
+from prescreen import OK as PRESCREEN_OK, Prescreener, describe as prescreen_describe
+from rating_index import RowBitmap
+from search_index import SearchIndex
+from session import (
+    IMAGE_EXTS,
+    DUPLICATE_COLUMN,
+    PRESCREEN_COLUMN,
+    CsvSet,
+    Session,
+    expand_csv_paths,
+    list_images,
+)
+from stall_watchdog import DEFAULT_THRESHOLD as STALL_THRESHOLD, StallWatchdog
+
+
+class _PathItem(QTableWidgetItem):
+    """Column-0 cell whose label is derived from the PathStore on demand
+    rather than kept as a second copy of the file name."""
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        super(_PathItem, self).__init__()
+        self._store = store
+        self._index = index
+
+    def data(self, role):
+        if role in (Qt.DisplayRole, Qt.EditRole):  # type: ignore[attr-defined]
+            return self._store.display_name(self._index)
+        return super(_PathItem, self).data(role)
+
+
+# Tables with more rows than this switch to large-table mode (see
+# MainWindow._set_large_table), which sizes columns from this many rows
+LARGE_TABLE_ROWS = 20000
+COLUMN_SIZE_SAMPLE = 200
+# Measured size of a QTableWidgetItem holding a short rating, in bytes
+TABLE_ITEM_BYTES = 420
+# How often the memory counters are refreshed and a budget enforced, in ms
+MEMORY_CHECK_MS = 1000
+# Functions --profile prints, by cumulative time
+PROFILE_TOP = 30
+# Rows ahead whose images are decoded in the decoder's worker processes
+DECODE_AHEAD = 2
+
+
+def _session_attribute(name):
+    """Property that forwards to the same-purpose attribute of
+    MainWindow.session, under the name the window has always used."""
+    return property(
+        lambda self: getattr(self.session, name),
+        lambda self, value: setattr(self.session, name, value),
+    )
 
 
 class MainWindow(QMainWindow, window1.Ui_MainWindow):
-    def __init__(self, files=None, parent=None):
+    filelist = _session_attribute("files")
+    column_names = _session_attribute("column_names")
+    path = _session_attribute("path")
+    listlocation = _session_attribute("row")
+    insert_column = _session_attribute("insert_column")
+    _dirty = _session_attribute("dirty")
+    _shown_rows = _session_attribute("shown")
+
+    def __init__(self, files=None, parent=None, prefetch="read"):
         super(MainWindow, self).__init__(parent)
         self.setupUi(self)
+        self.session = Session(on_cells_changed=self._show_cells)
 
         self.actionOpen_Directory.triggered.connect(self.openDir)
         self.actionOpen_Files.triggered.connect(self.openFiles)
@@ -48,23 +133,79 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         self.action_Zoom_Fit.triggered.connect(self.zoomToFit)
         self.action_Zoom_In.triggered.connect(self.zoomIn)
         self.action_Zoom_Out.triggered.connect(self.zoomOut)
+        self.actionFind.triggered.connect(self.focusSearch)
+        self.searchEdit.textEdited.connect(self._on_search_edited)
+        self.searchEdit.returnPressed.connect(self._on_search_return)
+        self.actionShow_All_Rows.triggered.connect(self.clearFilter)
+        self.actionShow_Unrated_Rows.triggered.connect(self.filterUnrated)
+        self.actionShow_Rows_Rated.triggered.connect(self.showRowsRated)
+        self.actionPrescreen_Images.triggered.connect(lambda: self.prescreen())
+        self.actionPrerate_Flagged.triggered.connect(self.prerateFlagged)
+        self.actionCompare.triggered.connect(self.compareWith)
+        self.actionWrite_Stall_Report.triggered.connect(self.writeStallReport)
+        self.actionWrite_Memory_Report.triggered.connect(self.writeMemoryReport)
+        self.actionRate_Selected_Rows.triggered.connect(lambda: self.rateSelectedRows())
+        self.actionFind_Duplicates.triggered.connect(self.findDuplicates)
+        self.actionRate_Duplicates.triggered.connect(self.rateDuplicates)
 
-        self.filelist = list()
-        self.path = None
         self.image = None
-        self.listlocation = 0
+        self._displayed_row = 0
         self.scaleFactor = None
         self._fit_mode = False
-        self.insert_column = 1
-        self.column_names = ["File", "QC_Raw", "QC_Pre"]
-        self._dirty = False
+        self._search_index = None
+        self._rating_index_suspended = False
+        self._row_filter = None
+        self._row_filter_label = ""
+        self._prefetcher = Prefetcher(prefetch)
+        self.label.byte_source = self._prefetcher.take
+        self._prescreener = None
+        self._prerate_after_prescreen = None
+        self._prescreen_timer = QTimer(self)
+        self._prescreen_timer.timeout.connect(self._collect_prescreen)
+        self._hasher = None
+        self._hash_index = None
+        self._hashes = {}
+        self._hash_timer = QTimer(self)
+        self._hash_timer.timeout.connect(self._collect_hashes)
+        self._compare_rules = []
+        self._compare_splitter = None
+        self._compare_viewers = []  # (scroll area, label) after the main one
+        self._decode_pool = None
+        self._syncing_scroll = False
+        self._overlay_mode = None
+        self._overlay_alpha = 0.5
+        self._watchdog = None
+        self._stall_report = None
+        self._recorder = None
+        self._csv_set = None
+        self._items_for_empty_cells = False
+        self._memory_report = "pyqc-memory.txt"
+        self.memory = self._account_memory()
+        self._memory_summary = ""
+        # Counting walks the paths and rating columns, so it is kept off
+        # the per-keypress status refresh
+        self._memory_timer = QTimer(self)
+        self._memory_timer.timeout.connect(self._check_memory)
+        self._memory_timer.start(MEMORY_CHECK_MS)
+        self.actionWrite_Stall_Report.setEnabled(False)
+        self._link_scrollbars(self.scrollArea)
+        self.label.windowChanged.connect(self._refresh_status)
 
         self._status_label = QLabel()
         self.statusBar().addPermanentWidget(self._status_label)
         self._refresh_status()
 
         self.tableWidget.cellClicked.connect(self.switchToItem)
+        model = self.tableWidget.model()
+        model.dataChanged.connect(self._on_cells_changed)
+        model.rowsInserted.connect(self._on_rows_inserted)
+        model.rowsRemoved.connect(self._rebuild_rating_index)
+        model.modelReset.connect(self._rebuild_rating_index)
+        model.columnsInserted.connect(self._on_columns_inserted)
+        model.columnsRemoved.connect(self._on_columns_removed)
         self.tableWidget.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self._large_table = False
+        self._size_precision = self.tableWidget.horizontalHeader().resizeContentsPrecision()
         self.tableWidget.customContextMenuRequested.connect(self.showColumnContextMenu)
         self.tableWidget.horizontalHeader().customContextMenuRequested.connect(
             self.showColumnContextMenu
@@ -72,7 +213,7 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         self.tableWidget.horizontalHeader().setContextMenuPolicy(Qt.CustomContextMenu)
 
         self.splitter_3.setSizes([200, 600])
-        self.tableWidget.resizeColumnsToContents()
+        self._resize_columns()
 
         if files:
             self.openArgumentFiles(files)
@@ -81,27 +222,55 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         if a0 is None:
             return
         event = a0
+        if self._recorder is not None:
+            self._recorder.key(event)
         if event.text() in "0123456789":
-            self.numpress(event.text())
+            rows = self._selected_rows()
+            if len(rows) > 1:
+                self.rateRows(rows, event.text())
+            else:
+                self.numpress(event.text())
         elif event.key() == Qt.Key_Period:  # type: ignore[attr-defined]
             self.undo()
         elif event.key() == Qt.Key_W or event.key() == Qt.Key_Slash:  # type: ignore[attr-defined]
             self.navup()
         elif event.key() == Qt.Key_S or event.key() == Qt.Key_Asterisk:  # type: ignore[attr-defined]
             self.navdown()
+        elif event.key() == Qt.Key_N:  # type: ignore[attr-defined]
+            self.nextUnrated()
+        elif event.key() == Qt.Key_P:  # type: ignore[attr-defined]
+            self.previousUnrated()
         elif event.key() == Qt.Key_Plus:  # type: ignore[attr-defined]
             self.scaleImage(1.1)
         elif event.key() == Qt.Key_Minus:  # type: ignore[attr-defined]
             self.scaleImage(0.9)
+        elif event.key() == Qt.Key_O:  # type: ignore[attr-defined]
+            self.cycleOverlay()
+        elif event.key() == Qt.Key_BracketLeft:  # type: ignore[attr-defined]
+            self.adjustOverlayAlpha(-0.1)
+        elif event.key() == Qt.Key_BracketRight:  # type: ignore[attr-defined]
+            self.adjustOverlayAlpha(0.1)
+        elif event.key() == Qt.Key_A:  # type: ignore[attr-defined]
+            self.toggleAutoContrast()
+        elif event.key() == Qt.Key_R:  # type: ignore[attr-defined]
+            self.resetWindow()
+        elif event.key() == Qt.Key_Escape:  # type: ignore[attr-defined]
+            self.label.setFocus()
 
     def _go_to_row(self, row):
         """Move selection to `row`, load its image, reset zoom. No-op if
         row is out of range or there are no files."""
         if not self.filelist or row < 0 or row >= len(self.filelist):
             return
+        step = -1 if row < self._displayed_row else 1
         self.listlocation = row
-        self.label.load(self.filelist[row])
-        self.scrollArea.setWidgetResizable(True)
+        self._displayed_row = row
+        self._load_row(row)
+        self._apply_overlay()
+        self._prefetch_from(row, step)
+        self._predecode_from(row, step)
+        for area, _ in self._viewers():
+            area.setWidgetResizable(True)
         self.scaleFactor = None
         self._fit_mode = False
         self.tableWidget.scrollToItem(
@@ -111,26 +280,225 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         self.tableWidget.selectRow(row)
         self._refresh_status()
 
+    def _load_row(self, row):
+        """Show the image of `row`, and in compare mode its siblings, which
+        are read and decoded side by side on a thread pool."""
+        path = self.filelist[row]
+        if not self._compare_rules:
+            self.label.load(path)
+            return
+        labels, sources = [self.label], [path]
+        for rule, (_, label) in zip(self._compare_rules, self._compare_viewers):
+            source = compare.sibling(path, rule)
+            if source is None:
+                label.content = None
+                label.clear()
+                label.setText("No {} file for this row".format(compare.format_rules([rule])))
+                continue
+            labels.append(label)
+            sources.append(source)
+        if self._decode_pool is None:
+            self._decode_pool = concurrent.futures.ThreadPoolExecutor(
+                thread_name_prefix="pyqc-decode"
+            )
+        load_together(labels, sources, self._decode_pool)
+
+    def _row_files(self, row):
+        """The file of `row` followed by the siblings compare mode shows."""
+        path = self.filelist[row]
+        siblings = (compare.sibling(path, rule) for rule in self._compare_rules)
+        return [path] + [s for s in siblings if s is not None]
+
+    def _viewers(self):
+        """(scroll area, label) of every image viewer, the main one first."""
+        return [(self.scrollArea, self.label)] + self._compare_viewers
+
+    def compareWith(self):
+        rules, ok = QInputDialog.getText(
+            self,
+            "Compare With Sibling Files",
+            "Show each image next to the file named by replacing OLD with NEW\n"
+            "in its path (OLD=NEW, comma-separated for more; empty to stop):",
+            text=compare.format_rules(self._compare_rules),
+        )
+        if not ok:
+            return
+        try:
+            self.setCompareRules(compare.parse_rules(rules))
+        except ValueError as exc:
+            QMessageBox.warning(self, "Compare", str(exc))
+
+    def setCompareRules(self, rules):
+        """Show one extra, linked viewer per (old, new) sibling rule."""
+        for area, label in self._compare_viewers:
+            area.deleteLater()
+        self._compare_viewers = []
+        self._compare_rules = list(rules)
+        if not rules:
+            self._overlay_mode = None
+            self.label.set_overlay()
+        if rules and self._compare_splitter is None:
+            # Put the main viewer in a row that the others join
+            self._compare_splitter = QSplitter(Qt.Horizontal)
+            self.splitter_2.insertWidget(0, self._compare_splitter)
+            self._compare_splitter.addWidget(self.scrollArea)
+        for _ in rules:
+            label = SaneDefaultsImageLabel()
+            label.setSizePolicy(self.label.sizePolicy())
+            label.setAlignment(Qt.AlignCenter)
+            # One decode pipeline for all viewers
+            label.cache = self.label.cache
+            label.byte_source = self.label.byte_source
+            label.decoder = self.label.decoder
+            label.shared_cache = self.label.shared_cache
+            label.auto_contrast = self.label.auto_contrast
+            area = QScrollArea()
+            area.setWidgetResizable(True)
+            area.setAlignment(Qt.AlignCenter)
+            area.setWidget(label)
+            self._compare_splitter.addWidget(area)
+            self._link_scrollbars(area)
+            self._compare_viewers.append((area, label))
+        if self.filelist:
+            self._go_to_row(self.listlocation)
+
+    def toggleAutoContrast(self):
+        enabled = not self.label.auto_contrast
+        for _, label in self._viewers():
+            label.set_auto_contrast(enabled)
+        self._refresh_status()
+
+    def resetWindow(self):
+        """Show every viewer's image as decoded again."""
+        for _, label in self._viewers():
+            label.set_auto_contrast(False)
+            label.set_window(None)
+        self._refresh_status()
+
+    def cycleOverlay(self):
+        """Switch the main viewer to the next overlay mode (then back to
+        none), compositing it with the first compare viewer's image."""
+        if not self._compare_viewers:
+            self._toast("Overlays need compare mode (View > Compare With Sibling Files)")
+            return
+        modes = (None,) + overlay.MODES
+        self._overlay_mode = modes[(modes.index(self._overlay_mode) + 1) % len(modes)]
+        self._apply_overlay()
+        self._refresh_status()
+
+    def adjustOverlayAlpha(self, delta):
+        if self._overlay_mode != "blend":
+            return
+        self._overlay_alpha = min(max(self._overlay_alpha + delta, 0.0), 1.0)
+        self._apply_overlay()
+        self._refresh_status()
+
+    def _apply_overlay(self):
+        other = self._compare_viewers[0][1] if self._compare_viewers else None
+        if self._overlay_mode is None or other is None or other.content is None:
+            self.label.set_overlay()
+        else:
+            self.label.set_overlay(
+                other.content_key, other.content, self._overlay_mode, self._overlay_alpha
+            )
+
+    def _link_scrollbars(self, area):
+        for bar in (area.horizontalScrollBar(), area.verticalScrollBar()):
+            bar.valueChanged.connect(functools.partial(self._sync_scroll, bar))
+
+    def _sync_scroll(self, bar, value):
+        """Scroll the other viewers to the same relative position."""
+        if self._syncing_scroll or not self._compare_viewers:
+            return
+        fraction = value / bar.maximum() if bar.maximum() else 0.0
+        horizontal = bar.orientation() == Qt.Horizontal
+        self._syncing_scroll = True
+        try:
+            for area, _ in self._viewers():
+                other = area.horizontalScrollBar() if horizontal else area.verticalScrollBar()
+                if other is not bar:
+                    other.setValue(round(fraction * other.maximum()))
+        finally:
+            self._syncing_scroll = False
+
+    def _prefetch_from(self, row, step):
+        """Tell the prefetcher which files follow `row` when moving by
+        `step`, over the rows the active filter shows."""
+        if self._prefetcher.mode == "off":
+            return
+        upcoming = []
+        for _ in range(self._prefetcher.max_window):
+            row = self._step_row(row, step)
+            if row is None:
+                break
+            upcoming.extend(self._row_files(row))
+        self._prefetcher.hint(upcoming)
+
+    def _predecode_from(self, row, step):
+        """Start decoding the images of the DECODE_AHEAD rows after `row`
+        (see SaneDefaultsImageLabel.predecode)."""
+        if self.label.decoder is None:
+            return
+        paths = []
+        for _ in range(DECODE_AHEAD):
+            row = self._step_row(row, step)
+            if row is None:
+                break
+            paths.append(self.filelist[row])
+        self.label.predecode(paths)
+        for rule, (_, label) in zip(self._compare_rules, self._compare_viewers):
+            siblings = (compare.sibling(path, rule) for path in paths)
+            label.predecode([s for s in siblings if s is not None])
+
+    def _step_row(self, row, step):
+        return self.session.step(row, step)
+
+    @property
+    def _rating_index(self):
+        return self.session.index
+
     def _count_unrated_rows(self):
-        count = 0
-        for r in range(self.tableWidget.rowCount()):
-            for c in range(1, self.tableWidget.columnCount()):
-                item = self.tableWidget.item(r, c)
-                if item is None or item.text() == "":
-                    count += 1
-                    break
-        return count
+        return len(self._rating_index.unrated())
 
     def _refresh_status(self):
         if not self.filelist:
             text = "No files loaded"
         else:
             text = f"{self.listlocation + 1} / {len(self.filelist)}"
+            if self._csv_set is not None:
+                text += "   CSV {} / {} {}".format(
+                    self._csv_set.position + 1,
+                    len(self._csv_set.paths),
+                    os.path.basename(self.path),
+                )
             unrated = self._count_unrated_rows()
             if unrated:
                 text += f"   {unrated} unrated"
-            if self._dirty:
+            if self._row_filter is not None:
+                text += f"   [{self._row_filter_label}: {len(self._row_filter)}]"
+            if self._prescreener is not None:
+                text += (
+                    f"   prescreen {self._prescreener.done}/{self._prescreener.total}"
+                )
+            if self._hasher is not None:
+                text += f"   hashing {self._hasher.done}/{self._hasher.total}"
+            window = self.label.window
+            if window is not None:
+                text += "   W/L {}/{}{}".format(
+                    window[1] - window[0],
+                    (window[0] + window[1]) // 2,
+                    " auto" if self.label.auto_contrast else "",
+                )
+            elif self.label.auto_contrast:
+                text += "   auto contrast"
+            if self._overlay_mode == "blend":
+                text += f"   blend {self._overlay_alpha:.0%}"
+            elif self._overlay_mode is not None:
+                text += f"   {self._overlay_mode}"
+            if self._unsaved():
                 text += "   ●"
+            if self._memory_summary:
+                text += "   " + self._memory_summary
         self._status_label.setText(text)
 
     def _toast(self, message, ms=3000):
@@ -138,35 +506,70 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         if bar is not None:
             bar.showMessage(message, ms)
 
+    def _rating_columns(self):
+        return self.session.rating_columns()
+
     def numpress(self, key):
-        rating_columns = list(range(1, self.tableWidget.columnCount()))
-        if not rating_columns:
+        row = self.listlocation
+        rating_columns = self._rating_columns()
+        last_cell = (
+            bool(rating_columns)
+            and self.insert_column == rating_columns[-1]
+            and self._step_row(row, 1) is None
+        )
+        if not self.session.rate(key):
+            return
+        if last_cell and self._switch_csv(1):
             return
+        if self.listlocation != row:
+            self._go_to_row(self.listlocation)
+        self._refresh_status()
 
-        if self.insert_column not in rating_columns:
-            self.insert_column = rating_columns[0]
+    def _jump_to_unrated(self, reverse=False):
+        if not self.session.next_unrated(reverse):
+            self._toast("No unrated rows")
+            return
+        self._go_to_row(self.listlocation)
 
-        self.tableWidget.setItem(
-            self.listlocation, self.insert_column, QTableWidgetItem(key)
-        )
-        self._dirty = True
+    def nextUnrated(self):
+        self._jump_to_unrated()
 
-        idx = rating_columns.index(self.insert_column)
-        if idx == len(rating_columns) - 1:
-            self.insert_column = rating_columns[0]
-            if self.listlocation + 1 < len(self.filelist):
-                self._go_to_row(self.listlocation + 1)
-        else:
-            self.insert_column = rating_columns[idx + 1]
-        self._refresh_status()
+    def previousUnrated(self):
+        self._jump_to_unrated(reverse=True)
 
     def navup(self):
-        self.insert_column = 1
-        self._go_to_row(self.listlocation - 1)
+        if self.session.move(-1):
+            self._go_to_row(self.listlocation)
+        else:
+            self._switch_csv(-1)
 
     def navdown(self):
-        self.insert_column = 1
-        self._go_to_row(self.listlocation + 1)
+        if self.session.move(1):
+            self._go_to_row(self.listlocation)
+        else:
+            self._switch_csv(1)
+
+    def _switch_csv(self, step):
+        """In a multi-CSV review, show the next (step 1) or previous (-1)
+        CSV of the set; backwards, on its last row. Returns False at either
+        end, or outside a multi-CSV review."""
+        if self._csv_set is None:
+            return False
+        session = self._csv_set.advance(step)
+        if session is None:
+            return False
+        if step < 0:
+            session.row = session.row_count - 1
+            session.insert_column = 1
+        self._show_csv_session(session)
+        self._toast(os.path.basename(session.path))
+        return True
+
+    def _show_csv_session(self, session):
+        self.session.on_cells_changed = None
+        session.on_cells_changed = self._show_cells
+        self.session = session
+        self._show_session(empty_items=True)
 
     def scaleImage(self, factor):
         if not self.label.content or self.label.content.size().width() == 0:
@@ -178,8 +581,7 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
             )
         self.scaleFactor *= factor
         self._fit_mode = False
-        self.scrollArea.setWidgetResizable(False)
-        self.label.resize(self.scaleFactor * self.label.content.size())
+        self._apply_scale()
         self.adjustScrollBar(self.scrollArea.horizontalScrollBar(), factor)
         self.adjustScrollBar(self.scrollArea.verticalScrollBar(), factor)
 
@@ -192,9 +594,8 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         if not self.label.content or self.label.content.size().width() == 0:
             return
         self._fit_mode = False
-        self.scrollArea.setWidgetResizable(False)
         self.scaleFactor = 1.0
-        self.label.resize(self.label.content.size())
+        self._apply_scale()
 
     def zoomToFit(self):
         if not self.label.content or self.label.content.size().width() == 0:
@@ -205,8 +606,14 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         scale_height = viewport_size.height() / content_size.height()
         self.scaleFactor = min(scale_width, scale_height)
         self._fit_mode = True
-        self.scrollArea.setWidgetResizable(False)
-        self.label.resize(self.scaleFactor * content_size)
+        self._apply_scale()
+
+    def _apply_scale(self):
+        """Size every viewer's image by the shared scaleFactor."""
+        for area, label in self._viewers():
+            area.setWidgetResizable(False)
+            if label.content and label.content.size().width():
+                label.resize(self.scaleFactor * label.content.size())
 
     def zoomIn(self):
         self.scaleImage(1.1)
@@ -218,6 +625,8 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         if a0 is None:
             return
         event = a0
+        if self._recorder is not None:
+            self._recorder.wheel(event)
         if event.angleDelta().y() > 0:
             self.scaleImage(1.1)
         else:
@@ -229,27 +638,56 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         if self._fit_mode:
             self.zoomToFit()
 
-    def _reset_table(self):
-        """Wipe table state back to defaults. Called by every loader so that
-        re-opening data never inherits stale columns, ratings, or paths."""
-        self.column_names = ["File", "QC_Raw", "QC_Pre"]
-        self.tableWidget.clearContents()
-        self.tableWidget.setRowCount(0)
-        self.tableWidget.setColumnCount(len(self.column_names))
-        self.tableWidget.setHorizontalHeaderLabels(self.column_names)
-        self.path = None
-        self.filelist = []
-        self.listlocation = 0
+    def _show_session(self, empty_items=False):
+        """Rebuild the table from a freshly loaded session, drop what the
+        view kept for the previous one, and show the cursor's row. Empty
+        cells get no item (None reads as ""), unless `empty_items` is set
+        and the table is not in large-table mode."""
+        self._row_filter = None
+        self._row_filter_label = ""
+        self._prefetcher.clear()
+        self._cancel_prescreen()
+        self._cancel_hashing()
+        self._search_index = None
+        self._displayed_row = 0
         self.scaleFactor = None
         self._fit_mode = False
-        self.insert_column = 1
-        self._dirty = False
+        session = self.session
+        table = self.tableWidget
+        rows = session.row_count
+        with self._rating_index_suspended_for_bulk(), self._table_batch():
+            table.clearContents()
+            table.setRowCount(0)
+            table.setColumnCount(len(self.column_names))
+            self._set_large_table(rows)
+            empty_items = empty_items and not self._large_table
+            self._items_for_empty_cells = empty_items
+            table.setRowCount(rows)
+            for row in range(rows):
+                table.setItem(row, 0, _PathItem(self.filelist, row))
+            for column in range(1, len(self.column_names)):
+                for row in range(rows):
+                    value = session.cell(row, column)
+                    if value or empty_items:
+                        table.setItem(row, column, QTableWidgetItem(value))
+        table.setHorizontalHeaderLabels(self.column_names)
+        self._resize_columns()
         self._refresh_status()
+        if rows:
+            self._build_search_index()
+            self._go_to_row(self.listlocation)
+
+    def _unsaved(self):
+        """Whether any ratings, in any CSV of a multi-CSV review, are
+        unsaved."""
+        if self._csv_set is not None:
+            return self._csv_set.dirty
+        return self._dirty
 
     def _confirm_discard_changes(self):
         """Prompt to save unsaved ratings. Returns True if the caller may
         proceed (saved or discarded), False on cancel or failed save."""
-        if not self._dirty:
+        if not self._unsaved():
             return True
         reply = QMessageBox.question(
             self,
@@ -262,7 +700,7 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
             return False
         if reply == QMessageBox.Yes:
             self.Save()
-            return not self._dirty
+            return not self._unsaved()
         return True
 
     def closeEvent(self, a0):
@@ -270,9 +708,130 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
             if a0 is not None:
                 a0.ignore()
             return
+        self._prefetcher.close()
+        self._cancel_prescreen()
+        self._cancel_hashing()
+        if self._watchdog is not None:
+            self._watchdog.stop()
+            self.writeStallReport()
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown(wait=False)
+        if self.label.decoder is not None:
+            self.label.decoder.close()
         if a0 is not None:
             a0.accept()
 
+    def watchForStalls(self, report_path, threshold=STALL_THRESHOLD):
+        """Record GUI stalls longer than `threshold` seconds, and write
+        them to `report_path` on exit or with Tools > Write Stall Report."""
+        self._watchdog = StallWatchdog(threshold)
+        self._stall_report = report_path
+        self._watchdog.start()
+        self.actionWrite_Stall_Report.setEnabled(True)
+
+    def recordTo(self, path):
+        """Log keys, wheel turns and table clicks to the trace `path`, for
+        `pyqc replay`."""
+        self._recorder = replay.Recorder(path)
+
+    def writeStallReport(self):
+        if self._watchdog is None:
+            return
+        try:
+            self._watchdog.write_report(self._stall_report)
+        except OSError as exc:
+            print("Warning: could not write stall report: {}".format(exc))
+            return
+        self._toast(
+            "{} stalls written to {}".format(len(self._watchdog.stalls), self._stall_report)
+        )
+
+    def _account_memory(self):
+        """MemoryAccounts for this window, its caches in the order they are
+        released in: read-ahead bytes first, decoded images last."""
+        accounts = memory.MemoryAccounts()
+        accounts.register("read-ahead", lambda: self._prefetcher.nbytes, self._prefetcher.release)
+        accounts.register(
+            "scaled images",
+            lambda: sum(label.scaled_nbytes() for _, label in self._viewers()),
+            self._release_scaled,
+        )
+        accounts.register(
+            "decoded images",
+            lambda: self.label.cache.nbytes
+            + sum(label.decoded_nbytes() for _, label in self._viewers()),
+            lambda nbytes: self.label.cache.release(nbytes),
+        )
+        accounts.register(
+            "GIF frames", lambda: sum(label.movie_nbytes() for _, label in self._viewers())
+        )
+        accounts.register("table items", self._table_nbytes)
+        accounts.register("paths", self._paths_nbytes)
+        accounts.register("ratings", lambda: self._rating_index.nbytes())
+        return accounts
+
+    def _paths_nbytes(self):
+        files = self.filelist
+        if hasattr(files, "nbytes"):  # a PathStore
+            return files.nbytes()
+        return sys.getsizeof(files) + sum(map(sys.getsizeof, files))
+
+    def _release_scaled(self, nbytes):
+        freed = 0
+        for _, label in self._viewers():
+            if freed >= nbytes:
+                break
+            freed += label.release_scaled(nbytes - freed)
+        return freed
+
+    def _table_nbytes(self):
+        """Estimated size of the table's items: one per path, and one per
+        rating cell, or per non-empty one if empty cells have none."""
+        rows = self.tableWidget.rowCount()
+        items = rows
+        for column in range(1, self.tableWidget.columnCount()):
+            if self._items_for_empty_cells:
+                items += rows
+            else:
+                items += rows - self._rating_index.value_counts(column).get("", 0)
+        return items * TABLE_ITEM_BYTES
+
+    def setMemoryBudget(self, nbytes):
+        """Keep the memory counted by self.memory under `nbytes` (None for
+        no limit) by releasing cached images, checked now and once a
+        second."""
+        self.memory.budget = nbytes
+        self._check_memory()
+
+    def _check_memory(self):
+        """Enforce the memory budget, then show the counters in the status
+        bar and its tooltip."""
+        if self.memory.budget is not None:
+            self.memory.enforce()
+        if not self.filelist:
+            self._memory_summary = ""
+            self._status_label.setToolTip("")
+            return
+        counters = self.memory.counters()
+        self._memory_summary = self.memory.summary(counters)
+        self._status_label.setToolTip(self.memory.report(counters, allocations=False))
+        self._refresh_status()
+
+    def writeMemoryReport(self):
+        """Append the memory counters, and while tracing the Python heap's
+        top allocation sites, to the memory report file."""
+        try:
+            with open(self._memory_report, "a", encoding="utf-8") as f:
+                stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+                f.write("{}\n{}\n\n".format(stamp, self.memory.report()))
+        except OSError as exc:
+            print("Warning: could not write memory report: {}".format(exc))
+            return
+        self._toast("Memory report written to {}".format(self._memory_report))
+
     def openDir(self):
         if not self._confirm_discard_changes():
             return
@@ -280,43 +839,40 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         if directory:
             self.loadDirectory(directory)
 
-    IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+    IMAGE_EXTS = IMAGE_EXTS
 
     def loadDirectory(self, directory):
-        """Load images from a directory, sorted, case-insensitive on suffix."""
-        files = sorted(
-            str(p)
-            for p in pathlib.Path(directory).iterdir()
-            if p.is_file() and p.suffix.lower() in self.IMAGE_EXTS
-        )
-
-        if not files:
-            print("Warning: No image files found.")
-            return
+        """Load images from a directory, sorted, case-insensitive on suffix.
 
-        self._reset_table()
-        self.filelist = files
-        self._populate_from_filelist()
+        `directory` may also be a .zip/.tar bundle or a pack, or a folder
+        inside one (``bundle.tar::sub-01``), whose members are then read in
+        place.
+        """
+        if self.session.load_directory(directory):
+            self._csv_set = None
+            self._show_session()
 
     def openFiles(self):
         if not self._confirm_discard_changes():
             return
         files, _ = QFileDialog.getOpenFileNames(
-            self, "Select Files", "", ("Images (*.gif *.png *.jpg *.jpeg *.webp)")
+            self, "Select Files", "", ("Images (*.gif *.png *.jpg *.jpeg *.webp *.nii *.nii.gz)")
         )
         if not files:
             return
 
-        self._reset_table()
-        self.filelist = list(files)
-        self._populate_from_filelist()
+        if self.session.load_files(files):
+            self._csv_set = None
+            self._show_session()
 
     def openCSV(self):
         if not self._confirm_discard_changes():
             return
-        path, _ = QFileDialog.getOpenFileName(self, "Open File", "", "CSV(*.csv)")
-        if path:
-            self.loadCSV(path)
+        paths, _ = QFileDialog.getOpenFileNames(self, "Open File", "", "CSV(*.csv)")
+        if len(paths) > 1:
+            self.loadCsvSet(paths)
+        elif paths:
+            self.loadCSV(paths[0])
 
     def loadCSV(self, path):
         """Load images and ratings from a CSV file.
@@ -325,85 +881,164 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         data rows of [path, rating1, rating2, ...]. CSVs without a header row
         are still accepted and assumed to use the default columns.
         """
-        print("Opening CSV file: {}".format(path))
-        with open(path, "r", newline="") as f:
-            reader = csv.reader(f)
-            rows = list(reader)
-
-        if not rows:
-            print("Warning: CSV file is empty.")
+        if self.session.load_csv(path):
+            self._csv_set = None
+            self._show_session(empty_items=True)
+
+    def loadCsvSet(self, paths):
+        """Review several rating CSVs one after another, as one list.
+
+        Moving down past the last row of a CSV, or rating its last cell,
+        opens the next one; moving up from the first row opens the previous
+        one. Each CSV is loaded when the review reaches it and dropped again
+        if it is left unchanged. Save writes every modified CSV back to its
+        own file.
+        """
+        csv_set = CsvSet(paths)
+        session = csv_set.advance(1)
+        if session is None:
+            print("Warning: none of the CSV files has data rows.")
             return
+        self._csv_set = csv_set
+        self._show_csv_session(session)
 
-        if rows[0] and rows[0][0] == "File":
-            column_names = [c for c in rows[0] if c]
-            data_rows = rows[1:]
-        else:
-            n_cols = max(len(r) for r in rows) if rows else 3
-            column_names = ["File"] + [f"Unknown_QC{i}" for i in range(1, n_cols)]
-            data_rows = rows
-
-        # Drop blank lines and rows with no path so filelist length stays in
-        # sync with rowCount; otherwise _write_csv pairs filelist[i] with
-        # the rating cells of a different row.
-        data_rows = [r for r in data_rows if r and r[0]]
-
-        if not data_rows:
-            print("Warning: CSV file has no data rows.")
+    def openArgumentFiles(self, files):
+        if self.session.load_files(files or ()):
+            self._csv_set = None
+            self._show_session()
+
+    def _set_large_table(self, rows):
+        """Turn large-table mode on for tables of more than LARGE_TABLE_ROWS
+        rows, and off again for smaller ones.
+
+        In large-table mode every row has the same fixed height, columns are
+        sized from COLUMN_SIZE_SAMPLE rows around the visible ones, and only
+        the last column stretches, so resizing the window re-lays out one
+        section instead of all of them.
+        """
+        large = rows > LARGE_TABLE_ROWS
+        if large == self._large_table:
             return
+        self._large_table = large
+        header = self.tableWidget.horizontalHeader()
+        row_header = self.tableWidget.verticalHeader()
+        if large:
+            header.setSectionResizeMode(QHeaderView.Interactive)
+            header.setStretchLastSection(True)
+            header.setResizeContentsPrecision(COLUMN_SIZE_SAMPLE)
+            row_header.setSectionResizeMode(QHeaderView.Fixed)
+            row_header.setResizeContentsPrecision(COLUMN_SIZE_SAMPLE)
+        else:
+            header.setSectionResizeMode(QHeaderView.Stretch)
+            header.setStretchLastSection(False)
+            header.setResizeContentsPrecision(self._size_precision)
+            row_header.setSectionResizeMode(QHeaderView.Interactive)
+            row_header.setResizeContentsPrecision(self._size_precision)
+
+    def _resize_columns(self):
+        """Fit the columns to their contents; in large-table mode, to a
+        sample of rows."""
+        self.tableWidget.resizeColumnsToContents()
 
-        self._reset_table()
-        self.path = path
-        self.column_names = column_names
-        self.tableWidget.setColumnCount(len(self.column_names))
-        self.tableWidget.setHorizontalHeaderLabels(self.column_names)
-        self.tableWidget.setRowCount(len(data_rows))
-
-        csv_dir = os.path.dirname(os.path.abspath(path))
-        self.listlocation = len(data_rows) - 1
-        first_unrated_found = False
-
-        for row_idx, rowdata in enumerate(data_rows):
-            file_path = rowdata[0]
-            if not os.path.isabs(file_path):
-                file_path = os.path.normpath(os.path.join(csv_dir, file_path))
-            self.filelist.append(file_path)
+    def _change_column(self, column, insert):
+        """Insert or remove table column `column`, after the session has.
 
-            display = os.path.splitext(os.path.basename(file_path))[0]
-            self.tableWidget.setItem(row_idx, 0, QTableWidgetItem(display))
+        QTableWidget shifts its row-major item array once per row for this,
+        which is quadratic in the size of the table. In large-table mode the
+        items are taken out instead, the column is changed on the empty
+        table and the items are put back, which is linear. The row filter,
+        selection and scroll position are restored afterwards.
+        """
+        table = self.tableWidget
+        change = table.insertColumn if insert else table.removeColumn
+        with self._rating_index_suspended_for_bulk():
+            if not self._large_table:
+                change(column)
+                return
+            rows = table.rowCount()
+            model = table.model()
+            items = []
+            scroll = table.verticalScrollBar().value()
+            with self._table_batch():
+                # The cells only move, so nobody needs to hear about them
+                blocked = model.blockSignals(True)
+                try:
+                    for row in range(rows):
+                        for old in range(table.columnCount()):
+                            item = table.takeItem(row, old)
+                            if item is None or (old == column and not insert):
+                                continue
+                            shifted = old >= column + (not insert)
+                            items.append((row, old + (1 if insert else -1) * shifted, item))
+                finally:
+                    model.blockSignals(blocked)
+                table.setRowCount(0)
+                change(column)
+                table.setRowCount(rows)
+                blocked = model.blockSignals(True)
+                try:
+                    for row, new, item in items:
+                        table.setItem(row, new, item)
+                finally:
+                    model.blockSignals(blocked)
+                if self._row_filter is not None:
+                    self._shown_rows = None  # every row is shown again
+                    self._apply_row_filter(self._row_filter, self._row_filter_label)
+                table.selectRow(self.listlocation)
+            table.verticalScrollBar().setValue(scroll)
+
+    @contextlib.contextmanager
+    def _table_batch(self):
+        """Hold back repaints and header layout while the table is filled
+        or restructured; the view lays itself out once at the end."""
+        table = self.tableWidget
+        table.setUpdatesEnabled(False)
+        try:
+            yield
+        finally:
+            table.setUpdatesEnabled(True)
+
+    def _build_search_index(self):
+        """Start indexing the freshly loaded filelist in the background."""
+        self._search_index = SearchIndex(self.filelist)
+        self._search_index.build_async()
+
+    def focusSearch(self):
+        self.searchEdit.setFocus()
+        self.searchEdit.selectAll()
+
+    def _search(self, start, reverse=False):
+        """Jump to the nearest row matching the search box, starting at
+        `start`. Returns True if a match was found."""
+        if self._search_index is None:
+            return False
+        row = self._search_index.find(self.searchEdit.text(), start, reverse)
+        if row is None:
+            return False
+        self.insert_column = 1
+        self._go_to_row(row)
+        return True
 
-            for column in range(1, len(self.column_names)):
-                val = rowdata[column] if column < len(rowdata) else ""
-                self.tableWidget.setItem(row_idx, column, QTableWidgetItem(val))
+    def _on_search_edited(self, text):
+        if text.strip() and not self._search(self.listlocation):
+            self._toast(f"No match for '{text.strip()}'")
 
-            if not first_unrated_found:
-                for column in range(1, len(self.column_names)):
-                    val = rowdata[column] if column < len(rowdata) else ""
-                    if val == "":
-                        self.listlocation = row_idx
-                        first_unrated_found = True
-                        break
+    def _on_search_return(self):
+        if QApplication.keyboardModifiers() & Qt.ShiftModifier:  # type: ignore[attr-defined]
+            self.findPrevious()
+        else:
+            self.findNext()
 
-        self.tableWidget.resizeColumnsToContents()
-        self._go_to_row(self.listlocation)
+    def findNext(self):
+        self._search(self.listlocation + 1)
 
-    def openArgumentFiles(self, files):
-        if not files:
-            print("Warning: No image files provided.")
-            return
-        self._reset_table()
-        self.filelist = list(files)
-        self._populate_from_filelist()
-
-    def _populate_from_filelist(self):
-        """Render self.filelist into the table and load the first image."""
-        self.tableWidget.setRowCount(len(self.filelist))
-        for i, path in enumerate(self.filelist):
-            display = os.path.splitext(os.path.basename(path))[0]
-            self.tableWidget.setItem(i, 0, QTableWidgetItem(display))
-        self._go_to_row(self.listlocation)
+    def findPrevious(self):
+        self._search(self.listlocation - 1, reverse=True)
 
     def switchToItem(self, row, column):
-        rating_columns = list(range(1, self.tableWidget.columnCount()))
+        if self._recorder is not None:
+            self._recorder.click(row, column)
+        rating_columns = self._rating_columns()
         if column in rating_columns:
             self.insert_column = column
         elif rating_columns:
@@ -411,49 +1046,218 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         self._go_to_row(row)
 
     def undo(self):
-        """Clear the most recently entered rating cell.
+        """Undo the last rating (see Session.undo), and show the row it was
+        entered on."""
+        row = self.listlocation
+        rows = self.session.undo()
+        if len(rows) > 1:
+            self._toast(f"Restored {len(rows)} rows")
+        if self.listlocation != row:
+            self._go_to_row(self.listlocation)
+        self._refresh_status()
 
-        On the first rating column, this means stepping back a row to its
-        last rating column; otherwise it stays on the current row and steps
-        insert_column one slot to the left. No-op at the very first cell.
-        """
-        rating_columns = list(range(1, self.tableWidget.columnCount()))
-        if not rating_columns:
+    def _selected_rows(self):
+        """RowBitmap of the selected rows that are on screen, built from the
+        selection's ranges rather than one index per row."""
+        selected = RowBitmap.from_ranges(
+            (
+                (selected.top(), selected.bottom() + 1)
+                for selected in self.tableWidget.selectionModel().selection()
+            ),
+            self.tableWidget.rowCount(),
+        )
+        if self._shown_rows is not None:
+            selected = selected & self._shown_rows
+        return selected
+
+    def _show_cells(self, column, rows):
+        """Copy the session's `column` cells of `rows` into the table as a
+        single model update: the model's signals are held back while the
+        cells are written, and one dataChanged covering the rows repaints
+        the view. The session has already updated _rating_index."""
+        table = self.tableWidget
+        model = table.model()
+        rows = [row for row in rows if row < table.rowCount()]
+        if not rows or column >= table.columnCount():
             return
-        if self.insert_column not in rating_columns:
-            self.insert_column = rating_columns[0]
-
-        idx = rating_columns.index(self.insert_column)
-        if idx > 0:
-            prev_col = rating_columns[idx - 1]
-            self.tableWidget.setItem(
-                self.listlocation, prev_col, QTableWidgetItem("")
+        with self._rating_index_suspended_for_bulk():
+            blocked = model.blockSignals(True)
+            try:
+                for row in rows:
+                    value = self.session.cell(row, column)
+                    item = table.item(row, column)
+                    if item is None:
+                        table.setItem(row, column, QTableWidgetItem(value))
+                    else:
+                        item.setText(value)
+            finally:
+                model.blockSignals(blocked)
+            model.dataChanged.emit(
+                model.index(min(rows), column), model.index(max(rows), column)
             )
-            self.insert_column = prev_col
-            self._dirty = True
-            self._refresh_status()
-        elif self.listlocation > 0:
-            target_row = self.listlocation - 1
-            last_col = rating_columns[-1]
-            self.tableWidget.setItem(target_row, last_col, QTableWidgetItem(""))
-            self.insert_column = last_col
-            self._dirty = True
-            self._go_to_row(target_row)
+
+    def rateRows(self, rows, value, column=None):
+        """Rate `column` (default: the current rating column) of every row
+        in the RowBitmap `rows` as `value`, undoable as one edit."""
+        rows = list(rows)
+        if self.session.rate_rows(rows, value, column) is None:
+            return
+        self._toast(f"Rated {len(rows)} rows as {value} (. to undo)")
+        self._refresh_status()
+
+    def rateSelectedRows(self, column=None):
+        rows = self._selected_rows()
+        if not rows:
+            self._toast("Select rows in the table first")
+            return
+        value, ok = QInputDialog.getText(
+            self,
+            "Rate Selected Rows",
+            f"Rating for the {len(rows)} selected rows:",
+        )
+        if ok and value.strip():
+            self.rateRows(rows, value.strip(), column)
+
+    @contextlib.contextmanager
+    def _rating_index_suspended_for_bulk(self):
+        """Ignore table change signals while a loader fills the table and
+        feeds _rating_index directly, instead of paying a Python slot call
+        per cell."""
+        self._rating_index_suspended = True
+        try:
+            yield
+        finally:
+            self._rating_index_suspended = False
+
+    def _rebuild_rating_index(self, *_args):
+        if self._rating_index_suspended:
+            return
+        self._clear_row_filter()
+        self._rating_index.reset(
+            self.tableWidget.rowCount(), self.tableWidget.columnCount()
+        )
+        for row in range(self.tableWidget.rowCount()):
+            for column in range(1, self.tableWidget.columnCount()):
+                item = self.tableWidget.item(row, column)
+                if item is not None:
+                    self._rating_index.set(row, column, item.text())
+        self.session.mark_derived_columns()
+
+    def _on_cells_changed(self, top_left, bottom_right, _roles=None):
+        if self._rating_index_suspended:
+            return
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            for column in range(max(top_left.column(), 1), bottom_right.column() + 1):
+                item = self.tableWidget.item(row, column)
+                self._rating_index.set(
+                    row, column, item.text() if item is not None else ""
+                )
+
+    def _on_rows_inserted(self, _parent, first, last):
+        if self._rating_index_suspended:
+            return
+        if first == self._rating_index.row_count:
+            self._rating_index.append_rows(last - first + 1)
+        else:
+            self._rebuild_rating_index()
+
+    def _on_columns_inserted(self, _parent, first, last):
+        if self._rating_index_suspended:
+            return
+        if first == 0:
+            self._rebuild_rating_index()
+            return
+        for column in range(first, last + 1):
+            self._rating_index.insert_column(column)
+        self.session.mark_derived_columns()
+
+    def _on_columns_removed(self, _parent, first, last):
+        if self._rating_index_suspended:
+            return
+        if first == 0:
+            self._rebuild_rating_index()
+            return
+        for column in range(last, first - 1, -1):
+            self._rating_index.remove_column(column)
+
+    def _apply_row_filter(self, rows, label):
+        """Show only the rows in the RowBitmap `rows` (all rows if None).
+
+        `rows` is one of the rating index's live bitmaps and is kept by
+        reference, so the status bar count follows later edits. Navigation
+        uses the rows actually on screen instead, so a row that is re-rated
+        out of the filter stays reachable until the filter is reapplied.
+        Only rows whose visibility changes are touched.
+        """
+        everything = RowBitmap(self.tableWidget.rowCount(), fill=True)
+        old = everything if self._shown_rows is None else self._shown_rows
+        new = everything if rows is None else everything & rows
+        self.tableWidget.setUpdatesEnabled(False)
+        try:
+            for row in new ^ old:
+                self.tableWidget.setRowHidden(row, not (rows is None or row in rows))
+        finally:
+            self.tableWidget.setUpdatesEnabled(True)
+        self._shown_rows = None if rows is None else new
+        self._row_filter = rows
+        self._row_filter_label = label
+
+    def _clear_row_filter(self):
+        if self._shown_rows is not None:
+            self._apply_row_filter(None, "")
+
+    def _set_row_filter(self, rows, label):
+        if not len(rows):
+            self._toast(f"No rows match: {label}")
+            return False
+        self._apply_row_filter(rows, label)
+        if self.listlocation not in rows:
+            row = rows.next(self.listlocation)
+            if row is None:
+                row = rows.prev(self.listlocation)
+            self.insert_column = 1
+            self._go_to_row(row)
+        self._refresh_status()
+        return True
+
+    def clearFilter(self):
+        self._clear_row_filter()
+        self._refresh_status()
+
+    def filterUnrated(self):
+        """Show only rows with at least one empty rating cell."""
+        return self._set_row_filter(self._rating_index.unrated(), "unrated")
+
+    def filterRated(self, column, value):
+        """Show only rows whose rating in `column` equals `value`."""
+        if column <= 0 or column >= len(self.column_names):
+            return False
+        return self._set_row_filter(
+            self._rating_index.rows_with(column, value),
+            f"{self.column_names[column]} = {value}",
+        )
+
+    def showRowsRated(self):
+        choices = []
+        labels = []
+        for column in range(1, len(self.column_names)):
+            counts = self._rating_index.value_counts(column)
+            for value in sorted(v for v in counts if v != ""):
+                choices.append((column, value))
+                labels.append(
+                    f"{self.column_names[column]} = {value}  ({counts[value]} rows)"
+                )
+        if not choices:
+            self._toast("No ratings entered yet")
+            return
+        label, ok = QInputDialog.getItem(
+            self, "Show Rows Rated", "Show rows where:", labels, 0, False
+        )
+        if ok and label in labels:
+            self.filterRated(*choices[labels.index(label)])
 
     def _write_csv(self, path):
-        """Write column_names as the header row, then [path, rating1, ...]."""
-        with open(path, "w", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(self.column_names)
-            for row in range(self.tableWidget.rowCount()):
-                if row >= len(self.filelist):
-                    continue
-                rowdata = [self.filelist[row]]
-                for column in range(1, len(self.column_names)):
-                    item = self.tableWidget.item(row, column)
-                    rowdata.append(item.text() if item is not None else "")
-                writer.writerow(rowdata)
-        self._dirty = False
+        self.session.save(path)
         self._toast(f"Saved {os.path.basename(path)}")
         self._refresh_status()
 
@@ -464,7 +1268,15 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
             self._write_csv(self.path)
 
     def Save(self):
-        if self.path:
+        if self._csv_set is not None:
+            saved = self._csv_set.save()
+            self._toast(
+                "Saved " + ", ".join(os.path.basename(p) for p in saved)
+                if saved
+                else "No changes to save"
+            )
+            self._refresh_status()
+        elif self.path:
             self._write_csv(self.path)
         else:
             self.SaveAs()
@@ -486,6 +1298,14 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
 
         menu = QMenu(self)
 
+        selected = len(self._selected_rows())
+        if local_col > 0 and selected > 1 and not header.underMouse():
+            rate_action = menu.addAction(f"Rate {selected} Selected Rows...")  # type: ignore[assignment]
+            rate_action.triggered.connect(  # type: ignore[union-attr]
+                lambda _checked=False, c=local_col: self.rateSelectedRows(c)
+            )
+            menu.addSeparator()
+
         if local_col > 0:
             add_action = menu.addAction("Add Column")  # type: ignore[assignment]
             add_action.triggered.connect(self.addColumn)  # type: ignore[union-attr]
@@ -502,6 +1322,166 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
 
         menu.exec_(header_pos)
 
+    def prescreen(self, prerate=None):
+        """Screen every image in background processes, writing each verdict
+        (and its statistics, as a tooltip) to the Prescreen column as it
+        arrives. If `prerate` is given, flagged images are pre-rated with it
+        once screening finishes."""
+        if not self.filelist:
+            return
+        self._cancel_prescreen()
+        if PRESCREEN_COLUMN not in self.column_names:
+            self._append_column(PRESCREEN_COLUMN)
+        self._prerate_after_prescreen = prerate
+        self._prescreener = Prescreener(list(enumerate(self.filelist)))
+        self._prescreen_timer.start(200)
+        self._refresh_status()
+
+    def _cancel_prescreen(self):
+        if self._prescreener is not None:
+            self._prescreener.cancel()
+            self._prescreener = None
+        self._prescreen_timer.stop()
+
+    def _collect_prescreen(self):
+        if self._prescreener is None:
+            return
+        results = self._prescreener.results()
+        column = self.column_names.index(PRESCREEN_COLUMN)
+        for row, result in results:
+            item = QTableWidgetItem(result["verdict"])
+            item.setToolTip(prescreen_describe(result))
+            self.tableWidget.setItem(row, column, item)
+        if results:
+            self._dirty = True
+        if self._prescreener.finished:
+            self._prescreener = None
+            self._prescreen_timer.stop()
+            flagged = len(self._flagged_rows())
+            self._toast(f"Prescreen finished: {flagged} images flagged")
+            if self._prerate_after_prescreen is not None:
+                self._prerate_flagged(self._prerate_after_prescreen)
+        self._refresh_status()
+
+    def _flagged_rows(self):
+        """Rows whose prescreen verdict is anything but ok, in order."""
+        if PRESCREEN_COLUMN not in self.column_names:
+            return []
+        column = self.column_names.index(PRESCREEN_COLUMN)
+        flagged = RowBitmap(len(self.filelist))
+        for value in self._rating_index.value_counts(column):
+            if value not in ("", PRESCREEN_OK):
+                flagged = flagged | self._rating_index.rows_with(column, value)
+        return list(flagged)
+
+    def prerateFlagged(self):
+        if PRESCREEN_COLUMN not in self.column_names:
+            self._toast("Run Tools > Prescreen Images first")
+            return
+        value, ok = QInputDialog.getText(
+            self,
+            "Pre-rate Flagged Images",
+            "Rating for every empty cell of the images the prescreen flagged:",
+            text="0",
+        )
+        if ok and value.strip():
+            self._prerate_flagged(value.strip())
+
+    def _prerate_flagged(self, value):
+        """Fill the empty rating cells of flagged rows with `value`."""
+        rows = self._flagged_rows()
+        self.session.fill_empty(rows, value)
+        self._toast(f"Pre-rated {len(rows)} flagged images as {value}")
+        self._refresh_status()
+
+    def findDuplicates(self):
+        """Hash every image in background processes (see dedupe), then
+        label each group of identical or near-identical images in the
+        Duplicate column. Files unchanged since an earlier run are not read
+        again: their hashes come from the hash index."""
+        if not self.filelist:
+            return
+        self._cancel_hashing()
+        self._hash_index = dedupe.HashIndex()
+        self._hashes = {}
+        self._hasher = dedupe.Hasher(
+            [(row, (path, self._hash_index.get(path))) for row, path in enumerate(self.filelist)]
+        )
+        self._hash_timer.start(200)
+        self._refresh_status()
+
+    def _cancel_hashing(self):
+        if self._hasher is not None:
+            self._hasher.cancel()
+            self._hasher = None
+        self._hash_timer.stop()
+
+    def _collect_hashes(self):
+        if self._hasher is None:
+            return
+        for row, result in self._hasher.results():
+            self._hashes[row] = result
+            self._hash_index.update(result)
+        if self._hasher.finished:
+            self._hasher = None
+            self._hash_timer.stop()
+            try:
+                self._hash_index.save()
+            except OSError as exc:
+                print("Warning: could not save the hash index: {}".format(exc))
+            self._label_duplicates()
+        self._refresh_status()
+
+    def _label_duplicates(self):
+        """Write each duplicate group's name ("dup-1", ...) to the
+        Duplicate column of its rows, with the other rows as a tooltip."""
+        n = len(self.filelist)
+        contents = [self._hashes.get(row, {}).get("content") for row in range(n)]
+        perceptuals = [self._hashes.get(row, {}).get("perceptual") for row in range(n)]
+        groups = dedupe.group_duplicates(contents, perceptuals)
+        if not groups and DUPLICATE_COLUMN not in self.column_names:
+            self._toast("No duplicate images found")
+            return
+        if DUPLICATE_COLUMN not in self.column_names:
+            self._append_column(DUPLICATE_COLUMN)
+        column = self.column_names.index(DUPLICATE_COLUMN)
+        values = [""] * n
+        for number, group in enumerate(groups, 1):
+            for row in group:
+                values[row] = f"dup-{number}"
+        self.session.fill_column(column, values)
+        for group in groups:
+            same = "Same file as" if len({contents[row] for row in group}) == 1 else "Looks like"
+            for row in group:
+                others = ", ".join(str(other + 1) for other in group if other != row)
+                self.tableWidget.item(row, column).setToolTip(f"{same} rows {others}")
+        copies = sum(len(group) - 1 for group in groups)
+        self._toast(f"{len(groups)} groups of duplicates: {copies} images need no review")
+
+    def _duplicate_group(self, row):
+        """Rows in the same Duplicate group as `row`, [row] if none."""
+        if DUPLICATE_COLUMN not in self.column_names:
+            return [row]
+        column = self.column_names.index(DUPLICATE_COLUMN)
+        value = self.session.cell(row, column)
+        if not value:
+            return [row]
+        return list(self._rating_index.rows_with(column, value))
+
+    def rateDuplicates(self):
+        """Give the other images of the current row's Duplicate group the
+        current row's ratings, undoable as one edit."""
+        row = self.listlocation
+        group = self._duplicate_group(row)
+        if len(group) < 2:
+            self._toast("No duplicates of this image (see Tools > Find Duplicate Images)")
+            return
+        if not self.session.copy_ratings(row, group):
+            self._toast("Rate this image first")
+            return
+        self._toast(f"Rated {len(group) - 1} duplicates like row {row + 1}")
+        self._refresh_status()
+
     def addColumn(self):
         dialog = QInputDialog(self)
         dialog.setWindowTitle("Add Column")
@@ -520,22 +1500,19 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
                 )
                 return
 
-            self.column_names.append(new_name)
-            self.tableWidget.insertColumn(self.tableWidget.columnCount())
-            header_item = QTableWidgetItem(new_name)
-            header_item.setTextAlignment(Qt.AlignCenter)  # type: ignore[attr-defined]
-            self.tableWidget.setHorizontalHeaderItem(
-                self.tableWidget.columnCount() - 1, header_item
-            )
+            self._append_column(new_name)
 
-            for row in range(self.tableWidget.rowCount()):
-                self.tableWidget.setItem(
-                    row, self.tableWidget.columnCount() - 1, QTableWidgetItem("")
-                )
+    def _append_column(self, name):
+        """Add an empty column called `name` at the right; returns its index."""
+        column = self.session.add_column(name)
+        self._change_column(column, insert=True)
+        header_item = QTableWidgetItem(name)
+        header_item.setTextAlignment(Qt.AlignCenter)  # type: ignore[attr-defined]
+        self.tableWidget.setHorizontalHeaderItem(column, header_item)
 
-            self._dirty = True
-            self.tableWidget.resizeColumnsToContents()
-            self._refresh_status()
+        self._resize_columns()
+        self._refresh_status()
+        return column
 
     def renameColumn(self):
         self._rename_column_at(self.tableWidget.currentColumn())
@@ -556,12 +1533,11 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
             if not new_name:
                 return
 
-            self.column_names[column] = new_name
+            self.session.rename_column(column, new_name)
             header_item = self.tableWidget.horizontalHeaderItem(column)
             if header_item:
                 header_item.setText(new_name)
-            self._dirty = True
-            self.tableWidget.resizeColumnsToContents()
+            self._resize_columns()
             self._refresh_status()
 
     def removeColumn(self):
@@ -580,22 +1556,195 @@ class MainWindow(QMainWindow, window1.Ui_MainWindow):
         )
 
         if reply == QMessageBox.Yes:
-            self.column_names.pop(column)
-            self.tableWidget.removeColumn(column)
-
-            rating_columns = list(range(1, self.tableWidget.columnCount()))
-            if rating_columns and self.insert_column not in rating_columns:
-                self.insert_column = rating_columns[0]
-
-            self._dirty = True
+            self._clear_row_filter()
+            if self.column_names[column] == PRESCREEN_COLUMN:
+                self._cancel_prescreen()
+            self.session.remove_column(column)
+            self._change_column(column, insert=False)
 
             if self.tableWidget.columnCount() > 0:
                 self.tableWidget.setHorizontalHeaderLabels(self.column_names)
-                self.tableWidget.resizeColumnsToContents()
+                self._resize_columns()
             self._refresh_status()
 
 
+def _pack_name(path, base):
+    """Member name for `path` in a pack built from `base`."""
+    if archive.is_member(path):
+        return archive.split_member(path)[1]
+    name = os.path.relpath(path, base)
+    if name.startswith(os.pardir):
+        return os.path.abspath(path).lstrip("/")
+    return name
+
+
+def _read_csv_paths(path):
+    """(header row or None, data rows, absolute image path of each row)."""
+    with open(path, "r", newline="") as f:
+        rows = [r for r in csv.reader(f) if csvformat.is_data_row(r)]
+    header = rows.pop(0) if rows and csvformat.header_columns(rows[0]) else None
+    csv_dir = os.path.dirname(os.path.abspath(path))
+    paths = [csvformat.resolve_path(r[0], csv_dir) for r in rows]
+    return header, rows, paths
+
+
+def pack_main(argv):
+    """`pyqc pack`: bundle a directory's or CSV's images into one pack."""
+    parser = argparse.ArgumentParser(
+        prog="pyqc pack",
+        description="Bundle images into a single memory-mapped .pyqcpack file. "
+        "Packing a CSV also writes a copy of it, next to the pack, whose File "
+        "column points into the pack.",
+    )
+    parser.add_argument(
+        "source", help="Directory (or archive) of images, or a CSV listing them"
+    )
+    parser.add_argument("-o", "--output", required=True, help="Pack file to write")
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        help="Add images missing from an existing pack instead of replacing it",
+    )
+    parser.add_argument(
+        "--preview-size",
+        type=int,
+        metavar="PX",
+        help="Store decoded previews at most PX pixels across instead of the "
+        "original files",
+    )
+    args = parser.parse_args(argv)
+    if args.preview_size is not None and args.preview_size <= 0:
+        parser.error("--preview-size must be positive")
+
+    try:
+        if args.source.lower().endswith(".csv"):
+            header, rows, paths = _read_csv_paths(args.source)
+            base = os.path.dirname(os.path.abspath(args.source))
+        else:
+            rows = None
+            paths = list_images(args.source)
+            base = archive.split_member(args.source)[0]
+        writer = pack.PackWriter(args.output, append=args.append)
+    except (OSError, ValueError) as exc:
+        print("Error: {}".format(exc), file=sys.stderr)
+        return 1
+
+    added = skipped = failed = 0
+    packed = {}
+    with writer:
+        for path in paths:
+            name = _pack_name(path, base)
+            if name in writer:
+                packed[path] = name
+                skipped += 1
+                continue
+            try:
+                if archive.is_member(path):
+                    data = bytes(archive.read_member(path))
+                else:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                if args.preview_size is None:
+                    writer.add(name, data)
+                else:
+                    image = QImage.fromData(data)
+                    if image.isNull():
+                        raise ValueError("not a decodable image")
+                    writer.add(
+                        name, pack.preview_blob(image, args.preview_size), pack.PREVIEW
+                    )
+            except (OSError, ValueError) as exc:
+                print(f"Warning: skipping {path}: {exc}")
+                failed += 1
+                continue
+            packed[path] = name
+            added += 1
+    print(
+        f"Packed {added} images into {args.output}"
+        f" ({skipped} already present, {failed} failed)"
+    )
+
+    if rows is not None:
+        # Rows whose image could not be packed keep pointing at the original
+        csv_out = os.path.splitext(args.output)[0] + ".csv"
+        if os.path.abspath(csv_out) == os.path.abspath(args.source):
+            csv_out = os.path.splitext(args.output)[0] + "-packed.csv"
+        prefix = os.path.basename(args.output) + archive.SEP
+        with open(csv_out, "w", newline="") as f:
+            writer = csv.writer(f)
+            if header is not None:
+                writer.writerow(header)
+            for row, path in zip(rows, paths):
+                if path in packed:
+                    path = prefix + packed[path]
+                writer.writerow([path] + row[1:])
+        print(f"Wrote {csv_out}")
+    return 1 if failed else 0
+
+
+def replay_main(argv):
+    """`pyqc replay`: time a recorded session against an offscreen window."""
+    parser = argparse.ArgumentParser(
+        prog="pyqc replay",
+        description="Replay a trace recorded with --record against an offscreen "
+        "PyQC window, and report how long each kind of event took to handle.",
+    )
+    parser.add_argument("trace", help="Trace file written by --record")
+    parser.add_argument("-c", "--csv", help="CSV file to load first")
+    parser.add_argument("-d", "--directory", help="Directory of images to load first")
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Keep the recorded pace instead of replaying as fast as possible",
+    )
+    parser.add_argument(
+        "--prefetch",
+        choices=PREFETCH_MODES,
+        default="read",
+        help="Read-ahead mode to replay with (default: %(default)s)",
+    )
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of text")
+    args = parser.parse_args(argv)
+    if args.csv and args.directory:
+        parser.error("Cannot specify both --directory and --csv")
+
+    try:
+        events = replay.load(args.trace)
+    except (OSError, ValueError) as exc:
+        print("Error: {}".format(exc), file=sys.stderr)
+        return 1
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    form = MainWindow(prefetch=args.prefetch)
+    form.resize(1280, 800)
+    form.show()
+    if args.csv:
+        form.loadCSV(args.csv)
+    elif args.directory:
+        form.loadDirectory(args.directory)
+    app.processEvents()
+
+    summary = replay.summarize(replay.run(app, form, events, realtime=args.realtime))
+    form._dirty = False  # never save what the replay rated
+    form.close()
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(replay.format_summary(summary))
+    return 0
+
+
 def main():
+    if sys.argv[1:2] == ["pack"]:
+        sys.exit(pack_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["replay"]:
+        sys.exit(replay_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["stats"]:
+        sys.exit(stats.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["serve"]:
+        sys.exit(serve.main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser(
         description="PyQC - A tool for reviewing QC images and storing ratings",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -604,29 +1753,142 @@ Keyboard Shortcuts:
   0-9    Assign rating to current image (alternates between QC_Raw and QC_Pre)
   W / /  Navigate up without rating
   S / *  Navigate down without rating
+  N / P  Jump to the next / previous unrated row
   .      Undo - clear the most recently entered rating cell
   +/-    Zoom in/out
+  O      In compare mode, cycle overlays of the first two images: blend,
+         checkerboard, difference, off
+  [ / ]  Decrease/increase the blend of the overlay
+  A      Toggle auto-contrast (right-drag on the image adjusts window/level)
+  R      Reset window/level
+  Ctrl+F Search file names and directories; Enter / Shift+Enter jump to the next / previous match
+  Ctrl+D Give the current image's duplicates the same ratings (see Tools > Find Duplicate Images)
 
 Examples:
   pyqc image1.jpg image2.png
   pyqc --directory /path/to/images
+  pyqc --directory bundle.tar::sub-01
+  pyqc pack /path/to/images -o qc.pyqcpack   (see: pyqc pack --help)
+  pyqc stats rater1.csv rater2.csv           (see: pyqc stats --help)
+  pyqc --csv ratings.csv --record trace.jsonl
+  pyqc replay trace.jsonl --csv ratings.csv  (see: pyqc replay --help)
+  pyqc serve --csv ratings.csv               (see: pyqc serve --help)
   pyqc --csv ratings.csv
         """,
     )
     parser.add_argument(
         "files",
         nargs="*",
-        help="Image files to review (supports: jpg, png, gif, webp, jpeg)",
+        help="Image files to review (supports: jpg, png, gif, webp, jpeg, nii, nii.gz)",
     )
     parser.add_argument(
         "-d",
         "--directory",
-        help="Directory containing images to review",
+        help="Directory, or .zip/.tar bundle, containing images to review",
     )
     parser.add_argument(
         "-c",
         "--csv",
-        help="CSV file to load (resumes from first unrated image)",
+        action="append",
+        help="CSV file to load (resumes from first unrated image); repeat "
+        "the option, or pass a quoted glob such as 'site*/ratings.csv', to "
+        "review several one after another",
+    )
+    parser.add_argument(
+        "--prefetch",
+        choices=PREFETCH_MODES,
+        default="read",
+        help="Read-ahead of upcoming files: read them into memory (default), "
+        "only hint the kernel's page cache (fadvise), or off",
+    )
+    parser.add_argument(
+        "--compare",
+        action="append",
+        type=compare.parse_rule,
+        default=[],
+        metavar="OLD=NEW",
+        help="Also show the file whose path has OLD replaced by NEW, in a linked "
+        "viewer; repeat for more viewers (e.g. --compare _raw=_pre)",
+    )
+    parser.add_argument(
+        "--decoder",
+        choices=decoders.CHOICES,
+        default="auto",
+        help="Still-image decoder: QImageReader in-process (qt), Pillow in "
+        "worker processes (pillow), or Pillow returning pixels through shared "
+        "memory (shm). auto (default) times each on a sample at startup",
+    )
+    parser.add_argument(
+        "--shared-cache",
+        nargs="?",
+        const="",
+        metavar="DIR",
+        help="Share decoded images with other PyQC processes on this machine "
+        "through DIR (default: a per-user directory in /dev/shm)",
+    )
+    parser.add_argument(
+        "--shared-cache-budget",
+        type=int,
+        default=shared_cache.DEFAULT_BUDGET // (1024 * 1024),
+        metavar="MB",
+        help="Total size of the shared cache, across all processes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--prescreen",
+        action="store_true",
+        help="Flag unreadable, blank and truncated images in the background "
+        "after loading (see Tools > Prescreen Images)",
+    )
+    parser.add_argument(
+        "--prerate",
+        metavar="RATING",
+        help="With --prescreen, rate flagged images RATING once screening ends",
+    )
+    parser.add_argument(
+        "--find-duplicates",
+        action="store_true",
+        help="Group identical and near-identical images in the background "
+        "after loading (see Tools > Find Duplicate Images)",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="TRACE",
+        help="Log key presses, wheel turns and table clicks to TRACE (JSON lines) "
+        "for pyqc replay",
+    )
+    parser.add_argument(
+        "--watchdog",
+        nargs="?",
+        const="pyqc-stalls.txt",
+        metavar="REPORT",
+        help="Record where the GUI freezes, and write a report to REPORT "
+        "(default: pyqc-stalls.txt) on exit or with Tools > Write Stall Report",
+    )
+    parser.add_argument(
+        "--stall-ms",
+        type=int,
+        default=int(STALL_THRESHOLD * 1000),
+        metavar="MS",
+        help="With --watchdog, the shortest freeze to record (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        metavar="MB",
+        help="Release cached images to keep PyQC's counted memory under MB "
+        "(the total is shown in the status bar)",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Record Python allocations with tracemalloc, and list the top "
+        "allocation sites in Tools > Write Memory Report",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the session with cProfile, and print the slowest calls "
+        "and the memory counters to stderr on exit",
     )
     parser.add_argument(
         "--version",
@@ -654,8 +1916,27 @@ Examples:
         parser.error("Cannot specify both --directory and file arguments")
     if args.csv and args.files:
         parser.error("Cannot specify both --csv and file arguments")
-
-    form = MainWindow()
+    try:
+        decoder = decoders.create(args.decoder)
+    except (OSError, ValueError) as exc:
+        parser.error("--decoder {}: {}".format(args.decoder, exc))
+
+    if args.trace_memory:
+        memory.start_tracing()
+    form = MainWindow(prefetch=args.prefetch)
+    if args.memory_budget is not None:
+        form.setMemoryBudget(args.memory_budget * memory.MB)
+    if args.watchdog:
+        form.watchForStalls(args.watchdog, args.stall_ms / 1000)
+    if args.record:
+        form.recordTo(args.record)
+    form.label.decoder = decoder
+    if args.shared_cache is not None:
+        form.label.shared_cache = shared_cache.SharedImageCache(
+            args.shared_cache or None, args.shared_cache_budget * 1024 * 1024
+        )
+    if args.compare:
+        form.setCompareRules(args.compare)
 
     # Load files based on arguments
     if args.files:
@@ -663,10 +1944,24 @@ Examples:
     elif args.directory:
         form.loadDirectory(args.directory)
     elif args.csv:
-        form.loadCSV(args.csv)
+        paths = expand_csv_paths(args.csv)
+        if len(paths) > 1:
+            form.loadCsvSet(paths)
+        else:
+            form.loadCSV(paths[0])
+    if args.prescreen or args.prerate:
+        form.prescreen(prerate=args.prerate)
+    if args.find_duplicates:
+        form.findDuplicates()
 
     form.show()
-    sys.exit(app.exec_())
+    if not args.profile:
+        sys.exit(app.exec_())
+    profiler = cProfile.Profile()
+    status = profiler.runcall(app.exec_)
+    pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(PROFILE_TOP)
+    print(form.memory.report(), file=sys.stderr)
+    sys.exit(status)
 
 
 if __name__ == "__main__":
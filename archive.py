@@ -0,0 +1,193 @@
+"""Read images straight out of tar and zip bundles.
+
+A bundle member is addressed as ``<archive>::<member>``, e.g.
+``bundle.tar::sub-01/qc.png``, anywhere PyQC takes an image path. The first
+time a bundle is opened, the offset and size of every member's data are
+written to an index under the cache directory. From then on, reading a
+member takes one seek and one read, and nothing is extracted to disk.
+
+Tarballs must be uncompressed (a .tar.gz cannot be seeked into). Zip members
+may be stored or deflated; deflated ones are inflated in memory. PyQC packs
+(see pack.py) are addressed the same way.
+"""
+
+import functools
+import json
+import os
+import struct
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+
+import cache_paths
+import pack
+
+SEP = "::"
+ARCHIVE_EXTS = (".zip", ".tar", pack.PACK_EXT)
+
+
+def is_archive(path):
+    return str(path).lower().endswith(ARCHIVE_EXTS)
+
+
+def is_member(path):
+    """True for ``<archive>::<member>`` paths."""
+    archive, sep, _ = str(path).partition(SEP)
+    return bool(sep) and is_archive(archive)
+
+
+def split_member(path):
+    archive, _, member = str(path).partition(SEP)
+    return archive, member
+
+
+def member_path(archive, member):
+    return archive + SEP + member
+
+
+def _scan_zip(path):
+    try:
+        with open(path, "rb") as f, zipfile.ZipFile(f) as zf:
+            return _zip_members(path, f, zf)
+    except zipfile.BadZipFile as exc:
+        raise ValueError("{}: not a valid zip file ({})".format(path, exc)) from None
+
+
+def _zip_members(path, f, zf):
+    members = {}
+    for info in zf.infolist():
+        if info.is_dir() or info.flag_bits & 0x1:  # skip encrypted
+            continue
+        # The data starts after the *local* header, whose extra field may
+        # differ from the central directory's copy.
+        f.seek(info.header_offset)
+        header = f.read(30)
+        if len(header) < 30 or header[:4] != b"PK\x03\x04":
+            raise ValueError("{}: bad header for {}".format(path, info.filename))
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        offset = info.header_offset + 30 + name_len + extra_len
+        members[info.filename] = [offset, info.compress_size, info.compress_type]
+    return members
+
+
+def _scan_tar(path):
+    try:
+        with tarfile.open(path, "r:") as tf:
+            return {
+                m.name[2:] if m.name.startswith("./") else m.name: [
+                    m.offset_data,
+                    m.size,
+                    zipfile.ZIP_STORED,
+                ]
+                for m in tf
+                if m.isfile()
+            }
+    except tarfile.TarError as exc:
+        raise ValueError("{}: not an uncompressed tar file ({})".format(path, exc))
+
+
+class MemberIndex:
+    """Member name -> (data offset, stored size, compression) for one archive."""
+
+    def __init__(self, path, members):
+        self.path = path
+        self._members = members
+        self._file = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        """Load the persisted index for `path`, building it on first use."""
+        index_path = os.path.join(
+            cache_paths.cache_dir("archives"), cache_paths.source_key(path) + ".json"
+        )
+        try:
+            with open(index_path, encoding="utf-8") as f:
+                members = json.load(f)
+        except (OSError, ValueError):
+            members = _scan_zip(path) if path.lower().endswith(".zip") else _scan_tar(path)
+            _write_index(index_path, members)
+        return cls(path, members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __contains__(self, member):
+        return member in self._members
+
+    def names(self):
+        return self._members.keys()
+
+    def read(self, member):
+        """The decoded bytes of `member`."""
+        entry = self._members.get(member)
+        if entry is None:
+            raise FileNotFoundError("{}: no member {!r}".format(self.path, member))
+        offset, size, method = entry
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "rb")
+            self._file.seek(offset)
+            data = self._file.read(size)
+        if len(data) != size:
+            raise OSError("{}: {!r} is truncated".format(self.path, member))
+        if method == zipfile.ZIP_DEFLATED:
+            try:
+                return zlib.decompress(data, -15)
+            except zlib.error as exc:
+                raise ValueError(
+                    "{}: {!r} is corrupt ({})".format(self.path, member, exc)
+                ) from None
+        if method != zipfile.ZIP_STORED:
+            raise ValueError(
+                "{}: unsupported compression for {!r}".format(self.path, member)
+            )
+        return data
+
+
+def _write_index(index_path, members):
+    """Persist `members`; failing to is only a missed optimization."""
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(index_path), suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(members, f, separators=(",", ":"))
+        os.replace(tmp, index_path)
+    except OSError as exc:
+        print("Warning: could not save archive index: {}".format(exc))
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_index(path, _size, _mtime_ns):
+    return MemberIndex.open(path)
+
+
+def index(path):
+    """The MemberIndex (or PackReader) for the archive at `path`, kept open
+    for reuse."""
+    if pack.is_pack(path):
+        return pack.open_pack(path)
+    st = os.stat(path)
+    return _cached_index(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def read_member(path):
+    """Bytes of the ``<archive>::<member>`` at `path`."""
+    archive, member = split_member(path)
+    return index(archive).read(member)
+
+
+def list_members(path, exts):
+    """Sorted member paths under an archive, or under ``<archive>::<dir>``,
+    whose names end with one of `exts` (case-insensitive)."""
+    archive, _, prefix = str(path).partition(SEP)
+    prefix = prefix.strip("/")
+    if prefix:
+        prefix += "/"
+    return sorted(
+        member_path(archive, name)
+        for name in index(archive).names()
+        if name.startswith(prefix) and name.lower().endswith(exts)
+    )
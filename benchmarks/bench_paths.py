@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Compare the memory footprint of a plain list of paths with PathStore.
+
+Usage: python benchmarks/bench_paths.py [--rows N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pathstore import PathStore  # noqa: E402
+
+
+def bids_paths(n_rows):
+    """Synthetic BIDS-style QC paths: 10 runs per subject, shared roots."""
+    for i in range(n_rows):
+        sub = f"sub-{i // 10:07d}"
+        yield f"/project/derivatives/qc/{sub}/ses-01/anat/{sub}_run-{i % 10}_T1w_qc.jpg"
+
+
+def list_nbytes(paths, display_names):
+    total = sys.getsizeof(paths) + sum(sys.getsizeof(p) for p in paths)
+    total += sys.getsizeof(display_names)
+    total += sum(sys.getsizeof(d) for d in display_names)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = list(bids_paths(args.rows))
+    display_names = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+    list_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = PathStore(bids_paths(args.rows))
+    store_time = time.perf_counter() - start
+    assert store == paths
+
+    print(f"rows: {args.rows}")
+    print(
+        f"list[str] + display names: {list_nbytes(paths, display_names) / 1e6:8.1f} MB"
+        f"  (built in {list_time:.2f}s)"
+    )
+    print(
+        f"PathStore:                 {store.nbytes() / 1e6:8.1f} MB"
+        f"  (built in {store_time:.2f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
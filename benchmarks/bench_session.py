@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Time the rating keys on a headless Session and through MainWindow.
+
+Rates every cell of a synthetic session, then undoes every rating. The
+window run is offscreen and loads no images, so the difference is the cost
+of the widgets themselves.
+
+Usage: python benchmarks/bench_session.py [--rows N] [--no-window]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session import Session  # noqa: E402
+
+
+def paths(n_rows):
+    return [f"/project/qc/sub-{i:07d}/anat/sub-{i:07d}_T1w_qc.jpg" for i in range(n_rows)]
+
+
+def drive(rate, undo, n_rows):
+    """Seconds to rate both columns of every row, then undo it all."""
+    start = time.perf_counter()
+    for i in range(n_rows):
+        rate(str(i % 3))
+        rate(str(i % 2))
+    for _ in range(2 * n_rows):
+        undo()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--no-window", action="store_true")
+    args = parser.parse_args()
+
+    session = Session()
+    session.load_files(paths(args.rows))
+    elapsed = drive(session.rate, session.undo, args.rows)
+    per_key = elapsed / (4 * args.rows)
+    print(f"Session:    {per_key * 1e6:9.1f} us per key")
+    if args.no_window:
+        return
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+
+    import PyQC
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])  # noqa: F841
+    window = PyQC.MainWindow(prefetch="off")
+    window.label.load = lambda path: None  # time the table, not decoding
+    window.openArgumentFiles(paths(args.rows))
+    elapsed = drive(window.numpress, window.undo, args.rows)
+    window_per_key = elapsed / (4 * args.rows)
+    print(
+        f"MainWindow: {window_per_key * 1e6:9.1f} us per key"
+        f"  ({window_per_key / per_key:.0f}x)"
+    )
+    window._dirty = False
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""Location of PyQC's on-disk caches."""
+
+import hashlib
+import os
+
+
+def cache_dir(name):
+    """Directory for the `name` cache: $PYQC_CACHE_DIR/`name`, or
+    pyqc/`name` under $XDG_CACHE_HOME (~/.cache by default)."""
+    base = os.environ.get("PYQC_CACHE_DIR")
+    if not base:
+        xdg = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        base = os.path.join(xdg, "pyqc")
+    return os.path.join(base, name)
+
+
+def source_key(path):
+    """Cache file stem for `path`, keyed on its absolute path, size and
+    mtime so a file that changes gets a fresh cache entry."""
+    st = os.stat(path)
+    key = "{}\0{}\0{}".format(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    return hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
@@ -0,0 +1,32 @@
+"""Find the files to show next to a row's image in compare mode.
+
+A rule ``OLD=NEW`` names a row's sibling by replacing the last occurrence
+of OLD in its path with NEW: with ``_raw=_pre``, ``sub-01_raw.png`` is shown
+next to ``sub-01_pre.png``. Each rule adds one viewer.
+"""
+
+
+def parse_rule(text):
+    """(old, new) from ``OLD=NEW``; raises ValueError if malformed."""
+    old, sep, new = text.partition("=")
+    if not sep or not old:
+        raise ValueError("compare rule must look like OLD=NEW, not {!r}".format(text))
+    return old, new
+
+
+def parse_rules(text):
+    """Rules from a comma-separated ``OLD=NEW,OLD=NEW`` string."""
+    return [parse_rule(part.strip()) for part in text.split(",") if part.strip()]
+
+
+def format_rules(rules):
+    return ",".join("{}={}".format(old, new) for old, new in rules)
+
+
+def sibling(path, rule):
+    """`path` with the rule applied, or None if it doesn't match."""
+    old, new = rule
+    head, sep, tail = str(path).rpartition(old)
+    if not sep:
+        return None
+    return head + new + tail
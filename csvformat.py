@@ -0,0 +1,39 @@
+"""Rules for reading PyQC rating CSVs, shared by the GUI and the CLI tools.
+
+A rating CSV has a header row whose first cell is "File", followed by data
+rows of [path, rating1, rating2, ...]. Headerless files are accepted too;
+their rating columns are named Unknown_QC1, Unknown_QC2, ... after the
+longest row. Relative paths are relative to the CSV's own directory.
+"""
+
+import os
+
+
+def header_columns(row):
+    """Column names if `row` is a header row, else None. Empty header
+    cells are dropped."""
+    if row and row[0] == "File":
+        return [c for c in row if c]
+    return None
+
+
+def unknown_columns(n_cols):
+    """Column names for a headerless CSV whose longest row has `n_cols`."""
+    return ["File"] + [f"Unknown_QC{i}" for i in range(1, n_cols)]
+
+
+def is_data_row(row):
+    """Blank lines and rows with no path are skipped."""
+    return bool(row and row[0])
+
+
+def resolve_path(path, csv_dir):
+    """Anchor a relative image path to the CSV's directory."""
+    if os.path.isabs(path):
+        return path
+    return os.path.normpath(os.path.join(csv_dir, path))
+
+
+def cell(row, column):
+    """Rating in `column` of `row`, "" if the row is short."""
+    return row[column] if column < len(row) else ""
@@ -0,0 +1,371 @@
+"""Interchangeable still-image decoders for SaneDefaultsImageLabel.
+
+    qt      QImageReader in the GUI process (what the label does on its own)
+    pillow  Pillow (libjpeg-turbo for JPEG) in a pool of worker processes;
+            the pixels are pickled back to the GUI process
+    shm     the same workers, but the pixels come back through a file on
+            tmpfs that the GUI process maps and wraps without copying
+
+The worker backends can start() decoding a file and finish() it later,
+which returns the image without waiting if the workers are done. The
+window starts the images of the rows ahead of the rater this way (see
+SaneDefaultsImageLabel.predecode), so they decode in other processes while
+the GUI process runs, off its GIL. decode() is start() and finish() in
+one call, and waits.
+
+Whether the worker processes pay for the round trip depends on the machine,
+so "auto" times each available backend on a sample JPEG, on a background
+thread, the first time PyQC starts on a machine. It decodes with Qt until
+the benchmark finishes, and uses the fastest backend from then on.
+
+A decoder's decode() returns a null QImage when it can't handle a file; the
+label then falls back to QImageReader, which also does animations.
+"""
+
+import concurrent.futures
+import hashlib
+import io
+import mmap
+import multiprocessing
+import os
+import platform
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PyQt5.QtCore import QT_VERSION_STR, QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QImage, QImageReader
+
+import cache_paths
+import shared_cache
+from imageops import array_to_qimage
+
+try:
+    import PIL.Image
+except ImportError:  # optional: pip install pillow
+    PIL = None
+
+BACKENDS = ("qt", "pillow", "shm")
+CHOICES = ("auto",) + BACKENDS
+
+_FORMATS = {
+    "L": QImage.Format_Grayscale8,
+    "I;16": QImage.Format_Grayscale16,
+}
+
+
+def available():
+    """Backends usable in this environment."""
+    return BACKENDS if PIL is not None else ("qt",)
+
+
+class QtDecoder:
+    """QImageReader, in the calling thread."""
+
+    name = "qt"
+
+    def decode(self, source, data=None):
+        """(image, error) for the file `source`, or for its bytes `data`."""
+        if data is None:
+            reader = QImageReader(source)
+        else:
+            device = QBuffer()
+            device.setData(data)
+            device.open(QIODevice.ReadOnly)
+            reader = QImageReader(device)
+        image = reader.read()
+        return image, reader.errorString()
+
+    def close(self):
+        pass
+
+
+def _pixels(source, data):
+    """(width, height, mode, raw bytes) of an image, decoded with Pillow
+    into a layout QImage can wrap: 8/16-bit gray or BGRA."""
+    with PIL.Image.open(io.BytesIO(data) if data is not None else source) as im:
+        if im.mode not in _FORMATS:
+            im = im.convert("RGBA")
+            return im.width, im.height, "RGBA", im.tobytes("raw", "BGRA")
+        return im.width, im.height, im.mode, im.tobytes()
+
+
+def _decode_pickled(source, data):
+    try:
+        return _pixels(source, data)
+    except Exception as exc:  # anything Pillow can't read goes back to Qt
+        return str(exc) or type(exc).__name__
+
+
+def _decode_to_file(source, data, directory):
+    """Like _decode_pickled, but writes the pixels to a new file in
+    `directory` and returns its path in place of the bytes."""
+    result = _decode_pickled(source, data)
+    if isinstance(result, str):
+        return result
+    width, height, mode, raw = result
+    fd, path = tempfile.mkstemp(dir=directory, suffix=".px")
+    with os.fdopen(fd, "wb") as f:
+        f.write(raw)
+    return width, height, mode, path
+
+
+def _wrap(width, height, mode, buffer):
+    if mode == "RGBA":
+        array = np.frombuffer(buffer, np.uint8, count=width * height * 4)
+        return array_to_qimage(array.reshape(height, width, 4))
+    dtype = np.uint16 if mode == "I;16" else np.uint8
+    array = np.frombuffer(buffer, dtype, count=width * height)
+    return array_to_qimage(array.reshape(height, width), _FORMATS[mode])
+
+
+class PillowDecoder:
+    """Pillow in worker processes, started on first use."""
+
+    name = "pillow"
+
+    def __init__(self, workers=2):
+        if PIL is None:
+            raise ValueError("the {} decoder needs Pillow".format(self.name))
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()  # decode() may be called from threads
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._pool is None:
+                # Spawned rather than forked, so workers don't copy the GUI
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool.submit(fn, *args)
+
+    def start(self, source, data=None):
+        """Start decoding in a worker process; returns a job for finish()
+        or discard()."""
+        return self._submit(_decode_pickled, source, data)
+
+    def finish(self, job):
+        """(image, error) of a start()ed job, waiting for it if need be."""
+        result = job.result()
+        if isinstance(result, str):
+            return QImage(), result
+        width, height, mode, raw = result
+        return _wrap(width, height, mode, raw), ""
+
+    def discard(self, job):
+        """Give up on a start()ed job."""
+        job.cancel()
+
+    def decode(self, source, data=None):
+        return self.finish(self.start(source, data))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class SharedMemoryDecoder(PillowDecoder):
+    """Pillow in worker processes, pixels handed over through tmpfs."""
+
+    name = "shm"
+
+    def __init__(self, workers=2, directory=None):
+        super().__init__(workers)
+        if directory is None:
+            base = shared_cache.private_dir(shared_cache.default_dir())
+            directory = shared_cache.private_dir(os.path.join(base, "decode"))
+        else:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.directory = directory
+
+    def start(self, source, data=None):
+        return self._submit(_decode_to_file, source, data, self.directory)
+
+    def finish(self, job):
+        result = job.result()
+        if isinstance(result, str):
+            return QImage(), result
+        width, height, mode, path = result
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            os.unlink(path)  # the mapping stays valid until it is dropped
+        return _wrap(width, height, mode, mapped), ""
+
+    def discard(self, job):
+        if not job.cancel():
+            job.add_done_callback(self._remove_pixels)
+
+    @staticmethod
+    def _remove_pixels(job):
+        """Delete the pixel file of a job nobody will finish()."""
+        if job.cancelled() or job.exception() is not None:
+            return
+        result = job.result()
+        if not isinstance(result, str):
+            try:
+                os.unlink(result[3])
+            except OSError:
+                pass
+
+
+class AutoDecoder:
+    """QtDecoder while a background thread finds the fastest backend, then
+    that backend (and its choice saved to `path`)."""
+
+    name = "auto"
+
+    def __init__(self, path):
+        self._decoder = QtDecoder()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._choose, args=(path,), name="pyqc-decoder-benchmark", daemon=True
+        )
+        self._thread.start()
+
+    def _choose(self, path):
+        decoder = _fastest()
+        _remember(path, decoder.name)
+        with self._lock:
+            if self._closed:
+                decoder.close()
+            else:
+                self._decoder = decoder
+
+    def wait(self, timeout=None):
+        """Block until the benchmark is done (for tests)."""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    @property
+    def chosen(self):
+        """The backend in use: "qt" until the benchmark is done."""
+        return self._decoder.name
+
+    def decode(self, source, data=None):
+        return self._decoder.decode(source, data)
+
+    def start(self, source, data=None):
+        """A job of the current backend, or None if it can't start one."""
+        decoder = self._decoder
+        if not hasattr(decoder, "start"):
+            return None
+        return decoder, decoder.start(source, data)
+
+    def finish(self, job):
+        decoder, job = job
+        return decoder.finish(job)
+
+    def discard(self, job):
+        decoder, job = job
+        decoder.discard(job)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._decoder.close()
+
+
+_CLASSES = {cls.name: cls for cls in (QtDecoder, PillowDecoder, SharedMemoryDecoder)}
+
+
+def sample_jpeg(width=1024, height=768):
+    """Encoded JPEG bytes of a noisy gradient, for benchmarking."""
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 200, width, dtype=np.float32)
+    pixels = gradient + rng.normal(0, 20, (height, width, 3)).transpose(2, 0, 1)
+    bgr = np.clip(pixels, 0, 255).astype(np.uint8).transpose(1, 2, 0)
+    bgra = np.concatenate([bgr, np.full((height, width, 1), 255, np.uint8)], axis=2)
+    image = array_to_qimage(bgra, QImage.Format_RGB32)
+    encoded = QByteArray()
+    device = QBuffer(encoded)
+    device.open(QIODevice.WriteOnly)
+    image.save(device, "JPEG", 90)
+    return bytes(encoded)
+
+
+def _best_time(decoder, data, rounds, clock):
+    """Best of `rounds` decodes of `data`, or None if it can't decode it.
+    The first decode also warms up the decoder's worker pool."""
+    if decoder.decode("", data)[0].isNull():
+        return None
+    best = float("inf")
+    for _ in range(rounds):
+        start = clock()
+        decoder.decode("", data)
+        best = min(best, clock() - start)
+    return best
+
+
+def benchmark(names=None, data=None, rounds=5, clock=time.perf_counter):
+    """{backend name: best decode time in seconds} over `rounds` decodes of
+    `data` (default: sample_jpeg())."""
+    data = sample_jpeg() if data is None else data
+    timings = {}
+    for name in names or available():
+        decoder = _CLASSES[name]()
+        try:
+            elapsed = _best_time(decoder, data, rounds, clock)
+        finally:
+            decoder.close()
+        if elapsed is not None:
+            timings[name] = elapsed
+    return timings
+
+
+def _choice_path():
+    """Where "auto" remembers its pick for this machine and these libraries."""
+    key = "{}\0{}\0{}\0{}".format(
+        platform.node(), os.cpu_count(), QT_VERSION_STR, getattr(PIL, "__version__", "")
+    )
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(cache_paths.cache_dir("decoders"), digest)
+
+
+def _fastest():
+    """The decoder that decodes a sample JPEG fastest here, warmed up."""
+    data = sample_jpeg()
+    best, best_time = None, float("inf")
+    for name in available():
+        decoder = _CLASSES[name]()
+        elapsed = _best_time(decoder, data, 3, time.perf_counter)
+        if elapsed is not None and elapsed < best_time:
+            if best is not None:
+                best.close()
+            best, best_time = decoder, elapsed
+        else:
+            decoder.close()
+    return best or QtDecoder()
+
+
+def _remember(path, name):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(name)
+    except OSError as exc:
+        print("Warning: could not save decoder choice: {}".format(exc))
+
+
+def create(name="auto"):
+    """The decoder called `name`. "auto" is the backend remembered for this
+    machine, or, the first time, an AutoDecoder that benchmarks them in the
+    background and remembers the winner in the cache."""
+    if name != "auto":
+        if name not in _CLASSES:
+            raise ValueError("unknown decoder {!r}".format(name))
+        return _CLASSES[name]()
+    path = _choice_path()
+    try:
+        with open(path, encoding="utf-8") as f:
+            remembered = f.read().strip()
+        if remembered in available():
+            return _CLASSES[remembered]()
+    except OSError:
+        pass
+    return AutoDecoder(path)
@@ -0,0 +1,266 @@
+"""Find duplicate and near-identical QC images.
+
+Pipeline re-runs often write the same QC image again under a new path.
+Each file gets two hashes:
+
+    content     BLAKE2b of its bytes: equal only for byte-identical files
+    perceptual  a 64-bit difference hash ("dHash") of its pixels: each bit
+                says whether a cell of a 9 x 8 grid of averages is brighter
+                than its right-hand neighbour, so re-encoded or re-rendered
+                copies of one image differ in a few bits at most
+
+The perceptual hash is computed from a reduced-size decode (libjpeg scales
+JPEGs while decoding), averaged down to the grid with NumPy. Images the
+prescreen would call blank get none: every flat image hashes to 0 (or to
+noise), whatever it was meant to show. Hasher runs
+hash_batch() over a session's files in the prescreen's worker processes.
+HashIndex remembers every hash with the size and mtime of the file it came
+from, so unchanged files are not read again on the next run.
+
+group_duplicates() joins files with the same content hash, or perceptual
+hashes at most `max_distance` bits from the first image of their group,
+into groups.
+"""
+
+import collections
+import hashlib
+import itertools
+import json
+import math
+import os
+
+import numpy as np
+from PyQt5.QtCore import QSize, Qt
+from PyQt5.QtGui import QImage, QImageReader
+
+import archive
+import cache_paths
+import nifti
+from imageops import qimage_view
+from prescreen import BLANK_FRACTION, BLANK_STD, Prescreener, read_image
+
+GRID_WIDTH, GRID_HEIGHT = 9, 8
+# Decoded size: every grid cell averages CELL x CELL pixels
+CELL = 16
+# Perceptual hashes this many bits apart or fewer count as the same image
+MAX_DISTANCE = 3
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+def _popcount(values):
+    """Set bits of each uint64 in `values`."""
+    if hasattr(np, "bitwise_count"):  # NumPy 2
+        return np.bitwise_count(values)
+    return _POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _stat(path):
+    """os.stat of `path`, or of the archive holding it."""
+    return os.stat(archive.split_member(path)[0] if archive.is_member(path) else path)
+
+
+def content_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    if archive.is_member(path):
+        digest.update(archive.read_member(path))
+    else:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _small_grayscale(path):
+    """Pixels of `path` as (GRID_HEIGHT * CELL, GRID_WIDTH * CELL) uint8."""
+    size = QSize(GRID_WIDTH * CELL, GRID_HEIGHT * CELL)
+    if archive.is_member(path) or nifti.is_nifti(path):
+        image = read_image(path)
+    else:
+        reader = QImageReader(path)
+        reader.setScaledSize(size)
+        image = reader.read()
+        if image.isNull():
+            raise ValueError(reader.errorString())
+    if image.size() != size:
+        image = image.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    return qimage_view(image.convertToFormat(QImage.Format_Grayscale8)).copy()
+
+
+def _is_flat(pixels):
+    """Whether uint8 `pixels` are blank by the prescreen's measures."""
+    values = pixels.ravel()
+    most_common = np.bincount(values, minlength=256).max()
+    return most_common >= BLANK_FRACTION * values.size or values.std() < BLANK_STD
+
+
+def perceptual_hash(path):
+    """64-bit dHash of the image at `path`, as an int, or None for a flat
+    image. Raises OSError or ValueError if it does not decode."""
+    pixels = _small_grayscale(path)
+    if _is_flat(pixels):
+        return None
+    pixels = pixels.astype(np.uint32)
+    grid = pixels.reshape(GRID_HEIGHT, CELL, GRID_WIDTH, CELL).sum(axis=(1, 3))
+    bits = (grid[:, 1:] > grid[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_file(path, known=None):
+    """{"path", "size", "mtime", "content", "perceptual"} for `path`, with
+    None for a hash that could not be computed (and an "error"), or for
+    the perceptual hash of a flat image. `known` is a HashIndex entry,
+    reused if the file has not changed since."""
+    result = {"path": path, "content": None, "perceptual": None}
+    try:
+        st = _stat(path)
+    except OSError as exc:
+        result["error"] = str(exc)
+        return result
+    result["size"], result["mtime"] = st.st_size, st.st_mtime_ns
+    if known is not None and known[:2] == (st.st_size, st.st_mtime_ns):
+        result["content"], result["perceptual"] = known[2:]
+        return result
+    try:
+        result["content"] = content_hash(path)
+        result["perceptual"] = perceptual_hash(path)
+    except (OSError, ValueError) as exc:
+        result["error"] = str(exc) or "not a decodable image"
+    return result
+
+
+def hash_batch(paths_and_known):
+    return [hash_file(path, known) for path, known in paths_and_known]
+
+
+class Hasher(Prescreener):
+    """hash_file() over (row, (path, known entry)) pairs, in worker
+    processes; see Prescreener."""
+
+    batch = staticmethod(hash_batch)
+
+    @staticmethod
+    def failed(exc):
+        return {"content": None, "perceptual": None, "error": str(exc)}
+
+
+class HashIndex:
+    """Hashes by file path, kept with the size and mtime they were computed
+    at, in a JSON-lines file under the PyQC cache."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_paths.cache_dir("hashes"), "index.jsonl")
+        self.entries = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        path, *entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    self.entries[path] = tuple(entry)
+        except OSError:
+            pass
+
+    def get(self, path):
+        """(size, mtime, content, perceptual) last recorded for `path`."""
+        return self.entries.get(path)
+
+    def update(self, result):
+        """Record a hash_file() result, unless it failed."""
+        if result.get("content") is None or "error" in result:
+            return
+        self.entries[result["path"]] = (
+            result["size"],
+            result["mtime"],
+            result["content"],
+            result["perceptual"],
+        )
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        partial = self.path + ".tmp"
+        with open(partial, "w", encoding="utf-8") as f:
+            for path, entry in self.entries.items():
+                f.write(json.dumps([path, *entry]) + "\n")
+        os.replace(partial, self.path)
+
+
+def _near_pairs(hashes, max_distance):
+    """(i, j) index pairs of distinct `hashes` (uint64) at most
+    `max_distance` bits apart.
+
+    Split into max_distance + 1 bands, two such hashes agree on at least
+    one whole band, so only hashes sharing a band value are compared. With
+    the hashes sorted by band value, those are neighbours less than a
+    bucket's length apart: comparing every hash with the one `offset`
+    places on, for growing offsets, covers each bucket in vector steps.
+    """
+    bands = max_distance + 1
+    width = math.ceil(64 / bands)
+    pairs = set()
+    for band in range(bands):
+        keys = (hashes >> np.uint64(band * width)) & np.uint64((1 << width) - 1)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        for offset in itertools.count(1):
+            same = keys[offset:] == keys[:-offset]
+            if not same.any():
+                break
+            i, j = order[:-offset][same], order[offset:][same]
+            near = _popcount(hashes[i] ^ hashes[j]) <= max_distance
+            pairs.update(zip(i[near].tolist(), j[near].tolist()))
+    return pairs
+
+
+def group_duplicates(contents, perceptuals, max_distance=MAX_DISTANCE):
+    """Rows (list indices) of duplicate images, as a list of groups of two
+    or more rows, each sorted, in order of their first row.
+
+    Rows are grouped by perceptual hash. Taking rows in order, each one not
+    yet in a group starts a group with every ungrouped row whose hash is at
+    most `max_distance` bits from its own. Every image in a group is that
+    close to the group's first image, so near matches never chain into a
+    group of images unlike one another.
+
+    A row without a perceptual hash (an image that did not decode, or a
+    flat one) joins the rows with the same content hash instead, since
+    byte-identical files always share a perceptual hash otherwise. Rows
+    with neither take no part.
+    """
+    labels = np.full(len(perceptuals), -1, np.int64)
+    decoded = np.array([value is not None for value in perceptuals], bool)
+    distinct = []
+    if decoded.any():
+        values = np.array([value for value in perceptuals if value is not None], np.uint64)
+        distinct, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+        neighbours = collections.defaultdict(list)
+        for i, j in _near_pairs(distinct, max_distance) if max_distance > 0 else ():
+            neighbours[i].append(j)
+            neighbours[j].append(i)
+        roots = np.arange(len(distinct))
+        grouped = set()
+        for node in sorted(neighbours, key=lambda node: first[node]):
+            if node in grouped:
+                continue
+            grouped.add(node)
+            for other in neighbours[node]:
+                if other not in grouped:
+                    grouped.add(other)
+                    roots[other] = node
+        labels[decoded] = roots[inverse.ravel()]
+    by_content = {}
+    for row in np.flatnonzero(~decoded).tolist():
+        if contents[row] is not None:
+            labels[row] = len(distinct) + by_content.setdefault(contents[row], len(by_content))
+
+    rows = np.flatnonzero(labels >= 0)
+    order = np.argsort(labels[rows], kind="stable")
+    rows, keys = rows[order], labels[rows][order]
+    bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(keys)]))
+    shared = ends - starts > 1
+    return sorted(
+        rows[begin:end].tolist() for begin, end in zip(starts[shared], ends[shared])
+    )
@@ -0,0 +1,94 @@
+"""Byte-bounded LRU cache for decoded images.
+
+Entries are charged by the size of their pixel buffers, so the budget is a
+budget on decoded memory rather than on a number of images: a grayscale
+montage kept as Format_Grayscale8 costs a quarter of the same montage as
+32-bit ARGB, and four times as many of them fit.
+"""
+
+from collections import OrderedDict
+
+from PyQt5.QtGui import QImage, QPixmap
+
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+
+def image_nbytes(image):
+    """Bytes of pixel data held by a QImage or QPixmap, or the length of
+    an encoded image."""
+    if isinstance(image, (bytes, bytearray)):
+        return len(image)
+    if isinstance(image, QImage):
+        return image.sizeInBytes()
+    if isinstance(image, QPixmap):
+        return image.width() * image.height() * max(image.depth(), 8) // 8
+    return 0
+
+
+class DecodedImageCache:
+    """Least-recently-used map of key -> decoded image.
+
+    get() refreshes an entry's recency; put() evicts the oldest entries
+    until the total cost fits `budget` again. An image larger than the
+    whole budget is simply not cached.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get_quiet(self, key):
+        """get() without refreshing recency or counting a hit or miss."""
+        entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    def put(self, key, image):
+        cost = image_nbytes(image)
+        self.discard(key)
+        if cost > self.budget:
+            return
+        self._entries[key] = (image, cost)
+        self.nbytes += cost
+        self.evict(self.budget)
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def evict(self, budget):
+        """Drop least-recently-used entries until at most `budget` bytes
+        remain. Returns the number of bytes freed."""
+        freed = 0
+        while self._entries and self.nbytes > budget:
+            _key, (_image, cost) = self._entries.popitem(last=False)
+            self.nbytes -= cost
+            freed += cost
+        return freed
+
+    def release(self, nbytes):
+        """Drop least-recently-used entries until `nbytes` are freed, or
+        the cache is empty. Returns the number of bytes freed."""
+        return self.evict(max(0, self.nbytes - nbytes))
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
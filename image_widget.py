@@ -19,10 +19,24 @@ Note from HeleleMama:
 __author__ = "Stephan Sokolow (deitarion/SSokolow); HeleleMama"
 __license__ = "MIT"
 
-from PyQt5.QtCore import QSize, Qt
-from PyQt5.QtGui import QImageReader, QMovie, QPalette, QPixmap
+import collections
+import concurrent.futures
+import os
+import weakref
+
+from PyQt5 import sip
+from PyQt5.QtCore import QBuffer, QIODevice, QObject, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QMovie, QPalette, QPixmap
 from PyQt5.QtWidgets import QLabel
 
+from image_cache import DecodedImageCache, image_nbytes
+from overlay import OverlayRenderer
+from imageops import array_to_qimage, box_downscale, is_single_channel, qimage_view
+import archive
+import levels
+import nifti
+import pack
+
 
 class SaneQMovie(QMovie):
     """add adaptScale method"""
@@ -84,6 +98,73 @@ class SaneQPixmap(QPixmap):
         return self.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
 
 
+class SaneQImage(QImage):
+    """Grayscale content kept at one (or two) bytes per pixel.
+
+    Wrapping a grayscale image in a QPixmap expands it to 32 bits per pixel.
+    This keeps the decoded image single-channel through caching and scaling;
+    only the screen-sized result of adaptScale() is converted, at paint time.
+    """
+
+    def adaptScale(self, size):
+        """aspect-preserving scaling that stays single-channel for as long
+        as possible"""
+        # Qt's smooth scaler converts anything that isn't 32-bit to RGB32
+        # before it starts, i.e. it would expand the full-resolution image
+        # 4x just to shrink it. Average whole pixel blocks in the native
+        # format first, so only the small intermediate takes that detour.
+        if size.width() <= 0 or size.height() <= 0:
+            return QImage()
+        factor = int(
+            max(self.width() / size.width(), self.height() / size.height())
+        )
+        source = self
+        if factor >= 2:
+            source = array_to_qimage(
+                box_downscale(qimage_view(self), factor), self.format()
+            )
+        scaled = source.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        # At the intermediate's exact size, scaled() shares its buffer
+        scaled._array = getattr(source, "_array", None)
+        return scaled
+
+
+def _decoded_content(image):
+    """Wrap a freshly decoded QImage as label content.
+
+    Grayscale sources (including gray-palette and R=G=B colour files) become
+    a single-channel SaneQImage; everything else becomes a SaneQPixmap.
+    """
+    if is_single_channel(image):
+        content = SaneQImage(image)
+        # A wrapped buffer (e.g. a pack preview) must outlive the copy too
+        content._array = getattr(image, "_array", None)
+        return content
+    if not image.hasAlphaChannel() and image.isGrayscale():
+        return SaneQImage(image.convertToFormat(QImage.Format_Grayscale8))
+    return SaneQPixmap(image)
+
+
+def cache_key(source):
+    """Key of `source`'s decoded image: its path with the size and mtime of
+    the file (or of the bundle holding it), so an image rewritten during a
+    session is decoded again rather than served from a cache."""
+    path = archive.split_member(source)[0] if archive.is_member(source) else source
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return (source, None, None)
+    return (source, st.st_size, st.st_mtime_ns)
+
+
+def _buffer(data):
+    """Read-only in-memory QIODevice over `data`"""
+    device = QBuffer()
+    device.setData(data)
+    device.open(QIODevice.ReadOnly)
+    return device
+
+
 def _sizeCheck(c_size, n_size):
     """Check if new size alter current dimension"""
     if c_size.width() == n_size.width() and c_size.height() <= n_size.height():
@@ -93,6 +174,40 @@ def _sizeCheck(c_size, n_size):
     return True
 
 
+class _StatsWorker(QObject):
+    """Computes levels.stats() on a background thread and hands each result
+    to its label in the GUI thread, if the label still exists by then."""
+
+    _ready = pyqtSignal(object, object, object)  # label weakref, content key, stats
+
+    def __init__(self):
+        super(_StatsWorker, self).__init__()
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix="pyqc-levels"
+        )
+        self._ready.connect(self._deliver)
+
+    def submit(self, label, key, content):
+        ref = weakref.ref(label)
+        self._pool.submit(lambda: self._ready.emit(ref, key, levels.stats(content)))
+
+    def _deliver(self, ref, key, stats):
+        label = ref()
+        if label is not None and not sip.isdeleted(label):
+            label._on_stats(key, stats)
+
+
+def _stats_worker():
+    global _STATS_WORKER
+    if _STATS_WORKER is None:
+        _STATS_WORKER = _StatsWorker()  # in the GUI thread, which it reports to
+    return _STATS_WORKER
+
+
+_STATS_WORKER = None
+_MAX_STATS = 256
+
+
 class SaneDefaultsImageLabel(QLabel):
     """Compound widget to work around some shortcomings in Qt image display.
 
@@ -115,6 +230,9 @@ class SaneDefaultsImageLabel(QLabel):
     (https://wiki.qt.io/Loading_Large_Images)
     """
 
+    # Emitted when the window/level changes, e.g. while right-dragging
+    windowChanged = pyqtSignal()
+
     def __init__(self):
         super(SaneDefaultsImageLabel, self).__init__()
 
@@ -131,19 +249,190 @@ class SaneDefaultsImageLabel(QLabel):
         # Reserve a slot for actual content
         self.content = None
 
+        # Decoded still images, keyed by source, so revisiting an image
+        # skips both the file read and the decode
+        self.cache = DecodedImageCache()
+
+        # Optional callable: source -> already-read file bytes, or None
+        # (see prefetch.Prefetcher.take)
+        self.byte_source = None
+
+        # Optional shared_cache.SharedImageCache: decoded images published
+        # by, and reused from, other PyQC processes on this machine
+        self.shared_cache = None
+
+        # Optional decoder (see decoders.py) tried before QImageReader on
+        # still images, and its jobs started ahead by predecode()
+        self.decoder = None
+        self._decoding = {}
+
+        # Source of self.content, its cache_key(), which also keys what is
+        # derived from it, and the other image composited over it (see
+        # set_overlay)
+        self.source = None
+        self.content_key = None
+        self.overlay = None
+        self._overlay_renderer = OverlayRenderer()
+
+        # Window/level: (low, high) in source intensities, or None to show
+        # images as decoded. With auto_contrast, each image gets the window
+        # its histogram suggests (see levels.stats), computed in the
+        # background and kept per source.
+        self.window = None
+        self.auto_contrast = False
+        self._stats = collections.OrderedDict()
+        self._windowed = DecodedImageCache(64 * 1024 * 1024)
+        self._drag = None
+
+    def decoded_nbytes(self):
+        """Bytes of the decoded content that its cache does not hold"""
+        if self.content is None or isinstance(self.content, QMovie):
+            return 0
+        if self.cache.get_quiet(self.content_key) is self.content:
+            return 0
+        return image_nbytes(self.content)
+
+    def scaled_nbytes(self):
+        """Bytes of the image as shown, and of the windowed images and
+        overlay composites cached to make it"""
+        shown = self.pixmap()
+        shown = image_nbytes(shown) if shown is not None else 0
+        return shown + self._windowed.nbytes + self._overlay_renderer.cache.nbytes
+
+    def release_scaled(self, nbytes):
+        """Drop cached windowed images and composites (see
+        DecodedImageCache.release)"""
+        freed = self._windowed.release(nbytes)
+        return freed + self._overlay_renderer.cache.release(max(0, nbytes - freed))
+
+    def movie_nbytes(self):
+        """Bytes held for an animated GIF: its file, if read into memory,
+        and its decoded frames"""
+        movie = self.content
+        if not isinstance(movie, QMovie):
+            return 0
+        frames = movie.frameCount() if movie.cacheMode() == QMovie.CacheAll else 1
+        device = getattr(movie, "_device", None)
+        data = device.size() if isinstance(device, QBuffer) else 0
+        return data + max(frames, 1) * movie.currentImage().sizeInBytes()
+
+    def _show(self, image):
+        """Display a QPixmap, or a QImage converted for painting"""
+        if isinstance(image, QImage):
+            image = QPixmap.fromImage(image)
+        self.setPixmap(image)
+
     def load(self, source, adaptSize=True):
-        """Load anything that QImageReader or QMovie constructors accept
+        """Load anything that QImageReader or QMovie constructors accept,
+        a .nii/.nii.gz volume (shown as a three-plane montage), or an
+        ``<archive>::<member>`` path (decoded from memory)
             adaptSize=True: Initial image size to fit container
             adaptSize=False: Set container's size the same as image
         """
+        if not self._load_cached(source, adaptSize):
+            self._present(source, self.read(source), adaptSize)
+
+    def _load_cached(self, source, adaptSize):
+        """Show `source` from the local or shared cache; False on a miss"""
+        self.source = source
+        self.content_key = cache_key(source)
+        self.overlay = None  # it was made for the previous image
+        self.window = None
+        size = QSize(self.width(), self.height())
+        cached = self.cache.get(self.content_key)
+        if cached is not None:
+            self.content = cached
+            self._request_stats()
+            self._display_content(size, adaptSize)
+            self.setMinimumSize(1, 1)
+            return True
+        if self.shared_cache is not None:
+            shared = self.shared_cache.get(source)
+            if shared is not None:
+                self._load_still(source, shared, "", size, adaptSize, publish=False)
+                return True
+        return False
+
+    def read(self, source):
+        """Fetch and decode `source` without touching the widget, so this
+        can run on a worker thread (see load_together). Returns one of
+            ("still", image, error, publish), ("volume", pixels),
+            ("movie", bytes or None), ("error", reason)
+        for _present() to show."""
+        data = self.byte_source(source) if self.byte_source is not None else None
+        if data is None and archive.is_member(source):
+            bundle, member = archive.split_member(source)
+            try:
+                if pack.is_pack(bundle):
+                    # Decoded straight from the pack's memory map
+                    # (already shared through the page cache, so not published)
+                    image = pack.open_pack(bundle).image(member)
+                    return ("still", image, "not a decodable image", False)
+                data = archive.read_member(source)
+            except (OSError, ValueError) as exc:
+                return ("error", str(exc))
+        elif data is None and nifti.is_nifti(source):
+            try:
+                return ("volume", nifti.montage(source))
+            except (OSError, ValueError) as exc:
+                return ("error", str(exc))
 
         # Use QImageReader to identify animated GIFs for separate handling
         # (Thanks to https://stackoverflow.com/a/20674469/435253 for this)
-        size = QSize(self.width(), self.height())
-        image_reader = QImageReader(source)
+        device = _buffer(data) if data is not None else source
+        image_reader = QImageReader(device)  # does not keep `device` alive
         if image_reader.supportsAnimation() and image_reader.imageCount() > 1:
-            # Set content as Movie
-            self.content = SaneQMovie(source)
+            return ("movie", data)
+        image, error = QImage(), ""
+        job = self._decoding.pop(source, None)
+        if job is not None:
+            image, error = self.decoder.finish(job)
+        elif self.decoder is not None:
+            image, error = self.decoder.decode(source, data)
+        if image.isNull():  # not a format the decoder handles
+            image = image_reader.read()
+            error = image_reader.errorString()
+        return ("still", image, error, True)
+
+    def predecode(self, sources):
+        """Start decoding `sources` in the decoder's worker processes, if it
+        has any, so that loading one later only waits for what is left of
+        its decode. Jobs started for other sources are dropped."""
+        wanted = set(sources)
+        for source in [s for s in self._decoding if s not in wanted]:
+            self.decoder.discard(self._decoding.pop(source))
+        start = getattr(self.decoder, "start", None)
+        if start is None:
+            return
+        for source in sources:
+            if (
+                source in self._decoding
+                or self.cache.get_quiet(cache_key(source)) is not None
+                or archive.is_member(source)
+                or nifti.is_nifti(source)
+            ):
+                continue
+            job = start(source)
+            if job is not None:
+                self._decoding[source] = job
+
+    def _present(self, source, decoded, adaptSize):
+        """Show the result of read(), in the GUI thread"""
+        size = QSize(self.width(), self.height())
+        kind = decoded[0]
+        if kind == "error":
+            self._show_error(source, decoded[1])
+        elif kind == "volume":
+            self._load_volume(source, decoded[1], size, adaptSize)
+        elif kind == "still":
+            _, image, error, publish = decoded
+            self._load_still(source, image, error, size, adaptSize, publish)
+        else:
+            # Set content as Movie, on a fresh device if reading from memory
+            data = decoded[1]
+            device = _buffer(data) if data is not None else source
+            self.content = SaneQMovie(device)
+            self.content._device = device  # QMovie does not own it
             # Adjust the widget size
             if adaptSize:
                 self.content.adaptScale(size)
@@ -153,28 +442,177 @@ class SaneDefaultsImageLabel(QLabel):
             # Start Movie replay
             self.setMovie(self.content)
             self.content.start()
+            # Keep the image from preventing downscaling
+            self.setMinimumSize(1, 1)
 
-        else:
-            image = image_reader.read()
-            if image.isNull():
-                self.content = None
-                self.clear()
-                self.setText("Failed to load: {}\n{}".format(
-                    source, image_reader.errorString()
-                ))
-                return
-            self.content = SaneQPixmap(image)
-            # Adjust the widget size
-            if adaptSize:
-                self.setPixmap(self.content.adaptScale(size))
-            else:
-                # Resizing container will trigger resizeEvent()
-                self.resize(self.content.size())
-                self.setPixmap(self.content)
+    def _load_still(self, source, image, error, size, adaptSize, publish=True):
+        """Show and cache a decoded still image, or `error` if it is null"""
+        if image.isNull():
+            self._show_error(source, error)
+            return
+        self.content = _decoded_content(image)
+        self.cache.put(self.content_key, self.content)
+        if publish and self.shared_cache is not None:
+            self.shared_cache.put(
+                source, self.content if isinstance(self.content, QImage) else image
+            )
+        self._request_stats()
+        self._display_content(size, adaptSize)
+        self.setMinimumSize(1, 1)
 
-        # Keep the image from preventing downscaling
+    def _load_volume(self, source, montage, size, adaptSize):
+        """Show the middle-slice montage of a NIfTI volume"""
+        self.content = array_to_qimage(montage, cls=SaneQImage)
+        self.cache.put(self.content_key, self.content)
+        if self.shared_cache is not None:
+            self.shared_cache.put(source, self.content)
+        self._request_stats()
+        self._display_content(size, adaptSize)
         self.setMinimumSize(1, 1)
 
+    def set_overlay(self, source=None, content=None, mode=None, alpha=0.5):
+        """Composite `content` (another label's image, `source` its
+        content_key) with this label's image, as one of overlay.MODES; mode=None shows
+        this label's image alone again."""
+        self.overlay = (source, content, mode, alpha) if mode else None
+        self._refresh()
+
+    def set_window(self, window):
+        """Show the image through the window (low, high), or as decoded
+        for None"""
+        if window is not None:
+            low = int(round(window[0]))
+            window = (low, max(low + 1, int(round(window[1]))))
+        if window != self.window:
+            self.window = window
+            self._refresh()
+            self.windowChanged.emit()
+
+    def set_auto_contrast(self, enabled):
+        """Window every image by its histogram (see levels.stats)"""
+        self.auto_contrast = enabled
+        stats = self._stats.get(self.content_key)
+        if not enabled:
+            self.set_window(None)
+        elif stats is not None:
+            self.set_window((stats["low"], stats["high"]))
+        elif isinstance(self.content, (SaneQPixmap, SaneQImage)):
+            self._request_stats()
+
+    def _refresh(self):
+        if isinstance(self.content, (SaneQPixmap, SaneQImage)):
+            self._show(self._fitted(QSize(self.width(), self.height())))
+
+    def _request_stats(self):
+        """With auto_contrast on, window the new still content by its
+        levels.stats(), computing them in the background unless they are
+        known already"""
+        if not self.auto_contrast:
+            return
+        stats = self._stats.get(self.content_key)
+        if stats is not None:
+            self._stats.move_to_end(self.content_key)
+            if self.auto_contrast:
+                self.window = (stats["low"], stats["high"])
+            return
+        content = self.content
+        if isinstance(content, QPixmap):
+            content = content.toImage()  # QPixmaps belong to the GUI thread
+        _stats_worker().submit(self, self.content_key, content)
+
+    def _on_stats(self, key, stats):
+        self._stats[key] = stats
+        while len(self._stats) > _MAX_STATS:
+            self._stats.popitem(last=False)
+        if key == self.content_key and self.auto_contrast:
+            self.set_window((stats["low"], stats["high"]))
+
+    def _windowed_content(self, size):
+        """self.content through self.window, reduced in its own format
+        towards `size` first so a 16-bit image is windowed at 16 bits but
+        only over about as many pixels as are shown"""
+        if self.window is None:
+            return self.content
+        factor = 1
+        if isinstance(self.content, SaneQImage) and size.width() > 0 and size.height() > 0:
+            factor = int(max(self.content.width() / size.width(),
+                             self.content.height() / size.height()))
+        key = (self.content_key, self.window, factor)
+        windowed = self._windowed.get(key)
+        if windowed is None:
+            base = self.content
+            if factor >= 2:
+                base = array_to_qimage(
+                    box_downscale(qimage_view(self.content), factor), self.content.format()
+                )
+            windowed = _decoded_content(levels.apply(base, *self.window))
+            self._windowed.put(key, windowed)
+        return windowed
+
+    def _fitted(self, size):
+        """self.content scaled to fit `size`, windowed and composited with
+        the overlay"""
+        content = self._windowed_content(size)
+        if self.overlay is None:
+            return content.adaptScale(size)
+        source, other, mode, alpha = self.overlay
+        target = self.content.size().scaled(size, Qt.KeepAspectRatio)
+        # Composite at no more than full resolution, then let Qt upscale
+        render = target if target.width() <= self.content.width() else self.content.size()
+        image = self._overlay_renderer.render(
+            (self.content_key, self.window), content, source, other, render, mode, alpha
+        )
+        if image.size() != target:
+            image = image.scaled(target, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        return image
+
+    def _show_error(self, source, reason):
+        self.content = None
+        self.clear()
+        self.setText("Failed to load: {}\n{}".format(source, reason))
+
+    def _display_content(self, size, adaptSize):
+        """Show a still-image self.content, as load() does for fresh ones"""
+        # Adjust the widget size
+        if adaptSize:
+            self._show(self._fitted(size))
+        else:
+            # Resizing container will trigger resizeEvent()
+            self.resize(self.content.size())
+            self._show(self.content)
+
+    def mousePressEvent(self, event):
+        """Right-drag adjusts the window: sideways for its width, up and
+        down for its level"""
+        if event.button() != Qt.RightButton or not isinstance(
+            self.content, (SaneQPixmap, SaneQImage)
+        ):
+            super(SaneDefaultsImageLabel, self).mousePressEvent(event)
+            return
+        stats = self._stats.get(self.content_key)
+        if self.window is not None:
+            start = self.window
+        elif stats is not None:
+            start = (stats["min"], stats["max"])
+        else:
+            start = (0, levels.levels_of(self.content) - 1)
+        self._drag = (event.pos(), start, levels.levels_of(self.content))
+
+    def mouseMoveEvent(self, event):
+        if self._drag is None:
+            super(SaneDefaultsImageLabel, self).mouseMoveEvent(event)
+            return
+        origin, (low, high), depth = self._drag
+        delta = event.pos() - origin
+        width = max(1.0, (high - low) * 2 ** (delta.x() / 200))
+        center = (low + high) / 2 - delta.y() * depth / 1000
+        self.set_window((center - width / 2, center + width / 2))
+
+    def mouseReleaseEvent(self, event):
+        if self._drag is None:
+            super(SaneDefaultsImageLabel, self).mouseReleaseEvent(event)
+        self._drag = None
+
     def adjustSize(self):
         """Reset content size"""
         # Retrieve content size
@@ -194,11 +632,23 @@ class SaneDefaultsImageLabel(QLabel):
                 self.content.adaptScale(size)
 
         # Check both content and current label to prevent false triggering
-        elif isinstance(self.content, SaneQPixmap) and self.pixmap():
+        elif isinstance(self.content, (SaneQPixmap, SaneQImage)) and self.pixmap():
             # Don't waste CPU generating a new pixmap if the resize didn't
             # alter the dimension that's currently bounding its size
             if _sizeCheck(self.pixmap().size(), size):
-                self.setPixmap(self.content.adaptScale(size))
+                self._show(self._fitted(size))
+
+
+def load_together(labels, sources, executor, adaptSize=True):
+    """load() each of `sources` into the matching label, reading and decoding
+    the ones not already cached concurrently on `executor` (a thread pool),
+    so several images take about as long to show as the slowest one."""
+    pending = []
+    for label, source in zip(labels, sources):
+        if not label._load_cached(source, adaptSize):
+            pending.append((label, source, executor.submit(label.read, source)))
+    for label, source, future in pending:
+        label._present(source, future.result(), adaptSize)
 
 
 def main():
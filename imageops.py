@@ -0,0 +1,79 @@
+"""NumPy helpers for working on QImage pixel buffers without copying.
+
+qimage_view() exposes an image's pixels as an ndarray that aliases the
+QImage's own buffer, and array_to_qimage() goes the other way. Both keep
+row strides intact, so images whose scanlines are padded to 32 bits work
+as they are.
+"""
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+# Formats with one channel per pixel, and the dtype of that channel.
+_SINGLE_CHANNEL = {
+    QImage.Format_Grayscale8: np.uint8,
+    QImage.Format_Grayscale16: np.uint16,
+}
+
+
+def is_single_channel(image):
+    """True for grayscale formats whose pixel values are intensities."""
+    return image.format() in _SINGLE_CHANNEL
+
+
+def qimage_view(image):
+    """Read-only (height, width) or (height, width, bytes) view of `image`.
+
+    Single-channel formats come back as 2-D arrays of uint8/uint16; any
+    other format is exposed as raw bytes per pixel. The view borrows the
+    QImage's memory, so `image` must outlive it and must not be modified.
+    """
+    height, width, stride = image.height(), image.width(), image.bytesPerLine()
+    ptr = image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    raw = np.frombuffer(ptr, dtype=np.uint8).reshape(height, stride)
+    dtype = _SINGLE_CHANNEL.get(image.format())
+    if dtype is not None:
+        itemsize = np.dtype(dtype).itemsize
+        return raw[:, : width * itemsize].view(dtype)
+    depth = image.depth() // 8
+    return raw[:, : width * depth].reshape(height, width, depth)
+
+
+def array_to_qimage(array, fmt=None, cls=QImage):
+    """Wrap a 2-D uint8/uint16 or (h, w, 4) uint8 array as a QImage.
+
+    The QImage (or `cls` subclass) aliases the array's memory; the array is
+    attached to the returned image so it lives at least as long as this
+    wrapper. Call .copy() on the result if it has to outlive the wrapper
+    itself.
+    """
+    array = np.ascontiguousarray(array)
+    height, width = array.shape[:2]
+    if fmt is None:
+        if array.ndim == 3:
+            fmt = QImage.Format_ARGB32
+        elif array.dtype == np.uint16:
+            fmt = QImage.Format_Grayscale16
+        else:
+            fmt = QImage.Format_Grayscale8
+    image = cls(array.data, width, height, array.strides[0], fmt)
+    image._array = array
+    return image
+
+
+def box_downscale(array, factor):
+    """Average `factor` x `factor` blocks of a 2-D array, keeping its dtype.
+
+    Rows and columns that don't fill a whole block are dropped; callers
+    follow up with a smooth resample to the exact target size anyway.
+    """
+    if factor <= 1:
+        return array
+    height = array.shape[0] // factor * factor
+    width = array.shape[1] // factor * factor
+    blocks = array[:height, :width].reshape(
+        height // factor, factor, width // factor, factor
+    )
+    mean = blocks.sum(axis=(1, 3), dtype=np.uint64) // (factor * factor)
+    return mean.astype(array.dtype)
@@ -0,0 +1,88 @@
+"""Window/level and auto-contrast for displayed images.
+
+A window (low, high) maps source intensities linearly onto 0-255, clipping
+below `low` and above `high`. It is applied as one lookup-table pass over
+the image's own buffer: 256 entries for 8-bit images, 65536 for
+Format_Grayscale16, so 16-bit data is windowed before it is reduced to
+8 bits. Colour images are windowed per channel with the 8-bit table.
+
+stats() summarizes an image's histogram (range and the percentiles that
+auto-contrast uses); SaneDefaultsImageLabel runs it on a background thread
+as images are loaded.
+"""
+
+import functools
+
+import numpy as np
+from PyQt5.QtGui import QImage, QPixmap
+
+from imageops import array_to_qimage, qimage_view
+
+# Auto-contrast clips this fraction of pixels at each end
+AUTO_LOW = 0.005
+AUTO_HIGH = 0.995
+
+
+def levels_of(content):
+    """Number of intensity levels of a QImage/QPixmap's pixels."""
+    if isinstance(content, QImage) and content.format() == QImage.Format_Grayscale16:
+        return 65536
+    return 256
+
+
+def _pixels(content):
+    """(image, values, levels) of a QImage/QPixmap: the QImage that owns
+    `values` (keep it while using them), a 2-D gray array or (h, w, 4) BGRA
+    bytes, and the number of intensity levels."""
+    if isinstance(content, QPixmap):
+        content = content.toImage()
+    if content.format() == QImage.Format_Grayscale16:
+        return content, qimage_view(content), 65536
+    if content.format() != QImage.Format_Grayscale8:
+        content = content.convertToFormat(QImage.Format_ARGB32)
+    return content, qimage_view(content), 256
+
+
+def stats(content):
+    """{"levels", "min", "max", "low", "high"} of an image's intensities;
+    low/high are the auto-contrast window."""
+    _image, values, levels = _pixels(content)
+    if values.ndim == 3:
+        values = values[:, :, :3]  # not alpha
+    hist = np.bincount(values.ravel(), minlength=levels)
+    cdf = np.cumsum(hist)
+    total = cdf[-1]
+    nonzero = np.flatnonzero(hist)
+    if not total:
+        return {"levels": levels, "min": 0, "max": levels - 1, "low": 0, "high": levels - 1}
+    low = int(np.searchsorted(cdf, total * AUTO_LOW, side="right"))
+    high = int(np.searchsorted(cdf, total * AUTO_HIGH))
+    return {
+        "levels": levels,
+        "min": int(nonzero[0]),
+        "max": int(nonzero[-1]),
+        "low": low,
+        "high": max(high, low + 1),
+    }
+
+
+@functools.lru_cache(maxsize=32)
+def lut(low, high, levels):
+    """uint8 table mapping 0..levels-1 through the window (low, high)."""
+    span = max(high - low, 1e-6)
+    table = np.clip((np.arange(levels) - low) * 255.0 / span + 0.5, 0, 255)
+    table = table.astype(np.uint8)
+    table.flags.writeable = False  # shared between callers
+    return table
+
+
+def apply(content, low, high):
+    """`content` through the window, as a new QImage: Format_Grayscale8
+    for grayscale sources, Format_ARGB32 (alpha kept) for colour ones."""
+    _image, values, levels = _pixels(content)
+    table = lut(low, high, levels)
+    if values.ndim == 2:
+        return array_to_qimage(np.take(table, values), QImage.Format_Grayscale8)
+    out = np.take(table, values)
+    out[:, :, 3] = values[:, :, 3]
+    return array_to_qimage(out, QImage.Format_ARGB32)
@@ -0,0 +1,125 @@
+"""Where PyQC's memory goes, and a budget that makes caches give it back.
+
+Each subsystem registers a counter with MemoryAccounts: a callable that
+returns how many bytes it holds right now, measured from the sizes of its
+buffers rather than sampled from the process. Caches also register a
+release callable, release(nbytes), which frees about `nbytes` of their
+least recently used entries and returns how much it freed. When the total
+is over the budget, enforce() asks the caches for the excess, in the order
+they were registered, so the cheapest to rebuild should come first.
+
+With tracing on (start_tracing), tracemalloc also records where the
+Python heap was allocated, and every report lists the top allocation
+sites, with their growth since the previous report.
+"""
+
+import tracemalloc
+
+MB = 1024 * 1024
+
+# Frames kept per allocation while tracing: enough to see the caller
+TRACE_FRAMES = 4
+
+
+def format_bytes(n):
+    if n >= 10 * MB:
+        return "{:.0f} MB".format(n / MB)
+    if n >= MB:
+        return "{:.1f} MB".format(n / MB)
+    return "{:.0f} kB".format(n / 1024)
+
+
+def start_tracing(frames=TRACE_FRAMES):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+class MemoryAccounts:
+    """Byte counters by subsystem, and an optional budget over their total
+    (None for no budget)."""
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.released = 0  # bytes freed by enforce(), over the session
+        self._subsystems = {}
+        self._snapshot = None
+
+    def register(self, name, measure, release=None):
+        self._subsystems[name] = (measure, release)
+
+    def counters(self):
+        """{subsystem: bytes held}, in registration order."""
+        return {name: int(measure()) for name, (measure, _) in self._subsystems.items()}
+
+    def enforce(self):
+        """Release cached memory until the total fits the budget again, as
+        far as the caches can. Returns the bytes released."""
+        if self.budget is None:
+            return 0
+        excess = sum(self.counters().values()) - self.budget
+        released = 0
+        for _, release in self._subsystems.values():
+            if excess - released <= 0:
+                break
+            if release is not None:
+                released += release(excess - released)
+        self.released += released
+        return released
+
+    def summary(self, counters=None):
+        """One line for the status bar, e.g. "mem 312 MB / 1024 MB"."""
+        total = sum((counters or self.counters()).values())
+        text = "mem " + format_bytes(total)
+        if self.budget is not None:
+            text += " / " + format_bytes(self.budget)
+        return text
+
+    def report(self, counters=None, top=10, allocations=True):
+        """Every counter on a line of its own, and, while tracing (unless
+        `allocations` is False), the `top` allocation sites of the Python
+        heap."""
+        counters = counters or self.counters()
+        width = max(map(len, counters), default=0)
+        lines = [
+            "{:<{}}  {:>10}".format(name, width, format_bytes(nbytes))
+            for name, nbytes in counters.items()
+        ]
+        lines.append("{:<{}}  {:>10}".format("total", width, format_bytes(sum(counters.values()))))
+        if self.budget is not None:
+            lines.append(
+                "budget {}, {} released to stay within it".format(
+                    format_bytes(self.budget), format_bytes(self.released)
+                )
+            )
+        if allocations and tracemalloc.is_tracing():
+            lines.append("")
+            lines.extend(self._trace_report(top))
+        return "\n".join(lines)
+
+    def _trace_report(self, top):
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            "Python heap (tracemalloc): {} now, {} at peak".format(
+                format_bytes(current), format_bytes(peak)
+            )
+        ]
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        if self._snapshot is None:
+            stats = snapshot.statistics("lineno")
+        else:
+            stats = snapshot.compare_to(self._snapshot, "lineno")
+        self._snapshot = snapshot
+        for stat in stats[:top]:
+            frame = stat.traceback[0]
+            growth = getattr(stat, "size_diff", None)
+            lines.append(
+                "  {:>10}{}  {}:{}".format(
+                    format_bytes(stat.size),
+                    "" if growth is None else " ({:+.1f} MB)".format(growth / MB),
+                    frame.filename,
+                    frame.lineno,
+                )
+            )
+        return lines
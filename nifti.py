@@ -0,0 +1,197 @@
+"""Lazy NIfTI-1/NIfTI-2 volume access for QC montages.
+
+Uncompressed volumes are memory-mapped, so only the pages behind the three
+slices that make up a montage are ever read. A ``.nii.gz`` is decompressed
+once into the on-disk cache (see cache_paths) and memory-mapped from there
+on every later visit.
+
+Only single-file volumes (``n+1`` / ``n+2`` magic) with scalar voxel types
+are supported. The header's affine is not applied: slices are shown in
+voxel order, with the second voxel axis pointing up, and pixdim is only
+used to correct the aspect ratio of each panel.
+"""
+
+import gzip
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+
+import cache_paths
+
+NIFTI_EXTS = (".nii", ".nii.gz")
+
+_DTYPES = {
+    2: np.uint8,
+    4: np.int16,
+    8: np.int32,
+    16: np.float32,
+    64: np.float64,
+    256: np.int8,
+    512: np.uint16,
+    768: np.uint32,
+    1024: np.int64,
+    1280: np.uint64,
+}
+
+# (sizeof_hdr, dim format, dim offset, datatype offset, pixdim format,
+#  pixdim offset, vox_offset format, vox_offset offset, magic offset)
+_LAYOUTS = {
+    348: ("8h", 40, 70, "8f", 76, "f", 108, 344),
+    540: ("8q", 16, 12, "8d", 104, "q", 168, 4),
+}
+
+
+def is_nifti(path):
+    return str(path).lower().endswith(NIFTI_EXTS)
+
+
+def cache_dir():
+    """Directory for decompressed volumes."""
+    return cache_paths.cache_dir("nifti")
+
+
+def _decompressed_path(path):
+    """Path of an uncompressed copy of the .nii.gz at `path`, creating it
+    on first use; an updated volume gets a fresh copy."""
+    target = os.path.join(cache_dir(), cache_paths.source_key(path) + ".nii")
+    if os.path.exists(target):
+        return target
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as dst, gzip.open(path, "rb") as src:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp, target)
+    except BaseException as exc:
+        os.unlink(tmp)
+        if isinstance(exc, (EOFError, zlib.error)):  # gzip's BadGzipFile is an OSError
+            raise ValueError("corrupt or truncated .gz file ({})".format(exc)) from None
+        raise
+    return target
+
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        raw = f.read(540)
+    if len(raw) < 348:
+        raise ValueError("file too short for a NIfTI header")
+
+    for endian in "<>":
+        (sizeof_hdr,) = struct.unpack_from(endian + "i", raw, 0)
+        if sizeof_hdr in _LAYOUTS:
+            break
+    else:
+        raise ValueError("not a NIfTI-1/NIfTI-2 file")
+    dim_fmt, dim_off, dt_off, pix_fmt, pix_off, vox_fmt, vox_off, magic_off = (
+        _LAYOUTS[sizeof_hdr]
+    )
+    if len(raw) < sizeof_hdr:
+        raise ValueError("truncated NIfTI header")
+    magic = raw[magic_off : magic_off + 3]
+    if magic not in (b"n+1", b"n+2"):
+        raise ValueError("only single-file NIfTI volumes are supported")
+
+    dim = struct.unpack_from(endian + dim_fmt, raw, dim_off)
+    (datatype,) = struct.unpack_from(endian + "h", raw, dt_off)
+    pixdim = struct.unpack_from(endian + pix_fmt, raw, pix_off)
+    (vox_offset,) = struct.unpack_from(endian + vox_fmt, raw, vox_off)
+
+    dtype = _DTYPES.get(datatype)
+    if dtype is None:
+        raise ValueError("unsupported NIfTI datatype {}".format(datatype))
+    ndim = dim[0]
+    if not 2 <= ndim <= 7:
+        raise ValueError("bad NIfTI dimensions")
+    shape = tuple(max(int(d), 1) for d in dim[1 : ndim + 1])
+    shape = (shape + (1, 1))[:max(ndim, 3)]
+    spacing = tuple(abs(float(p)) or 1.0 for p in pixdim[1:4])
+    return np.dtype(dtype).newbyteorder(endian), shape, int(vox_offset), spacing
+
+
+class NiftiVolume:
+    """Memory-mapped first 3-D volume of a NIfTI file, indexed [x, y, z]."""
+
+    def __init__(self, path):
+        self.path = path
+        if str(path).lower().endswith(".gz"):
+            path = _decompressed_path(path)
+        dtype, shape, offset, spacing = _read_header(path)
+        self.spacing = spacing
+        data = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape, order="F")
+        # Extra dimensions (time, etc.): show the first volume only.
+        self.data = data[(slice(None),) * 3 + (0,) * (data.ndim - 3)]
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def slices(self):
+        """Middle axial, coronal and sagittal slices as 2-D arrays, each
+        with rows running top to bottom, plus their (row, col) spacing."""
+        nx, ny, nz = self.shape
+        dx, dy, dz = self.spacing
+        axial = self.data[:, :, nz // 2]
+        coronal = self.data[:, ny // 2, :]
+        sagittal = self.data[nx // 2, :, :]
+        return [
+            (np.flipud(axial.T), (dy, dx)),
+            (np.flipud(coronal.T), (dz, dx)),
+            (np.flipud(sagittal.T), (dz, dy)),
+        ]
+
+
+def window(slices, low_pct=1.0, high_pct=99.0):
+    """Map arrays to uint8 with one shared robust window.
+
+    The window runs from the `low_pct` to the `high_pct` percentile of all
+    the slices' voxels together, so the three panels of a montage share the
+    same contrast. Scaling is a single vectorized pass per slice.
+    """
+    sample = np.concatenate([np.asarray(s, dtype=np.float32).ravel() for s in slices])
+    sample = sample[np.isfinite(sample)]
+    if sample.size == 0:
+        return [np.zeros(np.shape(s), dtype=np.uint8) for s in slices]
+    lo, hi = np.percentile(sample, [low_pct, high_pct])
+    if hi <= lo:
+        hi = lo + 1
+    scale = np.float32(255.0 / (hi - lo))
+    out = []
+    for s in slices:
+        scaled = (np.asarray(s, dtype=np.float32) - np.float32(lo)) * scale
+        out.append(np.nan_to_num(np.clip(scaled, 0, 255)).astype(np.uint8))
+    return out
+
+
+def _resample_rows(array, factor):
+    """Stretch rows by `factor` (nearest neighbour) to fix voxel aspect."""
+    if abs(factor - 1) < 1e-3:
+        return array
+    rows = max(int(round(array.shape[0] * factor)), 1)
+    index = np.minimum((np.arange(rows) / factor).astype(np.intp), array.shape[0] - 1)
+    return array[index]
+
+
+def montage(path, gap=4):
+    """Axial | coronal | sagittal montage of the volume at `path`, as a
+    C-contiguous 2-D uint8 array ready to wrap as a Grayscale8 QImage."""
+    volume = NiftiVolume(path)
+    slices = volume.slices()
+    panels = window([s for s, _ in slices])
+    panels = [
+        _resample_rows(panel, row_mm / col_mm)
+        for panel, (_, (row_mm, col_mm)) in zip(panels, slices)
+    ]
+    height = max(p.shape[0] for p in panels)
+    width = sum(p.shape[1] for p in panels) + gap * (len(panels) - 1)
+    canvas = np.zeros((height, width), dtype=np.uint8)
+    x = 0
+    for panel in panels:
+        top = (height - panel.shape[0]) // 2
+        canvas[top : top + panel.shape[0], x : x + panel.shape[1]] = panel
+        x += panel.shape[1] + gap
+    return canvas
@@ -0,0 +1,221 @@
+"""Single-file image bundles ("packs") for slow shared filesystems.
+
+A pack replaces thousands of small image files with one file that PyQC
+memory-maps. Layout (little-endian):
+
+    header   b"PYQCPACK", u32 version, u32 reserved
+    blobs    one per image, in insertion order
+    table    per image: u64 offset, u64 size, u32 kind, u32 name end
+    names    UTF-8 member names, concatenated
+    trailer  u64 table offset, u64 image count, b"PYQCPEND"
+
+An ENCODED blob is the original image file, decoded straight from the
+mapping. A PREVIEW blob is a downscaled image that has already been decoded:
+a 16-byte header (u32 width, height, bytes per line, QImage format) followed
+by the scanlines. It is wrapped as a QImage in place, without copying.
+A new pack is written to a temporary file and renamed over any old one.
+Appending writes the new blobs and a fresh table, names and trailer after
+the old trailer. The file only ever grows, so processes that have the pack
+mapped keep reading it safely; the superseded table is left as dead space.
+"""
+
+import functools
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage
+
+PACK_EXT = ".pyqcpack"
+MAGIC = b"PYQCPACK"
+END_MAGIC = b"PYQCPEND"
+VERSION = 1
+
+ENCODED = 0
+PREVIEW = 1
+
+_HEADER = struct.Struct("<8sII")
+_ENTRY = struct.Struct("<QQII")
+_TRAILER = struct.Struct("<QQ8s")
+_PREVIEW = struct.Struct("<IIII")
+
+
+def is_pack(path):
+    return str(path).lower().endswith(PACK_EXT)
+
+
+class PackReader:
+    """Read-only, memory-mapped view of a pack."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size + _TRAILER.size:
+                raise ValueError("{}: not a PyQC pack".format(path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _ = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{}: not a PyQC pack".format(path))
+        table_offset, count, end = _TRAILER.unpack_from(
+            self._map, len(self._map) - _TRAILER.size
+        )
+        if end != END_MAGIC:
+            raise ValueError("{}: truncated pack".format(path))
+
+        names_offset = table_offset + count * _ENTRY.size
+        names_end = len(self._map) - _TRAILER.size
+        if not _HEADER.size <= table_offset <= names_offset <= names_end:
+            raise ValueError("{}: corrupt pack".format(path))
+        self.entries = list(_ENTRY.iter_unpack(self._map[table_offset:names_offset]))
+        raw = self._map[names_offset:names_end]
+        self.member_names = []
+        start = 0
+        for offset, size, _, end in self.entries:
+            in_bounds = _HEADER.size <= offset and offset + size <= table_offset
+            if not in_bounds or not start <= end <= len(raw):
+                raise ValueError("{}: corrupt pack".format(path))
+            self.member_names.append(raw[start:end].decode("utf-8", "surrogateescape"))
+            start = end
+        self._rows = {name: row for row, name in enumerate(self.member_names)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, member):
+        return member in self._rows
+
+    def names(self):
+        return self.member_names
+
+    def _entry(self, member):
+        row = self._rows.get(member)
+        if row is None:
+            raise FileNotFoundError("{}: no member {!r}".format(self.path, member))
+        return self.entries[row]
+
+    def read(self, member):
+        """The stored blob of `member`, as a memoryview into the mapping."""
+        offset, size, _, _ = self._entry(member)
+        return memoryview(self._map)[offset : offset + size]
+
+    def image(self, member):
+        """`member` as a QImage; previews alias the mapping without a copy."""
+        offset, size, kind, _ = self._entry(member)
+        if kind == ENCODED:
+            return QImage.fromData(self.read(member))
+        width, height, stride, fmt = _PREVIEW.unpack_from(self._map, offset)
+        if _PREVIEW.size + height * stride > size:
+            raise ValueError("{}: corrupt preview for {!r}".format(self.path, member))
+        pixels = np.frombuffer(
+            self._map, np.uint8, count=height * stride, offset=offset + _PREVIEW.size
+        )
+        image = QImage(pixels.data, width, height, stride, QImage.Format(fmt))
+        image._array = pixels  # keeps the mapping alive as long as the image
+        return image
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_reader(path, _size, _mtime_ns):
+    return PackReader(path)
+
+
+def open_pack(path):
+    """The PackReader for `path`, kept mapped for reuse until it changes."""
+    st = os.stat(path)
+    return _cached_reader(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def preview_blob(image, size):
+    """Serialise `image`, shrunk to fit `size` x `size`, as a PREVIEW blob.
+
+    Grayscale images stay single-channel; others are stored as 32-bit.
+    """
+    if max(image.width(), image.height()) > size:
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    if image.isGrayscale() and not image.hasAlphaChannel():
+        fmt = QImage.Format_Grayscale8
+    elif image.hasAlphaChannel():
+        fmt = QImage.Format_ARGB32
+    else:
+        fmt = QImage.Format_RGB32
+    image = image.convertToFormat(fmt)
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    header = _PREVIEW.pack(image.width(), image.height(), image.bytesPerLine(), fmt)
+    return header + bytes(bits)
+
+
+class PackWriter:
+    """Writes a new pack, or appends to an existing one.
+
+    Use as a context manager. The table is written on exit even after an
+    error, so everything added up to that point stays readable.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self._entries = []
+        self._names = []
+        self._tmp = None
+        if append and os.path.exists(path):
+            reader = PackReader(path)
+            self._entries = list(reader.entries)
+            self._names = list(reader.member_names)
+            reader._map.close()
+            # Never truncate: other processes may have the pack mapped
+            self._file = open(path, "r+b")
+            self._file.seek(0, os.SEEK_END)
+        else:
+            # Never overwrite in place: other processes may have the old pack mapped
+            fd, self._tmp = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(path)), suffix=".part"
+            )
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(self._tmp, 0o666 & ~umask)  # as open() would create it
+            self._file = os.fdopen(fd, "wb")
+            self._file.write(_HEADER.pack(MAGIC, VERSION, 0))
+        self._known = set(self._names)
+        self._name_bytes = sum(len(n.encode("utf-8", "surrogateescape")) for n in self._names)
+
+    def __contains__(self, name):
+        return name in self._known
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, name, blob, kind=ENCODED):
+        if name in self._known:
+            raise ValueError("duplicate pack member {!r}".format(name))
+        offset = self._file.tell()
+        self._file.write(blob)
+        self._name_bytes += len(name.encode("utf-8", "surrogateescape"))
+        self._entries.append((offset, len(blob), kind, self._name_bytes))
+        self._names.append(name)
+        self._known.add(name)
+
+    def close(self):
+        try:
+            with self._file:
+                table_offset = self._file.tell()
+                for entry in self._entries:
+                    self._file.write(_ENTRY.pack(*entry))
+                for name in self._names:
+                    self._file.write(name.encode("utf-8", "surrogateescape"))
+                self._file.write(_TRAILER.pack(table_offset, len(self._entries), END_MAGIC))
+            if self._tmp is not None:
+                os.replace(self._tmp, self.path)
+        except BaseException:
+            if self._tmp is not None:
+                os.unlink(self._tmp)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,115 @@
+"""Compact, append-only storage for the session's file paths.
+
+QC datasets are usually BIDS-style trees where thousands of images share the
+same handful of directories, so keeping one full ``str`` per row mostly stores
+the same prefixes over and over. ``PathStore`` interns each directory prefix
+once and packs the leaf names into a single UTF-8 buffer with an offset table,
+which brings a million-row session down from hundreds of MB to tens.
+"""
+
+from array import array
+from collections.abc import Sequence
+import os
+import sys
+
+
+def _split(path):
+    """Split `path` into (prefix, leaf) such that prefix + leaf == path.
+
+    Unlike os.path.split() this never normalises separators, so the exact
+    string that went in is what comes back out of the store. An archive
+    member at the top of its bundle (``bundle.zip::qc.png``) keeps the
+    ``bundle.zip::`` part in its prefix.
+    """
+    leaf = os.path.basename(path).rpartition("::")[2]
+    return path[: len(path) - len(leaf)], leaf
+
+
+class PathStore(Sequence):
+    """List-like container of paths backed by interned prefixes and arrays.
+
+    Supports the read-only Sequence protocol plus append()/extend(), and
+    compares equal to any sequence holding the same paths in the same order,
+    so it can stand in for the plain list that `MainWindow.filelist` used to
+    be. Row order is insertion order, which is what `_write_csv` relies on.
+    """
+
+    def __init__(self, paths=()):
+        self._dirs = []
+        self._dir_ids = {}
+        self._row_dirs = array("I")
+        self._leaves = bytearray()
+        self._leaf_ends = array("Q")
+        self.extend(paths)
+
+    def append(self, path):
+        prefix, leaf = _split(os.fspath(path))
+        dir_id = self._dir_ids.get(prefix)
+        if dir_id is None:
+            dir_id = len(self._dirs)
+            self._dirs.append(sys.intern(prefix))
+            self._dir_ids[prefix] = dir_id
+        self._row_dirs.append(dir_id)
+        self._leaves += leaf.encode("utf-8", "surrogateescape")
+        self._leaf_ends.append(len(self._leaves))
+
+    def extend(self, paths):
+        for path in paths:
+            self.append(path)
+
+    def _leaf(self, index):
+        start = self._leaf_ends[index - 1] if index else 0
+        end = self._leaf_ends[index]
+        return self._leaves[start:end].decode("utf-8", "surrogateescape")
+
+    def _normalize_index(self, index):
+        n = len(self._leaf_ends)
+        if index < 0:
+            index += n
+        if index < 0 or index >= n:
+            raise IndexError("PathStore index out of range")
+        return index
+
+    def __len__(self):
+        return len(self._leaf_ends)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = self._normalize_index(index)
+        return self._dirs[self._row_dirs[index]] + self._leaf(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, (str, bytes)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return "PathStore({!r})".format(list(self))
+
+    def prefix(self, index):
+        """Directory part of row `index`, i.e. everything before the leaf."""
+        return self._dirs[self._row_dirs[self._normalize_index(index)]]
+
+    def display_name(self, index):
+        """Table label for row `index`: the file name without its extension.
+
+        Computed on demand rather than stored; matches
+        os.path.splitext(os.path.basename(path))[0].
+        """
+        return os.path.splitext(self._leaf(self._normalize_index(index)))[0]
+
+    def nbytes(self):
+        """Approximate memory held by the store, in bytes."""
+        return (
+            sys.getsizeof(self._dirs)
+            + sum(sys.getsizeof(d) for d in self._dirs)
+            + sys.getsizeof(self._dir_ids)
+            + sys.getsizeof(self._row_dirs)
+            + sys.getsizeof(self._leaves)
+            + sys.getsizeof(self._leaf_ends)
+        )
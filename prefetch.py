@@ -0,0 +1,233 @@
+"""Read upcoming image files ahead of the rater, separately from decoding.
+
+On NFS/Lustre most of the time spent loading the next image is I/O latency,
+not decoding. A Prefetcher is told which files are coming up next (hint())
+and fetches them on a few worker threads while the rater looks at the
+current one. Fetched bytes go into a bounded pool, which
+SaneDefaultsImageLabel drains through its `byte_source` hook.
+
+How far ahead to read adapts to both sides: the window is the number of
+files the rater gets through in the time storage takes to deliver one
+(both tracked as moving averages), plus one, clamped to a fixed range.
+
+In "fadvise" mode nothing is held; the kernel is asked to pull upcoming
+files into the page cache with posix_fadvise(WILLNEED) instead. Only the
+first page is read, which is what the storage latency is timed on.
+"""
+
+import collections
+import math
+import os
+import threading
+import time
+
+import archive
+import nifti
+import pack
+
+DEFAULT_BUDGET = 64 * 1024 * 1024
+MODES = ("read", "fadvise", "off")
+
+# Weight of the newest sample in the moving averages
+_ALPHA = 0.3
+# Bytes read from each file in "fadvise" mode to time the storage
+_PAGE = 4096
+
+
+def _prefetchable(path):
+    """Whether `path` is read as a plain byte stream by the label."""
+    if archive.is_member(path):
+        return not pack.is_pack(archive.split_member(path)[0])
+    return not nifti.is_nifti(path)
+
+
+def _read(path):
+    if archive.is_member(path):
+        return archive.read_member(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _fadvise(path):
+    if archive.is_member(path):
+        path = archive.split_member(path)[0]
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        os.pread(fd, _PAGE, 0)  # waits one round trip to storage
+    finally:
+        os.close(fd)
+
+
+class Prefetcher:
+    """Bounded, adaptive read-ahead of upcoming files on worker threads."""
+
+    def __init__(
+        self,
+        mode="read",
+        budget=DEFAULT_BUDGET,
+        workers=4,
+        min_window=2,
+        max_window=32,
+        clock=time.monotonic,
+    ):
+        if mode not in MODES:
+            raise ValueError("unknown prefetch mode {!r}".format(mode))
+        if mode == "fadvise" and not hasattr(os, "posix_fadvise"):
+            mode = "read"
+        self.mode = mode
+        self.budget = budget
+        self.min_window = min_window
+        self.max_window = max_window
+        self._clock = clock
+
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._in_flight = set()
+        self._pool = collections.OrderedDict()
+        self._wanted = set()
+        self._nbytes = 0
+        self._closed = False
+
+        self._last_hint = None
+        self.interval = None  # seconds between the rater's moves
+        self.latency = None  # seconds to fetch one file
+        self.hits = 0
+        self.misses = 0
+
+        self.workers = workers
+        self._threads = []
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def window(self):
+        """How many upcoming files to keep fetched."""
+        if self.interval is None or self.latency is None:
+            return max(self.min_window, min(4, self.max_window))
+        ahead = math.ceil(self.latency / max(self.interval, 1e-3)) + 1
+        return max(self.min_window, min(ahead, self.max_window))
+
+    def hint(self, upcoming):
+        """Replace the work queue with the first window() of `upcoming`,
+        the paths the rater will probably look at next, nearest first.
+        The worker threads are started on the first call."""
+        if self.mode == "off" or self._closed:
+            return
+        now = self._clock()
+        if self._last_hint is not None:
+            self.interval = _ewma(self.interval, now - self._last_hint)
+        self._last_hint = now
+
+        window = self.window()
+        with self._cond:
+            if not self._threads and not self._closed:
+                for i in range(self.workers):
+                    thread = threading.Thread(
+                        target=self._work, name="pyqc-prefetch-{}".format(i), daemon=True
+                    )
+                    thread.start()
+                    self._threads.append(thread)
+            wanted = []
+            for path in upcoming:
+                if len(wanted) >= window:
+                    break
+                if _prefetchable(path):
+                    wanted.append(path)
+            # Files the rater has moved away from are not worth their memory
+            self._wanted = set(wanted)
+            for path in [p for p in self._pool if p not in self._wanted]:
+                self._nbytes -= len(self._pool.pop(path))
+            self._queue = collections.deque(
+                p for p in wanted if p not in self._pool and p not in self._in_flight
+            )
+            self._cond.notify_all()
+
+    def take(self, path):
+        """Prefetched bytes of `path`, removed from the pool, or None."""
+        with self._cond:
+            data = self._pool.pop(path, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self._nbytes -= len(data)
+            self.hits += 1
+            return data
+
+    def release(self, nbytes):
+        """Drop the oldest fetched files until `nbytes` are freed, or none
+        are left. Returns the number of bytes freed."""
+        freed = 0
+        with self._cond:
+            while self._pool and freed < nbytes:
+                _, data = self._pool.popitem(last=False)
+                self._nbytes -= len(data)
+                freed += len(data)
+        return freed
+
+    def wait(self, timeout=None):
+        """Block until the queue is drained (for tests and benchmarks)."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._queue and not self._in_flight, timeout
+            )
+
+    def clear(self):
+        with self._cond:
+            self._queue.clear()
+            self._wanted = set()
+            self._pool.clear()
+            self._nbytes = 0
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if self._closed:
+                    return
+                path = self._queue.popleft()
+                self._in_flight.add(path)
+
+            start = self._clock()
+            data = None
+            try:
+                if self.mode == "fadvise":
+                    _fadvise(path)
+                else:
+                    data = bytes(_read(path))
+            except Exception:
+                pass  # whatever failed, the label reports it when it gets there
+            finally:
+                elapsed = self._clock() - start
+                with self._cond:
+                    self._in_flight.discard(path)
+                    self.latency = _ewma(self.latency, elapsed)
+                    if data is not None and path in self._wanted:
+                        self._store(path, data)
+                    self._cond.notify_all()
+
+    def _store(self, path, data):
+        old = self._pool.pop(path, None)
+        if old is not None:
+            self._nbytes -= len(old)
+        self._pool[path] = data
+        self._nbytes += len(data)
+        while self._nbytes > self.budget:
+            _, evicted = self._pool.popitem(last=False)
+            self._nbytes -= len(evicted)
+
+
+def _ewma(average, sample):
+    if average is None:
+        return sample
+    return average + _ALPHA * (sample - average)
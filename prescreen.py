@@ -0,0 +1,186 @@
+"""Cheap automatic checks that flag broken or blank QC images.
+
+screen() decodes one image and computes a few vectorized statistics on its
+grayscale pixels, then gives a verdict:
+
+    unreadable  the file is missing or does not decode
+    blank       (almost) every pixel has the same value
+    truncated   the bottom rows are a single flat colour, which is how a
+                JPEG cut off mid-file decodes
+    tiny        smaller than MIN_SIDE pixels across
+    ok          none of the above
+
+Prescreener runs screen() over a session's files in a process pool, in
+batches, and is polled from the GUI thread so results can be written to
+the table as they come in.
+"""
+
+import concurrent.futures
+import multiprocessing
+
+import numpy as np
+from PyQt5.QtGui import QImage, QImageReader
+
+import archive
+import nifti
+import pack
+from imageops import array_to_qimage, qimage_view
+
+OK = "ok"
+VERDICTS = (OK, "unreadable", "blank", "truncated", "tiny")
+
+# A pixel value shared by at least this fraction of the image means blank
+BLANK_FRACTION = 0.98
+# ...as does a standard deviation (on a 0-255 scale) below this
+BLANK_STD = 1.0
+# Flat rows at the bottom covering at least this fraction mean truncated
+TRUNCATED_FRACTION = 0.05
+MIN_SIDE = 8
+
+BATCH = 32
+
+
+def read_image(path):
+    """The image at `path` as a QImage, or raise OSError/ValueError.
+
+    `path` may be an archive or pack member; a NIfTI volume reads as the
+    montage of its middle slices.
+    """
+    if nifti.is_nifti(path) and not archive.is_member(path):
+        return array_to_qimage(nifti.montage(path)).copy()
+    if archive.is_member(path):
+        bundle, member = archive.split_member(path)
+        if pack.is_pack(bundle):
+            image = pack.open_pack(bundle).image(member)
+        else:
+            image = QImage.fromData(archive.read_member(path))
+        error = "not a decodable image"
+    else:
+        reader = QImageReader(path)
+        image = reader.read()
+        error = reader.errorString()
+    if image.isNull():
+        raise ValueError(error)
+    return image
+
+
+def _grayscale(path):
+    """(height, width) uint8 pixels of the image at `path`, or raise."""
+    if nifti.is_nifti(path) and not archive.is_member(path):
+        return nifti.montage(path)
+    image = read_image(path)
+    return qimage_view(image.convertToFormat(QImage.Format_Grayscale8)).copy()
+
+
+def _flat_tail(pixels):
+    """Number of identical, uniform rows at the bottom of `pixels`."""
+    rows_flat = (pixels == pixels[:, :1]).all(axis=1)
+    same_as_last = (pixels == pixels[-1]).all(axis=1)
+    tail = rows_flat & same_as_last
+    if not tail[-1]:
+        return 0
+    breaks = np.flatnonzero(~tail)
+    return len(tail) - (breaks[-1] + 1 if breaks.size else 0)
+
+
+def screen(path):
+    """Statistics and verdict for one image, as a plain dict."""
+    try:
+        pixels = _grayscale(path)
+    except (OSError, ValueError) as exc:
+        return {"path": path, "verdict": "unreadable", "error": str(exc) or "unreadable"}
+
+    height, width = pixels.shape
+    result = {"path": path, "width": int(width), "height": int(height)}
+    if not pixels.size:
+        result["verdict"] = "unreadable"
+        return result
+    values = pixels.ravel()
+    result["mean"] = float(values.mean())
+    result["std"] = float(values.std())
+    result["flat"] = float(np.bincount(values, minlength=256).max() / values.size)
+    tail = _flat_tail(pixels)
+
+    if result["flat"] >= BLANK_FRACTION or result["std"] < BLANK_STD:
+        result["verdict"] = "blank"
+    elif tail >= max(1, TRUNCATED_FRACTION * height) and tail < height:
+        result["verdict"] = "truncated"
+    elif min(width, height) < MIN_SIDE:
+        result["verdict"] = "tiny"
+    else:
+        result["verdict"] = OK
+    return result
+
+
+def screen_batch(paths):
+    return [screen(p) for p in paths]
+
+
+def describe(result):
+    """One-line summary of a screen() result, for tooltips and reports."""
+    if "error" in result:
+        return "{}: {}".format(result["verdict"], result["error"])
+    if "mean" not in result:
+        return result["verdict"]
+    return "{}: {}x{}, mean {:.1f}, sd {:.1f}, {:.0%} one value".format(
+        result["verdict"],
+        result["width"],
+        result["height"],
+        result["mean"],
+        result["std"],
+        result["flat"],
+    )
+
+
+class Prescreener:
+    """Screens (row, path) pairs in a pool of worker processes.
+
+    Workers are spawned rather than forked, so they start clean instead of
+    inheriting a copy of the GUI process. Call results() periodically to
+    collect finished rows; cancel() stops outstanding work.
+
+    Subclasses run other per-file work the same way by overriding `batch`
+    (a module-level function, so it pickles) and failed().
+    """
+
+    batch = staticmethod(screen_batch)
+
+    def __init__(self, rows_and_paths, workers=None):
+        self.total = len(rows_and_paths)
+        self.done = 0
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._pending = {}
+        for start in range(0, self.total, BATCH):
+            batch = rows_and_paths[start : start + BATCH]
+            future = self._pool.submit(self.batch, [p for _, p in batch])
+            self._pending[future] = [r for r, _ in batch]
+
+    @staticmethod
+    def failed(exc):
+        """Result for each row of a batch whose worker died."""
+        return {"verdict": "unreadable", "error": str(exc)}
+
+    @property
+    def finished(self):
+        return not self._pending
+
+    def results(self):
+        """[(row, result)] for batches finished since the last call."""
+        out = []
+        for future in [f for f in self._pending if f.done()]:
+            rows = self._pending.pop(future)
+            try:
+                batch = future.result()
+            except Exception as exc:  # a worker died; don't lose the rows
+                batch = [self.failed(exc) for _ in rows]
+            out.extend(zip(rows, batch))
+        self.done += len(out)
+        if self.finished:
+            self._pool.shutdown(wait=False)
+        return out
+
+    def cancel(self):
+        self._pending.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
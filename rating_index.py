@@ -0,0 +1,520 @@
+"""Bitmap indexes over the rating columns of a session.
+
+Each rating column keeps its cells as small integer codes (one ``array``
+slot per row) plus a RowBitmap per value that has been asked about, so
+"which rows are rated 0?" is answered by handing out a live bitmap rather
+than by scanning or copying the table. RowBitmap keeps a Fenwick tree of per-block
+popcounts next to its bits, which makes counting and next/previous-member
+lookups O(log n) no matter how sparse the set is. Intersections and
+differences of two bitmaps combine their bytes with numpy.
+"""
+
+from array import array
+
+import numpy as np
+
+# Bits per Fenwick block. Within a block, next/prev scan at most
+# BLOCK_BITS // 8 bytes using bytes.lstrip/rstrip, which run at C speed.
+BLOCK_BITS = 4096
+_BLOCK_BYTES = BLOCK_BITS // 8
+
+# RatingIndex.set_rows rebuilds bitmaps when it changes at least one row in
+# this many
+_BULK_RATIO = 64
+
+
+class _Fenwick:
+    """Binary indexed tree over non-negative integer counts."""
+
+    def __init__(self, counts=()):
+        tree = array("q", [0])
+        tree.extend(counts)
+        n = len(tree) - 1
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def nbytes(self):
+        return self._tree.itemsize * len(self._tree)
+
+    def add(self, index, delta):
+        i = index + 1
+        n = len(self._tree) - 1
+        while i <= n:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index):
+        """Sum of counts[0..index] inclusive; 0 for index < 0."""
+        total = 0
+        i = min(index + 1, len(self._tree) - 1)
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, k):
+        """Smallest index whose inclusive prefix sum is >= k (k >= 1)."""
+        pos = 0
+        n = len(self._tree) - 1
+        step = 1 << n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= n and self._tree[nxt] < k:
+                pos = nxt
+                k -= self._tree[nxt]
+            step >>= 1
+        return pos
+
+
+class RowBitmap:
+    """Growable set of row ids stored as a bitmap.
+
+    len() is the number of members; `size` is the number of rows covered.
+    next()/prev() find the nearest member in either direction in
+    O(log n), and iteration yields members in ascending order.
+    """
+
+    def __init__(self, size=0, fill=False):
+        self._bits = bytearray()
+        self._size = 0
+        self._count = 0
+        self._blocks = _Fenwick()
+        self.resize(size, fill)
+
+    @classmethod
+    def from_int(cls, value, size):
+        bitmap = cls()
+        bitmap.assign_int(value, size)
+        return bitmap
+
+    def assign_int(self, value, size):
+        """Replace the contents in place with the bits of `value`."""
+        self._bits = bytearray(value.to_bytes((size + 7) // 8, "little"))
+        self._size = size
+        self._reindex()
+
+    @classmethod
+    def from_rows(cls, rows, size):
+        """Bitmap of `size` rows with the given member rows set."""
+        bitmap = cls()
+        bitmap._bits = bytearray((size + 7) // 8)
+        bitmap._size = size
+        for row in rows:
+            bitmap._bits[row >> 3] |= 1 << (row & 7)
+        bitmap._reindex()
+        return bitmap
+
+    @classmethod
+    def from_ranges(cls, ranges, size):
+        """Bitmap of `size` rows with the rows of each (start, stop) range
+        set, a byte at a time."""
+        bitmap = cls()
+        bitmap._bits = bytearray((size + 7) // 8)
+        bitmap._size = size
+        for start, stop in ranges:
+            bitmap._set_range(max(start, 0), min(stop, size))
+        bitmap._reindex()
+        return bitmap
+
+    def _set_range(self, start, stop):
+        """Set rows start..stop-1 without updating the block counts."""
+        if start >= stop:
+            return
+        first, last = start >> 3, (stop - 1) >> 3
+        low = (0xFF << (start & 7)) & 0xFF
+        high = (1 << (((stop - 1) & 7) + 1)) - 1
+        if first == last:
+            self._bits[first] |= low & high
+            return
+        self._bits[first] |= low
+        self._bits[first + 1 : last] = b"\xff" * (last - first - 1)
+        self._bits[last] |= high
+
+    def to_int(self):
+        return int.from_bytes(self._bits, "little")
+
+    def _reindex(self):
+        counts = [
+            int.from_bytes(self._bits[i : i + _BLOCK_BYTES], "little").bit_count()
+            for i in range(0, len(self._bits), _BLOCK_BYTES)
+        ]
+        self._blocks = _Fenwick(counts)
+        self._count = sum(counts)
+
+    @property
+    def size(self):
+        return self._size
+
+    def resize(self, size, fill=False):
+        """Grow or shrink to cover `size` rows; new rows are members iff
+        `fill` is true."""
+        old = self._size
+        if size == old:
+            return
+        self._bits = bytearray(self._bits[: (size + 7) // 8])
+        self._bits.extend(bytes((size + 7) // 8 - len(self._bits)))
+        self._size = size
+        if size < old:
+            if size % 8:
+                self._bits[-1] &= (1 << (size % 8)) - 1
+        elif fill:
+            self._set_range(old, size)
+        self._reindex()
+
+    def _combine(self, other, op):
+        """Bitmap of `self.size` rows from `op` over both bitmaps' bytes;
+        rows past the end of `other` count as non-members."""
+        ours = np.frombuffer(self._bits, np.uint8)
+        theirs = np.zeros_like(ours)
+        common = min(len(ours), len(other._bits))
+        theirs[:common] = np.frombuffer(other._bits, np.uint8, count=common)
+        result = RowBitmap()
+        result._bits = bytearray(op(ours, theirs).tobytes())
+        result._size = self._size
+        if self._size % 8:
+            result._bits[-1] &= (1 << (self._size % 8)) - 1
+        result._reindex()
+        return result
+
+    def __and__(self, other):
+        return self._combine(other, np.bitwise_and)
+
+    def __or__(self, other):
+        return self._combine(other, np.bitwise_or)
+
+    def __xor__(self, other):
+        return self._combine(other, np.bitwise_xor)
+
+    def __len__(self):
+        return self._count
+
+    def nbytes(self):
+        """Bytes held by the bits and their block counts."""
+        return len(self._bits) + self._blocks.nbytes()
+
+    def __contains__(self, row):
+        if row < 0 or row >= self._size:
+            return False
+        return bool(self._bits[row >> 3] & (1 << (row & 7)))
+
+    def add(self, row):
+        if row < 0 or row >= self._size:
+            raise IndexError("RowBitmap index out of range")
+        mask = 1 << (row & 7)
+        if not self._bits[row >> 3] & mask:
+            self._bits[row >> 3] |= mask
+            self._blocks.add(row // BLOCK_BITS, 1)
+            self._count += 1
+
+    def discard(self, row):
+        if row < 0 or row >= self._size:
+            return
+        mask = 1 << (row & 7)
+        if self._bits[row >> 3] & mask:
+            self._bits[row >> 3] &= ~mask & 0xFF
+            self._blocks.add(row // BLOCK_BITS, -1)
+            self._count -= 1
+
+    def rank(self, row):
+        """Number of members strictly before `row`."""
+        if row <= 0:
+            return 0
+        row = min(row, self._size)
+        block = row // BLOCK_BITS
+        start = block * _BLOCK_BYTES
+        head = int.from_bytes(self._bits[start : row >> 3], "little").bit_count()
+        if row & 7:
+            head += (self._bits[row >> 3] & ((1 << (row & 7)) - 1)).bit_count()
+        return self._blocks.prefix(block - 1) + head
+
+    def _first_in(self, byte_start, byte_end):
+        seg = bytes(self._bits[byte_start:byte_end])
+        stripped = seg.lstrip(b"\0")
+        if not stripped:
+            return None
+        i = byte_start + len(seg) - len(stripped)
+        b = self._bits[i]
+        return i * 8 + (b & -b).bit_length() - 1
+
+    def _last_in(self, byte_start, byte_end):
+        seg = bytes(self._bits[byte_start:byte_end])
+        stripped = seg.rstrip(b"\0")
+        if not stripped:
+            return None
+        i = byte_start + len(stripped) - 1
+        return i * 8 + self._bits[i].bit_length() - 1
+
+    def next(self, row):
+        """Smallest member >= `row`, or None."""
+        row = max(row, 0)
+        if row >= self._size or not self._count:
+            return None
+        byte = row >> 3
+        b = self._bits[byte] >> (row & 7)
+        if b:
+            return row + (b & -b).bit_length() - 1
+        block = row // BLOCK_BITS
+        found = self._first_in(byte + 1, (block + 1) * _BLOCK_BYTES)
+        if found is not None:
+            return found
+        seen = self._blocks.prefix(block)
+        if seen >= self._count:
+            return None
+        block = self._blocks.find(seen + 1)
+        return self._first_in(block * _BLOCK_BYTES, (block + 1) * _BLOCK_BYTES)
+
+    def prev(self, row):
+        """Largest member <= `row`, or None."""
+        row = min(row, self._size - 1)
+        if row < 0 or not self._count:
+            return None
+        byte = row >> 3
+        b = self._bits[byte] & ((1 << ((row & 7) + 1)) - 1)
+        if b:
+            return byte * 8 + b.bit_length() - 1
+        block = row // BLOCK_BITS
+        found = self._last_in(block * _BLOCK_BYTES, byte)
+        if found is not None:
+            return found
+        seen = self._blocks.prefix(block - 1)
+        if not seen:
+            return None
+        block = self._blocks.find(seen)
+        return self._last_in(block * _BLOCK_BYTES, (block + 1) * _BLOCK_BYTES)
+
+    def __iter__(self):
+        for i, b in enumerate(self._bits):
+            while b:
+                low = b & -b
+                yield i * 8 + low.bit_length() - 1
+                b ^= low
+
+
+class _Column:
+    """Codes and value bitmaps for a single rating column. Code 0 is "".
+
+    Only the "" bitmap is kept from the start; the bitmap for any other
+    value is built by one pass over `codes` the first time it is asked for
+    and maintained from then on, so free-text columns with thousands of
+    distinct values don't cost a bitmap each. `rated` is False for a
+    machine-filled column, whose empty cells do not make a row unrated.
+    """
+
+    def __init__(self, rows):
+        self.rated = True
+        self.codes = array("H", bytes(2 * rows))
+        self.values = [""]
+        self.counts = [rows]
+        self.ids = {"": 0}
+        self.bitmaps = {0: RowBitmap(rows, fill=True)}
+
+    def code_for(self, value):
+        code = self.ids.get(value)
+        if code is None:
+            code = self.ids[value] = len(self.values)
+            self.values.append(value)
+            self.counts.append(0)
+            if code > 0xFFFF and self.codes.typecode == "H":
+                self.codes = array("I", self.codes)
+        return code
+
+    def bitmap(self, code):
+        bitmap = self.bitmaps.get(code)
+        if bitmap is None:
+            bitmap = self.bitmaps[code] = RowBitmap.from_rows(
+                (row for row, c in enumerate(self.codes) if c == code),
+                len(self.codes),
+            )
+        return bitmap
+
+    def fill(self, values):
+        """Replace every cell at once from a sequence of one value per row."""
+        codes = [self.code_for(v) for v in values]
+        self.codes = array("I" if len(self.values) > 0x10000 else "H", codes)
+        self.counts = [0] * len(self.values)
+        for code in codes:
+            self.counts[code] += 1
+        self.bitmaps = {}
+        self.bitmap(0)
+
+    def set(self, row, value):
+        code = self.code_for(value)
+        old = self.codes[row]
+        if old == code:
+            return
+        self.codes[row] = code
+        self.counts[old] -= 1
+        self.counts[code] += 1
+        if old in self.bitmaps:
+            self.bitmaps[old].discard(row)
+        if code in self.bitmaps:
+            self.bitmaps[code].add(row)
+
+    def set_rows(self, rows, values):
+        """set() for many rows at once. The touched bitmaps are rebuilt
+        once each from the rows that left and joined them, instead of
+        being updated one row at a time."""
+        joined, left = {}, {}
+        for row, value in zip(rows, values):
+            code = self.code_for(value)
+            old = self.codes[row]
+            if old == code:
+                continue
+            self.codes[row] = code
+            self.counts[old] -= 1
+            self.counts[code] += 1
+            left.setdefault(old, []).append(row)
+            joined.setdefault(code, []).append(row)
+        size = len(self.codes)
+        for code in joined.keys() | left.keys():
+            bitmap = self.bitmaps.get(code)
+            if bitmap is None:
+                continue
+            bits = bitmap.to_int()
+            bits &= ~RowBitmap.from_rows(left.get(code, ()), size).to_int()
+            bits |= RowBitmap.from_rows(joined.get(code, ()), size).to_int()
+            bitmap.assign_int(bits, size)
+
+    def append_rows(self, count):
+        size = len(self.codes) + count
+        self.codes.extend(array(self.codes.typecode, bytes(self.codes.itemsize * count)))
+        self.counts[0] += count
+        for code, bitmap in self.bitmaps.items():
+            bitmap.resize(size, fill=(code == 0))
+
+
+class RatingIndex:
+    """Per-column value index for the rating cells of a table.
+
+    Columns are numbered as in the table: column 0 holds the file paths and
+    is not indexed, columns 1.. are rating columns. Every cell starts out as
+    "" (unrated). Alongside the per-column bitmaps the index maintains the
+    set of unrated rows, those with at least one empty rating cell. Columns
+    marked with set_rated(column, False) hold derived values and are left
+    out of it.
+    """
+
+    def __init__(self, rows=0, columns=1):
+        self._unrated = RowBitmap()
+        self.reset(rows, columns)
+
+    def reset(self, rows, columns):
+        self._rows = rows
+        self._columns = [_Column(rows) for _ in range(max(columns - 1, 0))]
+        self._unrated.assign_int(
+            (1 << rows) - 1 if self._columns else 0, rows
+        )
+
+    def _recompute_unrated(self):
+        value = 0
+        for col in self._columns:
+            if col.rated:
+                value |= col.bitmaps[0].to_int()
+        self._unrated.assign_int(value, self._rows)
+
+    def set_rated(self, column, rated):
+        """Whether empty cells of `column` count towards unrated()."""
+        col = self._columns[column - 1]
+        if col.rated != rated:
+            col.rated = rated
+            self._recompute_unrated()
+
+    @property
+    def row_count(self):
+        return self._rows
+
+    def nbytes(self):
+        """Approximate memory held by the index, in bytes: the cell codes
+        and every bitmap, not counting the distinct values themselves."""
+        total = self._unrated.nbytes()
+        for col in self._columns:
+            total += col.codes.itemsize * len(col.codes)
+            total += sum(bitmap.nbytes() for bitmap in col.bitmaps.values())
+        return total
+
+    @property
+    def column_count(self):
+        return len(self._columns) + 1
+
+    def get(self, row, column):
+        col = self._columns[column - 1]
+        return col.values[col.codes[row]]
+
+    def set(self, row, column, value):
+        if column <= 0 or column > len(self._columns) or not 0 <= row < self._rows:
+            return
+        self._columns[column - 1].set(row, value)
+        if any(col.rated and col.codes[row] == 0 for col in self._columns):
+            self._unrated.add(row)
+        else:
+            self._unrated.discard(row)
+
+    def set_rows(self, column, rows, values):
+        """set() for each row in `rows` with the matching entry of
+        `values`, in one pass per bitmap; for bulk edits."""
+        if column <= 0 or column > len(self._columns):
+            return
+        cells = [(row, value) for row, value in zip(rows, values) if 0 <= row < self._rows]
+        if len(cells) * _BULK_RATIO < self._rows:
+            # Rebuilding a bitmap costs a pass over all rows; a few O(log n)
+            # updates are cheaper
+            for row, value in cells:
+                self.set(row, column, value)
+            return
+        self._columns[column - 1].set_rows(*zip(*cells))
+        self._recompute_unrated()
+
+    def fill_column(self, column, values):
+        """Bulk-load `column` from one value per row, e.g. straight from a
+        CSV reader, far faster than calling set() for each cell."""
+        if len(values) != self._rows:
+            raise ValueError("expected one value per row")
+        self._columns[column - 1].fill(values)
+        self._recompute_unrated()
+
+    def append_rows(self, count):
+        if count <= 0:
+            return
+        for col in self._columns:
+            col.append_rows(count)
+        self._rows += count
+        self._unrated.resize(self._rows, fill=any(col.rated for col in self._columns))
+
+    def insert_column(self, column):
+        self._columns.insert(column - 1, _Column(self._rows))
+        self._unrated.assign_int((1 << self._rows) - 1, self._rows)
+
+    def remove_column(self, column):
+        del self._columns[column - 1]
+        self._recompute_unrated()
+
+    def rows_with(self, column, value):
+        """Live bitmap of the rows whose `column` cell equals `value`.
+
+        The bitmap is the index's own and keeps tracking later edits,
+        including for a value that has not been entered yet.
+        """
+        col = self._columns[column - 1]
+        return col.bitmap(col.code_for(value))
+
+    def value_counts(self, column):
+        """{value: row count} for every value currently in `column`."""
+        col = self._columns[column - 1]
+        return {v: n for v, n in zip(col.values, col.counts) if n}
+
+    def unrated(self):
+        """Live bitmap of the rows with at least one empty rating cell."""
+        return self._unrated
+
+    def first_empty_column(self, row):
+        """Leftmost rated column that is empty on `row`, or None."""
+        for column, col in enumerate(self._columns, start=1):
+            if col.rated and col.codes[row] == 0:
+                return column
+        return None
@@ -0,0 +1,149 @@
+"""Record a rating session's input, and replay it as a benchmark.
+
+With --record, MainWindow writes each key press, wheel turn and table click
+to a JSON-lines trace as it handles them, with the time since the session
+started:
+
+    {"t": 1.52, "type": "key", "key": 83, "text": "s", "modifiers": 0}
+    {"t": 1.61, "type": "wheel", "delta": 120}
+    {"t": 2.07, "type": "click", "row": 12, "column": 1}
+
+`pyqc replay` (see PyQC.replay_main) feeds a trace to a MainWindow, either
+as fast as it can or at the pace it was recorded. It times each event from
+dispatch until the event queue is drained again, and reports the latency
+distribution per kind of event.
+"""
+
+import json
+import time
+
+import numpy as np
+from PyQt5.QtCore import QEvent, QPoint, QPointF, Qt
+from PyQt5.QtGui import QKeyEvent, QWheelEvent
+
+
+class Recorder:
+    """Appends input events to a trace file."""
+
+    def __init__(self, path, clock=time.monotonic):
+        self._file = open(path, "w", encoding="utf-8")
+        self._clock = clock
+        self._start = clock()
+
+    def _write(self, event):
+        event = dict(t=round(self._clock() - self._start, 4), **event)
+        self._file.write(json.dumps(event) + "\n")
+
+    def key(self, event):
+        self._write(
+            {
+                "type": "key",
+                "key": event.key(),
+                "text": event.text(),
+                "modifiers": int(event.modifiers()),
+            }
+        )
+
+    def wheel(self, event):
+        self._write({"type": "wheel", "delta": event.angleDelta().y()})
+
+    def click(self, row, column):
+        self._write({"type": "click", "row": row, "column": column})
+
+    def close(self):
+        self._file.close()
+
+
+def load(path):
+    """The events of a trace, in order."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def label(event):
+    """Name an event is reported under, e.g. "key S" or "wheel"."""
+    if event["type"] != "key":
+        return event["type"]
+    text = event.get("text", "")
+    if text.isdigit():
+        return "key 0-9"
+    return "key " + (text.upper() if text.strip() else str(event["key"]))
+
+
+def dispatch(window, event):
+    """Deliver one trace event to `window` the way Qt would."""
+    kind = event["type"]
+    if kind == "key":
+        window.keyPressEvent(
+            QKeyEvent(
+                QEvent.KeyPress,
+                event["key"],
+                Qt.KeyboardModifiers(event.get("modifiers", 0)),
+                event.get("text", ""),
+            )
+        )
+    elif kind == "wheel":
+        window.wheelEvent(
+            QWheelEvent(
+                QPointF(),
+                QPointF(),
+                QPoint(),
+                QPoint(0, event["delta"]),
+                Qt.NoButton,
+                Qt.NoModifier,
+                Qt.NoScrollPhase,
+                False,
+            )
+        )
+    elif kind == "click":
+        window.switchToItem(event["row"], event["column"])
+    else:
+        raise ValueError("unknown trace event type {!r}".format(kind))
+
+
+def run(app, window, events, realtime=False, clock=time.perf_counter, sleep=time.sleep):
+    """Replay `events` against `window`; {label: [latency seconds]}."""
+    latencies = {}
+    start = clock()
+    for event in events:
+        if realtime:
+            wait = event.get("t", 0) - (clock() - start)
+            if wait > 0:
+                sleep(wait)
+        began = clock()
+        dispatch(window, event)
+        app.processEvents()
+        latencies.setdefault(label(event), []).append(clock() - began)
+    return latencies
+
+
+def summarize(latencies):
+    """{label: {"n", "p50", "p90", "p99", "max", "total"}} in milliseconds."""
+    summary = {}
+    for name, samples in sorted(latencies.items()):
+        ms = np.asarray(samples) * 1000
+        p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+        summary[name] = {
+            "n": int(ms.size),
+            "p50": float(p50),
+            "p90": float(p90),
+            "p99": float(p99),
+            "max": float(ms.max()),
+            "total": float(ms.sum()),
+        }
+    return summary
+
+
+def format_summary(summary):
+    lines = [
+        "{:<12} {:>6} {:>9} {:>9} {:>9} {:>9}".format(
+            "event", "n", "p50 ms", "p90 ms", "p99 ms", "max ms"
+        )
+    ]
+    for name, row in summary.items():
+        lines.append(
+            "{:<12} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                name, row["n"], row["p50"], row["p90"], row["p99"], row["max"]
+            )
+        )
+    return "\n".join(lines)
@@ -0,0 +1,195 @@
+"""Incremental substring index over a PathStore for jump-to-subject search.
+
+Display names are indexed by trigram (gram -> ascending row ids) so that a
+query of three or more characters only has to verify the rows sharing its
+rarest trigram. Shorter queries fall back to a prefix lookup over row ids
+sorted by display name. Directory prefixes are indexed separately, since
+they are shared by many rows and a subject ID usually appears there too.
+"""
+
+from array import array
+import bisect
+import itertools
+import threading
+
+
+def _trigrams(text):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """Case-insensitive substring search over the paths in a PathStore.
+
+    The index only ever reads the store; call update() (or let the next
+    query do it) after appending rows and only the new rows are indexed.
+    build_async() does the initial pass on a background thread; queries
+    issued before it finishes fall back to a linear scan, so results are
+    always correct, just slower until the index is ready.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        self._thread = None
+        self._indexed = 0
+        self._grams = {}
+        self._by_name = array("I")
+        self._dir_rows = {}
+
+    @property
+    def ready(self):
+        return self._thread is None or not self._thread.is_alive()
+
+    def build_async(self):
+        """Index all rows currently in the store on a daemon thread."""
+        if not self.ready:
+            return
+        self._thread = threading.Thread(
+            target=self.update, name="pyqc-search-index", daemon=True
+        )
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _name(self, row):
+        return self._store.display_name(row).lower()
+
+    def _dir(self, row):
+        return self._store.prefix(row).lower()
+
+    def update(self):
+        """Index rows appended to the store since the last update."""
+        with self._lock:
+            start, end = self._indexed, len(self._store)
+            if start >= end:
+                return
+            names = [self._name(row) for row in range(start, end)]
+            for row, name in enumerate(names, start):
+                for gram in _trigrams(name):
+                    postings = self._grams.get(gram)
+                    if postings is None:
+                        postings = self._grams[gram] = array("I")
+                    postings.append(row)
+                directory = self._dir(row)
+                postings = self._dir_rows.get(directory)
+                if postings is None:
+                    postings = self._dir_rows[directory] = array("I")
+                postings.append(row)
+
+            if end - start > 1024:
+                if start:
+                    names = [self._name(row) for row in range(start)] + names
+                self._by_name = array(
+                    "I", sorted(range(end), key=names.__getitem__)
+                )
+            else:
+                for row in range(start, end):
+                    bisect.insort(self._by_name, row, key=self._name)
+            self._indexed = end
+
+    def _matches(self, query, row):
+        if len(query) < 3:
+            return self._name(row).startswith(query)
+        return query in self._name(row) or query in self._dir(row)
+
+    def _gram_rows(self, query):
+        """Ascending rows whose display name has every trigram of `query`
+        (a superset of the rows actually containing it)."""
+        postings = [self._grams.get(g) for g in _trigrams(query)]
+        if any(p is None for p in postings):
+            return array("I")
+        return min(postings, key=len)
+
+    def _prefix_rows(self, query):
+        """Rows whose display name starts with `query`, in name order."""
+        lo = bisect.bisect_left(self._by_name, query, key=self._name)
+        hi = bisect.bisect_left(
+            self._by_name, query + "\U0010ffff", lo=lo, key=self._name
+        )
+        return self._by_name[lo:hi]
+
+    def find(self, query, start=0, reverse=False):
+        """First row at or after `start` (at or before, if `reverse`) whose
+        display name or directory contains `query`, wrapping around the ends
+        of the list. Queries shorter than three characters only match the
+        start of display names. Returns None if nothing matches."""
+        query = query.strip().lower()
+        n = len(self._store)
+        if not query or n == 0:
+            return None
+        start %= n
+
+        if not self.ready:
+            return next(
+                (r for r in _wrapped(range(n), start, reverse) if self._matches(query, r)),
+                None,
+            )
+
+        self.update()
+        with self._lock:
+            if len(query) < 3:
+                hits = [_nearest(self._prefix_rows(query), start, reverse)]
+            else:
+                hits = [
+                    _first(
+                        self._gram_rows(query),
+                        start,
+                        reverse,
+                        lambda r: query in self._name(r),
+                    )
+                ]
+                hits.extend(
+                    _first(postings, start, reverse)
+                    for directory, postings in self._dir_rows.items()
+                    if query in directory
+                )
+
+        hits = [r for r in hits if r is not None]
+        if not hits:
+            return None
+        if reverse:
+            return min(hits, key=lambda r: (start - r) % n)
+        return min(hits, key=lambda r: (r - start) % n)
+
+
+def _wrapped(seq, pos, reverse):
+    """Iterate `seq` starting at index `pos` and wrapping around."""
+    if reverse:
+        indices = itertools.chain(
+            range(pos, -1, -1), range(len(seq) - 1, pos, -1)
+        )
+    else:
+        indices = itertools.chain(range(pos, len(seq)), range(pos))
+    return (seq[i] for i in indices)
+
+
+def _first(rows, start, reverse, accept=None):
+    """First entry of ascending `rows` at or after `start` (at or before, if
+    `reverse`), wrapping around, that satisfies `accept`."""
+    if not rows:
+        return None
+    if reverse:
+        pos = bisect.bisect_right(rows, start) - 1
+        if pos < 0:
+            pos = len(rows) - 1
+    else:
+        pos = bisect.bisect_left(rows, start)
+        if pos == len(rows):
+            pos = 0
+    for row in _wrapped(rows, pos, reverse):
+        if accept is None or accept(row):
+            return row
+    return None
+
+
+def _nearest(rows, start, reverse):
+    """Like _first() for unordered `rows` that need no verification."""
+    if not rows:
+        return None
+    if reverse:
+        before = [r for r in rows if r <= start]
+        return max(before) if before else max(rows)
+    after = [r for r in rows if r >= start]
+    return min(after) if after else min(rows)
@@ -0,0 +1,649 @@
+"""`pyqc serve`: review a rating CSV from a web browser.
+
+For raters on a thin client, where a forwarded Qt window is too slow to
+use. ReviewServer is a small HTTP/1.1 server on asyncio:
+
+    GET  /                 the review page (same keys as the GUI)
+    GET  /api/session      the CSV's columns, row count and first unrated row
+    GET  /api/rows/<n>     row n: file, cells, preview and prefetch URLs
+    POST /api/rows/<n>     rate row n: {"column": name or index, "value": "1"}
+    POST /api/save         write the CSV now
+    GET  /preview/<n>      row n's image, shrunk to fit --preview-size
+
+Previews are encoded on a thread pool, as WebP for browsers that accept it
+and JPEG otherwise. Their ETag is derived from the source file's path,
+size and mtime, so a revalidation (If-None-Match) is answered from a stat,
+without decoding anything. Encoded previews are kept in memory and in the
+on-disk preview cache. Every row response names the previews of the next
+rows in a Link: rel=prefetch header, and the server starts encoding them
+before the browser asks.
+
+The disk cache is kept under DISK_BUDGET bytes by deleting its least
+recently used previews (a preview's mtime is its last use), checked at
+start and every PRUNE_EVERY previews written.
+
+Ratings go into a Session, which writes the CSV in the same format as
+MainWindow, SAVE_DELAY seconds after the last rating and on shutdown.
+
+Any web page the rater has open can send requests to a server on
+localhost, so requests must name this server in their Host header, by IP
+address, localhost, the listen address or the machine's name (any other
+hostname means a DNS rebinding attempt), and POSTs must carry JSON and come from the review page's own
+origin, if they say where they come from. A cross-site form or a "simple"
+fetch() cannot set Content-Type: application/json.
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import http
+import ipaddress
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import urllib.parse
+
+from PyQt5.QtCore import QBuffer, QIODevice, Qt
+from PyQt5.QtGui import QImage, QImageWriter
+
+import archive
+import cache_paths
+from image_cache import DecodedImageCache
+from prescreen import read_image
+from session import Session
+
+DEFAULT_PREVIEW_SIZE = 1024
+DEFAULT_PREFETCH = 4
+JPEG_QUALITY = 85
+# Encoded previews kept in memory, in bytes
+MEMORY_BUDGET = 64 * 1024 * 1024
+# Encoded previews kept in the disk cache, in bytes
+DISK_BUDGET = 1024 * 1024 * 1024
+PRUNE_EVERY = 64
+# Seconds from a rating until the CSV is written; later ratings join the save
+SAVE_DELAY = 1.0
+MAX_HEADERS = 100
+MAX_BODY = 64 * 1024
+
+Request = collections.namedtuple("Request", "method target version headers body")
+
+
+@functools.lru_cache(maxsize=None)
+def webp_supported():
+    return b"webp" in [bytes(f) for f in QImageWriter.supportedImageFormats()]
+
+
+def preview_etag(path, size, fmt):
+    """ETag of the `fmt` preview of `path` at `size`: changes with the
+    file (or the archive holding it). Raises OSError if it is missing."""
+    bundle = archive.split_member(path)[0] if archive.is_member(path) else path
+    st = os.stat(bundle)
+    key = "{}\0{}\0{}\0{}\0{}".format(
+        os.path.abspath(path), st.st_size, st.st_mtime_ns, size, fmt
+    )
+    return hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+
+
+def encode_preview(path, size, fmt):
+    """The image at `path`, shrunk to fit `size` x `size`, encoded as `fmt`
+    ("jpeg" or "webp"). Raises OSError or ValueError."""
+    image = read_image(path)
+    if max(image.width(), image.height()) > size:
+        image = image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    if image.format() == QImage.Format_Grayscale16:
+        image = image.convertToFormat(QImage.Format_Grayscale8)
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    if not image.save(buffer, fmt.upper(), JPEG_QUALITY):
+        raise ValueError("cannot encode {} as {}".format(path, fmt))
+    return bytes(buffer.data())
+
+
+def _etag_matches(header, etag):
+    """Whether an If-None-Match header value lists `etag`."""
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == f'"{etag}"' for tag in tags)
+
+
+async def _read_request(reader):
+    """The next Request on a connection, None once the client closed it.
+    Raises ValueError on a malformed request."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise ValueError("malformed request line") from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise ValueError("too many headers")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if not 0 <= length <= MAX_BODY:
+        raise ValueError("bad request body length")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method, target, version, headers, body)
+
+
+def _keep_alive(request):
+    connection = request.headers.get("connection", "").lower()
+    if request.version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+def _response(status, headers, body, keep_alive):
+    lines = ["HTTP/1.1 {} {}".format(status, http.HTTPStatus(status).phrase)]
+    headers = dict(headers)
+    if status != 304:
+        headers["Content-Length"] = str(len(body))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+    return head if status == 304 else head + body
+
+
+def _json(status, data, headers=()):
+    headers = dict(headers, **{"Content-Type": "application/json", "Cache-Control": "no-store"})
+    return status, headers, json.dumps(data).encode("utf-8")
+
+
+def _error(status, message):
+    return _json(status, {"error": message})
+
+
+def _hostname(netloc):
+    return urllib.parse.urlsplit("//" + netloc).hostname or ""
+
+
+def prune_cache(directory, budget):
+    """Delete the least recently used files of `directory` until the rest
+    fit in `budget` bytes."""
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        total -= size
+
+
+class ReviewServer:
+    """Serves one Session to browsers; see the module docstring."""
+
+    def __init__(
+        self,
+        session,
+        preview_size=DEFAULT_PREVIEW_SIZE,
+        prefetch=DEFAULT_PREFETCH,
+        cache_dir=None,
+        save_delay=SAVE_DELAY,
+        workers=2,
+        disk_budget=DISK_BUDGET,
+    ):
+        self.session = session
+        self.preview_size = preview_size
+        self.prefetch = prefetch
+        self.cache_dir = cache_dir or cache_paths.cache_dir("previews")
+        self.save_delay = save_delay
+        self.disk_budget = disk_budget
+        self.hostnames = set()
+        self.previews = DecodedImageCache(MEMORY_BUDGET)
+        self.port = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self._pending = {}
+        self._connections = set()
+        self._server = None
+        self._save_handle = None
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Listen on `host`:`port`; port 0 picks a free one (see .port)."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.hostnames = {"localhost", host, socket.gethostname(), socket.getfqdn()}
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._executor.submit(prune_cache, self.cache_dir, self.disk_budget)
+
+    async def close(self):
+        """Stop serving and write any unsaved ratings."""
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        self.save()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def save(self):
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if self.session.dirty:
+            self.session.save()
+
+    def _autosave(self):
+        try:
+            self.save()
+        except OSError as exc:
+            print("Warning: could not save {}: {}".format(self.session.path, exc), file=sys.stderr)
+
+    # Connections
+
+    async def _handle(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except ValueError as exc:
+                    status, headers, body = _error(400, str(exc))
+                    writer.write(_response(status, headers, body, False))
+                    break
+                if request is None:
+                    break
+                status, headers, body = await self._respond(request)
+                keep_alive = _keep_alive(request)
+                writer.write(_response(status, headers, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    def _allowed(self, request):
+        """None if `request` may be served, else an error response; see
+        the module docstring."""
+        host = request.headers.get("host", "")
+        name = _hostname(host)
+        try:
+            ipaddress.ip_address(name)
+        except ValueError:
+            if name not in self.hostnames:
+                return _error(403, "unexpected Host {!r}".format(host))
+        if request.method != "POST":
+            return None
+        origin = request.headers.get("origin")
+        if origin is not None and urllib.parse.urlsplit(origin).netloc != host:
+            return _error(403, "cross-origin request from {}".format(origin))
+        content_type = request.headers.get("content-type", "")
+        if content_type.split(";")[0].strip().lower() != "application/json":
+            return _error(415, "expected Content-Type: application/json")
+        return None
+
+    async def _respond(self, request):
+        refused = self._allowed(request)
+        if refused is not None:
+            return refused
+        path = urllib.parse.urlsplit(request.target).path
+        parts = path.strip("/").split("/")
+        get = request.method == "GET"
+        post = request.method == "POST"
+        if path == "/" and get:
+            return 200, {"Content-Type": "text/html; charset=utf-8"}, PAGE.encode("utf-8")
+        if parts == ["api", "session"] and get:
+            return _json(200, self._session_json())
+        if parts == ["api", "save"] and post:
+            try:
+                self.save()
+            except OSError as exc:
+                return _error(500, "cannot save {}: {}".format(self.session.path, exc))
+            return _json(200, {"saved": self.session.path})
+        if len(parts) == 3 and parts[:2] == ["api", "rows"] and (get or post):
+            row = self._row(parts[2])
+            if row is None:
+                return _error(404, "no row {}".format(parts[2]))
+            if post:
+                return self._rate(row, request.body)
+            return self._row_response(row, request.headers)
+        if len(parts) == 2 and parts[0] == "preview" and get:
+            row = self._row(parts[1])
+            if row is None:
+                return _error(404, "no row {}".format(parts[1]))
+            return await self._preview(row, request.headers)
+        return _error(404, "no {} {}".format(request.method, path))
+
+    # API
+
+    def _row(self, text):
+        try:
+            row = int(text)
+        except ValueError:
+            return None
+        return row if 0 <= row < len(self.session.files) else None
+
+    def _session_json(self):
+        session = self.session
+        first_unrated = session.index.unrated().next(0)
+        return {
+            "csv": os.path.basename(session.path or ""),
+            "columns": session.column_names,
+            "rating_columns": session.rating_columns(),
+            "rows": len(session.files),
+            "first_unrated": first_unrated,
+        }
+
+    def _upcoming(self, row):
+        rows = []
+        for _ in range(self.prefetch):
+            row = self.session.step(row, 1)
+            if row is None:
+                break
+            rows.append(row)
+        return rows
+
+    def _row_response(self, row, headers):
+        upcoming = self._upcoming(row)
+        self._warm(upcoming, self._format(headers))
+        data = {
+            "row": row,
+            "file": self.session.files[row],
+            "cells": [self.session.cell(row, c) for c in range(1, len(self.session.column_names))],
+            "preview": f"/preview/{row}",
+            "prefetch": [f"/preview/{r}" for r in upcoming],
+        }
+        return _json(200, data, self._link_header(upcoming))
+
+    def _rate(self, row, body):
+        try:
+            data = json.loads(body)
+            name, value = data["column"], data["value"]
+        except (ValueError, KeyError, TypeError):
+            return _error(400, 'expected {"column": ..., "value": ...}')
+        names = self.session.column_names
+        column = name
+        if isinstance(name, str):
+            column = names.index(name) if name in names else None
+        if column not in self.session.rating_columns() or not isinstance(value, (str, int)):
+            return _error(400, "cannot rate column {!r} as {!r}".format(name, value))
+        self.session.set_cell(row, column, str(value))
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(
+                self.save_delay, self._autosave
+            )
+        return self._row_response(row, {})
+
+    def _link_header(self, rows):
+        if not rows:
+            return {}
+        return {"Link": ", ".join(f"</preview/{r}>; rel=prefetch" for r in rows)}
+
+    # Previews
+
+    def _format(self, headers):
+        if "image/webp" in headers.get("accept", "") and webp_supported():
+            return "webp"
+        return "jpeg"
+
+    async def _preview(self, row, request_headers):
+        path = self.session.files[row]
+        fmt = self._format(request_headers)
+        try:
+            etag = preview_etag(path, self.preview_size, fmt)
+        except OSError as exc:
+            return _error(404, str(exc))
+        upcoming = self._upcoming(row)
+        self._warm(upcoming, fmt)
+        headers = {
+            "ETag": f'"{etag}"',
+            "Cache-Control": "private, max-age=60",
+            "Vary": "Accept",
+            **self._link_header(upcoming),
+        }
+        if _etag_matches(request_headers.get("if-none-match"), etag):
+            return 304, headers, b""
+        data = self.previews.get(etag)
+        if data is None:
+            try:
+                data = await asyncio.shield(self._encode(path, etag, fmt))
+            except (OSError, ValueError) as exc:
+                return _error(404, "cannot read {}: {}".format(path, exc))
+        headers["Content-Type"] = "image/" + fmt
+        return 200, headers, data
+
+    def _encode(self, path, etag, fmt):
+        """Future of the encoded preview; one per ETag however many
+        requests (and prefetches) wait for it."""
+        future = self._pending.get(etag)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, self._load_preview, path, etag, fmt)
+            future.add_done_callback(functools.partial(self._encoded, etag))
+            self._pending[etag] = future
+        return future
+
+    def _encoded(self, etag, future):
+        self._pending.pop(etag, None)
+        if not future.cancelled() and future.exception() is None:
+            self.previews.put(etag, future.result())
+
+    def _warm(self, rows, fmt):
+        """Start encoding the previews of `rows` that are not cached yet."""
+        for row in rows:
+            path = self.session.files[row]
+            try:
+                etag = preview_etag(path, self.preview_size, fmt)
+            except OSError:
+                continue
+            if etag not in self.previews:
+                self._encode(path, etag, fmt)
+
+    def _load_preview(self, path, etag, fmt):
+        """Runs on the pool: the preview from the disk cache, or encoded
+        and added to it."""
+        cached = os.path.join(self.cache_dir, etag + "." + fmt)
+        try:
+            with open(cached, "rb") as f:
+                data = f.read()
+            os.utime(cached)  # LRU: mark as recently used
+            return data
+        except OSError:
+            pass
+        data = encode_preview(path, self.preview_size, fmt)
+        partial = "{}.{}-{}.tmp".format(cached, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(partial, "wb") as f:
+                f.write(data)
+            os.replace(partial, cached)
+        except OSError:
+            return data  # an unwritable cache only costs re-encoding
+        with self._writes_lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            prune_cache(self.cache_dir, self.disk_budget)
+        return data
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>PyQC</title>
+<style>
+  body { margin: 0; font: 14px sans-serif; background: #222; color: #ddd; }
+  #bar { padding: 6px 10px; background: #333; white-space: nowrap; overflow: hidden; }
+  #bar span { margin-right: 1.5em; }
+  #bar .current { color: #fff; font-weight: bold; text-decoration: underline; }
+  #image { display: block; margin: auto; max-width: 100vw; max-height: calc(100vh - 32px); }
+</style>
+</head>
+<body>
+<div id="bar"></div>
+<img id="image" alt="">
+<script>
+let info, current, column = 0;
+const history = [];
+
+async function api(path, body) {
+  const options = body === undefined ? {} : {
+    method: "POST", headers: {"Content-Type": "application/json"}, body: JSON.stringify(body)};
+  const response = await fetch(path, options);
+  return response.json();
+}
+
+function render() {
+  const bar = document.getElementById("bar");
+  bar.textContent = "";
+  const add = (text, cls) => {
+    const span = document.createElement("span");
+    span.textContent = text;
+    if (cls) span.className = cls;
+    bar.appendChild(span);
+  };
+  add(`${info.csv}  ${current.row + 1} / ${info.rows}`);
+  info.rating_columns.forEach((c, i) =>
+    add(`${info.columns[c]}: ${current.cells[c - 1] || "-"}`, i === column ? "current" : ""));
+  add(current.file);
+}
+
+function show(data) {
+  current = data;
+  document.getElementById("image").src = data.preview;
+  for (const url of data.prefetch) new Image().src = url;
+  render();
+}
+
+async function go(row) {
+  if (row < 0 || row >= info.rows) return;
+  show(await api(`/api/rows/${row}`));
+}
+
+async function rate(value) {
+  const c = info.rating_columns[column];
+  history.push([current.row, column]);
+  const data = await api(`/api/rows/${current.row}`, {column: c, value});
+  if (column < info.rating_columns.length - 1) {
+    column += 1;
+    show(data);
+  } else {
+    column = 0;
+    if (data.row + 1 < info.rows) await go(data.row + 1); else show(data);
+  }
+}
+
+async function undo() {
+  const last = history.pop();
+  if (!last) return;
+  column = last[1];
+  show(await api(`/api/rows/${last[0]}`, {column: info.rating_columns[column], value: ""}));
+}
+
+document.addEventListener("keydown", async (event) => {
+  const key = event.key;
+  if ((event.ctrlKey || event.metaKey) && key === "s") {
+    event.preventDefault();
+    await api("/api/save", {});
+  } else if (/^[0-9]$/.test(key) && info.rating_columns.length) {
+    await rate(key);
+  } else if (["w", "W", "/", "ArrowUp"].includes(key)) {
+    column = 0;
+    await go(current.row - 1);
+  } else if (["s", "S", "*", "ArrowDown"].includes(key)) {
+    column = 0;
+    await go(current.row + 1);
+  } else if (key === ".") {
+    await undo();
+  }
+});
+
+(async () => {
+  info = await api("/api/session");
+  await go(info.first_unrated === null ? info.rows - 1 : info.first_unrated);
+})();
+</script>
+</body>
+</html>
+"""
+
+
+async def _serve(session, args):
+    server = ReviewServer(session, preview_size=args.preview_size, prefetch=args.prefetch)
+    await server.start(args.host, args.port)
+    print("Serving {} at http://{}:{}/ (Ctrl+C to stop)".format(session.path, args.host, server.port))
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, AttributeError):  # no SIGTERM handlers on Windows
+        pass
+    try:
+        await stop.wait()
+    finally:
+        await server.close()
+
+
+def main(argv):
+    """`pyqc serve`: review a CSV through a browser."""
+    parser = argparse.ArgumentParser(
+        prog="pyqc serve",
+        description="Serve a rating CSV for review in a web browser, with "
+        "pre-scaled previews and ratings saved back to the CSV.",
+    )
+    parser.add_argument("-c", "--csv", required=True, help="CSV file to review")
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address to listen on (default: %(default)s; reach it remotely "
+        "through an SSH tunnel)",
+    )
+    parser.add_argument("--port", type=int, default=8000, help="default: %(default)s")
+    parser.add_argument(
+        "--preview-size",
+        type=int,
+        default=DEFAULT_PREVIEW_SIZE,
+        metavar="PX",
+        help="Shrink previews to at most PX pixels across (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=DEFAULT_PREFETCH,
+        metavar="N",
+        help="Previews of the next N rows to prepare ahead (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+    if args.preview_size <= 0:
+        parser.error("--preview-size must be positive")
+
+    session = Session()
+    try:
+        if not session.load_csv(args.csv):
+            return 1
+    except OSError as exc:
+        print("Error: {}".format(exc), file=sys.stderr)
+        return 1
+    try:
+        asyncio.run(_serve(session, args))
+    except KeyboardInterrupt:
+        pass
+    return 0
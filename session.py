@@ -0,0 +1,491 @@
+"""A rating session without a UI: the files, their ratings and the cursor.
+
+Session is everything MainWindow used to keep in its QTableWidget, in
+compact form: the paths in a PathStore and the rating cells as the codes of
+a RatingIndex, so a million-row session costs tens of MB and "which rows are
+unrated?" is a bitmap lookup. It implements loading, the rating keys
+(rate/undo/next unrated), bulk ratings, column changes and saving, and
+imports no Qt, so scripts and benchmarks can drive the same code paths
+without a display.
+
+MainWindow is a view over a Session: it forwards input to it and mirrors the
+cells the session changes into its table through `on_cells_changed`.
+CsvSet chains the Sessions of several rating CSVs into one review.
+"""
+
+import csv
+import glob
+import itertools
+import os
+import pathlib
+
+import csvformat
+from pathstore import PathStore
+from rating_index import RatingIndex
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".nii", ".nii.gz")
+
+DEFAULT_COLUMNS = ("File", "QC_Raw", "QC_Pre")
+
+# Column the prescreen fills in; like any derived column, it is saved with
+# the ratings but skipped by the rating keys.
+PRESCREEN_COLUMN = "Prescreen"
+# Column naming each row's group of duplicate images (see dedupe)
+DUPLICATE_COLUMN = "Duplicate"
+DERIVED_COLUMNS = {PRESCREEN_COLUMN, DUPLICATE_COLUMN}
+
+
+def list_images(directory):
+    """Sorted image paths in `directory`, case-insensitive on suffix.
+
+    `directory` may also be an archive or pack, or ``<archive>::<folder>``.
+    """
+    import archive  # packs are read with Qt; keep it out of plain sessions
+
+    if archive.is_archive(directory) or archive.is_member(directory):
+        return archive.list_members(directory, IMAGE_EXTS)
+    # Match on the whole name: Path.suffix of "x.nii.gz" is only ".gz"
+    return sorted(
+        str(p)
+        for p in pathlib.Path(directory).iterdir()
+        if p.is_file() and p.name.lower().endswith(IMAGE_EXTS)
+    )
+
+
+class Session:
+    """Files, rating columns and rating cursor of one review.
+
+    `row` and `insert_column` are the cursor the rating keys write at.
+    `shown` is None, or the RowBitmap of the rows a filter shows; moving the
+    cursor only visits those. `on_cells_changed(column, rows)` is called
+    after rate(), undo() and the bulk edits change cells.
+    """
+
+    def __init__(self, on_cells_changed=None):
+        self.on_cells_changed = on_cells_changed
+        self.index = RatingIndex()
+        self.reset()
+
+    def reset(self):
+        """Back to an empty session with the default columns."""
+        self.files = PathStore()
+        self.column_names = list(DEFAULT_COLUMNS)
+        self.index.reset(0, len(self.column_names))
+        self.path = None
+        self.row = 0
+        self.insert_column = 1
+        self.shown = None
+        self.dirty = False
+        self._bulk_undo = None
+
+    # Loading
+
+    def load_files(self, paths):
+        """Start a session over `paths`, all unrated. Returns False, leaving
+        the session as it was, if there are none."""
+        files = PathStore(paths)
+        if not files:
+            print("Warning: No image files provided.")
+            return False
+        self.reset()
+        self.files = files
+        self.index.reset(len(files), len(self.column_names))
+        return True
+
+    def load_directory(self, directory):
+        """load_files() over the images in `directory` (see list_images)."""
+        try:
+            files = list_images(directory)
+        except (OSError, ValueError) as exc:
+            print(f"Warning: cannot list {directory}: {exc}")
+            return False
+        if not files:
+            print("Warning: No image files found.")
+            return False
+        return self.load_files(files)
+
+    def load_csv(self, path):
+        """Load images and ratings from a rating CSV (see csvformat), with
+        the cursor on the first unrated row, or the last row if all are
+        rated. Returns False, leaving the session as it was, if the file
+        has no data rows."""
+        print("Opening CSV file: {}".format(path))
+        with open(path, "r", newline="") as f:
+            rows = list(csv.reader(f))
+
+        if not rows:
+            print("Warning: CSV file is empty.")
+            return False
+
+        column_names = csvformat.header_columns(rows[0])
+        if column_names is not None:
+            data_rows = rows[1:]
+        else:
+            column_names = csvformat.unknown_columns(max(len(r) for r in rows))
+            data_rows = rows
+
+        # Drop blank lines and rows with no path so the files and the rating
+        # cells stay paired row for row
+        data_rows = [r for r in data_rows if csvformat.is_data_row(r)]
+
+        if not data_rows:
+            print("Warning: CSV file has no data rows.")
+            return False
+
+        self.reset()
+        self.path = path
+        self.column_names = column_names
+        csv_dir = os.path.dirname(os.path.abspath(path))
+        self.files = PathStore(csvformat.resolve_path(r[0], csv_dir) for r in data_rows)
+        self.index.reset(len(data_rows), len(column_names))
+        self.mark_derived_columns()
+        for column in range(1, len(column_names)):
+            self.index.fill_column(column, [csvformat.cell(r, column) for r in data_rows])
+
+        first_unrated = self.index.unrated().next(0)
+        self.row = first_unrated if first_unrated is not None else len(data_rows) - 1
+        return True
+
+    # Cells and navigation
+
+    @property
+    def row_count(self):
+        return self.index.row_count
+
+    def cell(self, row, column):
+        """Rating in `column` of `row`, "" if empty."""
+        if not 0 < column < self.index.column_count or not 0 <= row < self.index.row_count:
+            return ""
+        return self.index.get(row, column)
+
+    def rating_columns(self):
+        """Columns that take ratings: all but the path column and the
+        machine-filled ones (see DERIVED_COLUMNS)."""
+        return [
+            column
+            for column in range(1, self.index.column_count)
+            if column >= len(self.column_names)
+            or self.column_names[column] not in DERIVED_COLUMNS
+        ]
+
+    def mark_derived_columns(self):
+        """Tell the index which columns are derived, so their empty cells
+        leave unrated() and first_empty_column() alone."""
+        rating_columns = set(self.rating_columns())
+        for column in range(1, self.index.column_count):
+            self.index.set_rated(column, column in rating_columns)
+
+    def step(self, row, step):
+        """Row reached by moving one step (+1 or -1) from `row` over the
+        shown rows, or None at either end."""
+        if self.shown is None:
+            target = row + step
+            return target if 0 <= target < len(self.files) else None
+        if step > 0:
+            return self.shown.next(row + 1)
+        return self.shown.prev(row - 1)
+
+    def move(self, step):
+        """Move the cursor one row without rating, back to the first rating
+        column. Returns False at either end."""
+        self.insert_column = 1
+        row = self.step(self.row, step)
+        if row is None:
+            return False
+        self.row = row
+        return True
+
+    def next_unrated(self, reverse=False):
+        """Move the cursor to the nearest unrated row after (or before) the
+        current one, wrapping around, on its first empty rating column.
+        Each jump is an O(log n) bitmap lookup; with a filter, it is first
+        intersected with the shown rows. Returns False if there is none."""
+        targets = self.index.unrated()
+        if self.shown is not None:
+            targets = targets & self.shown
+        if not len(targets):
+            return False
+        if reverse:
+            row = targets.prev(self.row - 1)
+            if row is None:
+                row = targets.prev(targets.size - 1)
+        else:
+            row = targets.next(self.row + 1)
+            if row is None:
+                row = targets.next(0)
+        self.insert_column = self.index.first_empty_column(row) or 1
+        self.row = row
+        return True
+
+    # Editing
+
+    def _write(self, column, rows, values):
+        """Set the `column` cells of `rows` to `values`; returns the old
+        values."""
+        old = [self.cell(row, column) for row in rows]
+        self.index.set_rows(column, rows, values)
+        if self.on_cells_changed is not None:
+            self.on_cells_changed(column, rows)
+        return old
+
+    def rate(self, value):
+        """Enter `value` at the cursor and advance it, the way a rating key
+        does: to the next rating column, or from the last one to the first
+        column of the next shown row. Returns False if there are no rating
+        columns."""
+        rating_columns = self.rating_columns()
+        if not rating_columns:
+            return False
+        if self.insert_column not in rating_columns:
+            self.insert_column = rating_columns[0]
+
+        self._write(self.insert_column, [self.row], [value])
+        self._bulk_undo = None
+        self.dirty = True
+
+        idx = rating_columns.index(self.insert_column)
+        if idx == len(rating_columns) - 1:
+            self.insert_column = rating_columns[0]
+            next_row = self.step(self.row, 1)
+            if next_row is not None:
+                self.row = next_row
+        else:
+            self.insert_column = rating_columns[idx + 1]
+        return True
+
+    def undo(self):
+        """Clear the most recently entered rating cell.
+
+        On the first rating column, this means stepping back a shown row to
+        its last rating column; otherwise the cursor stays on the row and
+        moves one column to the left. If the last rating was a bulk one (see
+        rate_rows and copy_ratings), all of its cells are restored instead.
+        Returns the rows that changed: none at the very first cell.
+        """
+        if self._bulk_undo is not None:
+            edits = self._bulk_undo
+            self._bulk_undo = None
+            changed = set()
+            for column, rows, old in reversed(edits):
+                self._write(column, rows, old)
+                changed.update(rows)
+            self.dirty = True
+            return sorted(changed)
+        rating_columns = self.rating_columns()
+        if not rating_columns:
+            return []
+        if self.insert_column not in rating_columns:
+            self.insert_column = rating_columns[0]
+
+        idx = rating_columns.index(self.insert_column)
+        if idx > 0:
+            self.insert_column = rating_columns[idx - 1]
+        else:
+            row = self.step(self.row, -1)
+            if row is None:
+                return []
+            self.row = row
+            self.insert_column = rating_columns[-1]
+        self._write(self.insert_column, [self.row], [""])
+        self.dirty = True
+        return [self.row]
+
+    def rate_rows(self, rows, value, column=None):
+        """Rate `column` (default: the cursor's rating column) of every row
+        in `rows` as `value`, undoable as one edit. Returns the column, or
+        None if there are no rating columns."""
+        rating_columns = self.rating_columns()
+        if not rating_columns:
+            return None
+        if column is None:
+            column = self.insert_column
+        if column not in rating_columns:
+            column = rating_columns[0]
+        rows = list(rows)
+        old = self._write(column, rows, itertools.repeat(value))
+        self._bulk_undo = [(column, rows, old)]
+        self.dirty = True
+        return column
+
+    def copy_ratings(self, source, rows):
+        """Give every row in `rows` the ratings of row `source`, in each
+        rating column where `source` has one, undoable as one edit. Returns
+        the number of columns copied."""
+        rows = [row for row in rows if row != source]
+        edits = []
+        for column in self.rating_columns():
+            value = self.cell(source, column)
+            if value and rows:
+                edits.append((column, rows, self._write(column, rows, itertools.repeat(value))))
+        if edits:
+            self._bulk_undo = edits
+            self.dirty = True
+        return len(edits)
+
+    def set_cell(self, row, column, value):
+        """Set one cell to `value` directly, leaving the cursor and undo
+        alone. Returns False if there is no such cell."""
+        if not 0 < column < self.index.column_count or not 0 <= row < self.row_count:
+            return False
+        self._write(column, [row], [value])
+        self._bulk_undo = None
+        self.dirty = True
+        return True
+
+    def fill_column(self, column, values):
+        """Set every cell of `column` from `values`, one per row, as for a
+        derived column. Not undoable."""
+        self._write(column, range(self.row_count), values)
+        self._bulk_undo = None
+        self.dirty = True
+
+    def fill_empty(self, rows, value):
+        """Set every empty rating cell of `rows` to `value`."""
+        for column in self.rating_columns():
+            empty = [row for row in rows if not self.cell(row, column)]
+            if empty:
+                self._write(column, empty, itertools.repeat(value))
+        if rows:
+            self.dirty = True
+
+    # Columns
+
+    def add_column(self, name):
+        """Add an empty column called `name` at the right; returns its index."""
+        column = self.index.column_count
+        self.column_names.append(name)
+        self.index.insert_column(column)
+        self.mark_derived_columns()
+        self.dirty = True
+        return column
+
+    def rename_column(self, column, name):
+        if column <= 0 or column >= len(self.column_names):
+            return False
+        self.column_names[column] = name
+        self.mark_derived_columns()
+        self.dirty = True
+        return True
+
+    def remove_column(self, column):
+        """Drop `column` and its cells. Column 0 (the paths) stays."""
+        if column <= 0 or column >= len(self.column_names):
+            return False
+        self.column_names.pop(column)
+        self.index.remove_column(column)
+        self._bulk_undo = None  # its column index may have moved
+        rating_columns = self.rating_columns()
+        if rating_columns and self.insert_column not in rating_columns:
+            self.insert_column = rating_columns[0]
+        self.dirty = True
+        return True
+
+    # Saving
+
+    def save(self, path=None):
+        """Write column_names as the header row, then [path, rating1, ...]
+        for every row, to `path` (default: the file the session was loaded
+        from)."""
+        path = path or self.path
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.column_names)
+            columns = range(1, len(self.column_names))
+            for row in range(min(self.index.row_count, len(self.files))):
+                writer.writerow([self.files[row]] + [self.cell(row, c) for c in columns])
+        self.dirty = False
+
+
+def expand_csv_paths(patterns):
+    """Sorted, de-duplicated paths matching the glob `patterns`; a pattern
+    that matches nothing is kept as it is, so opening it reports the error."""
+    paths = set()
+    for pattern in patterns:
+        paths.update(glob.glob(pattern) or [pattern])
+    return sorted(paths)
+
+
+class CsvSet:
+    """Rating CSVs reviewed one after another, as if they were one file.
+
+    Only the current CSV and the ones with unsaved ratings are loaded: a
+    file is read when the review reaches it and dropped again when the
+    review moves on without changing it. Each Session keeps the path it
+    was loaded from, so save() writes every edit back to its own file and
+    leaves the unchanged files alone.
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.position = None
+        self._sessions = {}
+
+    @property
+    def session(self):
+        """The current file's Session, None before the first open()."""
+        return self._sessions.get(self.position)
+
+    def open(self, position):
+        """Make the CSV at `position` the current one, loading it unless it
+        is still open. Returns its Session, or None, keeping the current
+        one, if it cannot be read or has no data rows."""
+        session = self._sessions.get(position)
+        if session is None:
+            session = Session()
+            try:
+                loaded = session.load_csv(self.paths[position])
+            except (OSError, csv.Error, UnicodeDecodeError) as exc:
+                print(f"Warning: cannot read {self.paths[position]}: {exc}")
+                loaded = False
+            if not loaded:
+                return None
+            self._sessions[position] = session
+        self.position = position
+        self._drop_unchanged()
+        return session
+
+    def advance(self, step):
+        """open() the nearest readable CSV `step` (+1 or -1) files on from
+        the current one. Returns None at either end."""
+        if self.position is None:
+            position = 0 if step > 0 else len(self.paths) - 1
+        else:
+            position = self.position + step
+        while 0 <= position < len(self.paths):
+            session = self.open(position)
+            if session is not None:
+                return session
+            position += step
+        return None
+
+    def open_files(self):
+        """Paths of the CSVs currently loaded."""
+        return [self.paths[position] for position in sorted(self._sessions)]
+
+    @property
+    def dirty(self):
+        return any(session.dirty for session in self._sessions.values())
+
+    def modified(self):
+        """Paths of the CSVs with unsaved ratings."""
+        return [
+            self.paths[position]
+            for position, session in sorted(self._sessions.items())
+            if session.dirty
+        ]
+
+    def save(self):
+        """Write each modified CSV back to its own file; returns their
+        paths."""
+        saved = []
+        for position, session in sorted(self._sessions.items()):
+            if session.dirty:
+                session.save()
+                saved.append(self.paths[position])
+        self._drop_unchanged()
+        return saved
+
+    def _drop_unchanged(self):
+        for position in list(self._sessions):
+            if position != self.position and not self._sessions[position].dirty:
+                del self._sessions[position]
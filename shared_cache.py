@@ -0,0 +1,229 @@
+"""Decoded-image cache shared by every PyQC process on a machine.
+
+When several raters review the same dataset on one workstation, each
+process would otherwise decode the same images into its own memory. Here,
+one process stores each decoded image as a file in a shared directory,
+which defaults to tmpfs (/dev/shm). Every other process memory-maps that
+file and wraps it as a QImage without copying.
+
+The directory is the index: one entry file per image, named by a hash of
+the image's path, size and mtime, with the file's mtime doubling as its
+last-use time. Entries are written to a temporary name and renamed into
+place, so readers never see a partial entry. Evicting an entry just
+unlinks it, and the memory stays valid for anyone who still has it
+mapped. Writers take an flock on the directory's lock file while they add
+entries and evict the least recently used ones to stay under the byte
+budget that all processes share.
+
+The default directory belongs to one user, and is only used if it is a
+real directory that the user owns and nobody else can write to: its name
+and the entry names are predictable, so another account could otherwise
+plant images in it. To share decoded images between
+raters logged in under different accounts, pass a directory owned by a
+group they are all in, with group write permission and the setgid bit
+(mode 2770). In a group-writable directory, entries and the lock file are
+created readable and writable by the group. Everyone in the group is
+trusted with the images the others see.
+"""
+
+import atexit
+import hashlib
+import mmap
+import os
+import shutil
+import stat
+import struct
+import tempfile
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+import archive
+import cache_paths
+
+try:
+    import fcntl
+except ImportError:  # Windows: renames alone keep entries consistent
+    fcntl = None
+
+DEFAULT_BUDGET = 1024 * 1024 * 1024
+
+_MAGIC = b"PYQCSHM1"
+_HEADER = struct.Struct("<8sIIII")
+_SUFFIX = ".img"
+
+
+def default_dir():
+    """Per-user directory on tmpfs if there is one, else in the cache. Pass
+    a group-shared directory instead to share across accounts."""
+    if os.path.isdir("/dev/shm"):
+        return os.path.join("/dev/shm", "pyqc-{}".format(os.getuid()))
+    return cache_paths.cache_dir("shared")
+
+
+def private_dir(path):
+    """Create `path` for this user alone and return it. If it already
+    exists as something other than a directory owned by this user and not
+    writable by anyone else, warn and return a new temporary directory
+    (removed at exit) next to it instead."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if (
+        stat.S_ISDIR(st.st_mode)
+        and (not hasattr(os, "getuid") or st.st_uid == os.getuid())
+        and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+    ):
+        return path
+    fallback = tempfile.mkdtemp(prefix="pyqc-", dir=os.path.dirname(path))
+    atexit.register(shutil.rmtree, fallback, True)
+    print(
+        "Warning: {} is not a private directory of this user; using {}".format(
+            path, fallback
+        )
+    )
+    return fallback
+
+
+def _entry_name(source):
+    """Entry file name for `source`, or None if it can't be stat'ed."""
+    stat_path = archive.split_member(source)[0] if archive.is_member(source) else source
+    try:
+        st = os.stat(stat_path)
+    except OSError:
+        return None
+    key = "{}\0{}\0{}".format(os.path.abspath(source), st.st_size, st.st_mtime_ns)
+    digest = hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest()
+    return digest + _SUFFIX
+
+
+class SharedImageCache:
+    """Cross-process map of image path -> decoded QImage."""
+
+    def __init__(self, directory=None, budget=DEFAULT_BUDGET):
+        if directory is None:
+            self.directory = private_dir(default_dir())
+        else:
+            self.directory = directory  # may be a group directory; trusted
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.budget = budget
+        group_writable = os.stat(self.directory).st_mode & stat.S_IWGRP
+        self._mode = 0o660 if group_writable else 0o600
+        self._lock_path = os.path.join(self.directory, ".lock")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, source):
+        """The cached image for `source`, mapped read-only, or None."""
+        name = _entry_name(source)
+        if name is None:
+            self.misses += 1
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # LRU: mark as recently used
+        except OSError:
+            pass  # another account's entry, in a directory not set up to share
+
+        magic, width, height, stride, fmt = _HEADER.unpack_from(mapped, 0)
+        if magic != _MAGIC or _HEADER.size + height * stride > len(mapped):
+            self.misses += 1
+            return None
+        pixels = np.frombuffer(
+            mapped, np.uint8, count=height * stride, offset=_HEADER.size
+        )
+        image = QImage(pixels.data, width, height, stride, QImage.Format(fmt))
+        image._array = pixels  # keeps the mapping alive as long as the image
+        self.hits += 1
+        return image
+
+    def put(self, source, image):
+        """Publish the decoded `image` of `source` to the other processes."""
+        name = _entry_name(source)
+        if name is None or image.isNull():
+            return
+        nbytes = _HEADER.size + image.sizeInBytes()
+        if nbytes > self.budget:
+            return
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        header = _HEADER.pack(
+            _MAGIC, image.width(), image.height(), image.bytesPerLine(), image.format()
+        )
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+            if self._mode != 0o600:
+                os.chmod(tmp, self._mode)
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                f.write(bits)
+            with self._locked():
+                os.replace(tmp, os.path.join(self.directory, name))
+                self._evict(self.budget)
+        except OSError as exc:
+            print("Warning: shared image cache: {}".format(exc))
+
+    def nbytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        with self._locked():
+            self._evict(0)
+
+    def _entries(self):
+        """[(path, size, mtime)] of the published entries."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(_SUFFIX):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue  # evicted by another process meanwhile
+            entries.append((entry.path, st.st_size, st.st_mtime_ns))
+        return entries
+
+    def _evict(self, budget):
+        """Drop least recently used entries until the total fits `budget`.
+        Must be called with the lock held."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in sorted(entries, key=lambda e: e[2]):
+            if total <= budget:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _locked(self):
+        return _FileLock(self._lock_path, self._mode)
+
+
+class _FileLock:
+    def __init__(self, path, mode=0o600):
+        self._path = path
+        self._mode = mode
+        self._fd = None
+
+    def __enter__(self):
+        # flock needs no write access, so other accounts' lock files do
+        self._fd = os.open(self._path, os.O_RDONLY | os.O_CREAT, self._mode)
+        st = os.fstat(self._fd)
+        own = hasattr(os, "getuid") and st.st_uid == os.getuid()
+        if own and stat.S_IMODE(st.st_mode) != self._mode:
+            os.fchmod(self._fd, self._mode)  # undo the umask
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
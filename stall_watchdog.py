@@ -0,0 +1,138 @@
+"""Catch the GUI thread blocking, and where.
+
+A QTimer in the GUI thread records a heartbeat a few dozen times a second.
+A watchdog thread checks how old the heartbeat is, and while it is older
+than the threshold, the GUI thread is stuck: every few milliseconds, the
+watchdog samples the GUI thread's Python stack with sys._current_frames().
+When the heartbeat resumes, the stall is recorded with its duration and its
+most frequent stack.
+
+Stalls are grouped by call site (the innermost frame of that stack) in a
+plain-text report, which is written on exit, or when asked for.
+"""
+
+import collections
+import sys
+import threading
+import time
+import traceback
+
+from PyQt5.QtCore import QTimer
+
+DEFAULT_THRESHOLD = 0.1
+_BEAT_MS = 20
+_MAX_FRAMES = 40
+
+
+def _stack(frame):
+    """Hashable (filename, lineno, name) frames, outermost first."""
+    if frame is None:
+        return ()
+    return tuple(
+        (f.filename, f.lineno, f.name)
+        for f in traceback.extract_stack(frame, limit=_MAX_FRAMES)
+    )
+
+
+class Stall:
+    def __init__(self, start):
+        self.start = start
+        self.duration = None
+        self.samples = collections.Counter()
+
+    @property
+    def stack(self):
+        """The stack seen in most samples."""
+        return self.samples.most_common(1)[0][0] if self.samples else ()
+
+
+class StallWatchdog:
+    """Records stalls of the thread it is created in (the GUI thread)."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, clock=time.monotonic):
+        self.threshold = threshold
+        self._clock = clock
+        self._period = min(threshold / 4, 0.01)
+        self._thread_id = threading.get_ident()
+        self._lock = threading.Lock()
+        self._beat = clock()
+        self._current = None
+        self.stalls = []
+        self._stop = threading.Event()
+        self._watcher = None
+        self._timer = QTimer()
+        self._timer.timeout.connect(self._on_beat)
+
+    def start(self):
+        self._beat = self._clock()
+        self._timer.start(_BEAT_MS)
+        self._stop.clear()
+        self._watcher = threading.Thread(
+            target=self._watch, name="pyqc-watchdog", daemon=True
+        )
+        self._watcher.start()
+
+    def stop(self):
+        self._timer.stop()
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def _on_beat(self):
+        now = self._clock()
+        with self._lock:
+            stall, self._current = self._current, None
+            self._beat = now
+        if stall is not None:
+            stall.duration = now - stall.start
+            self.stalls.append(stall)
+
+    def _watch(self):
+        while not self._stop.wait(self._period):
+            with self._lock:
+                if self._clock() - self._beat < self.threshold:
+                    continue
+                if self._current is None:
+                    self._current = Stall(self._beat)
+                frame = sys._current_frames().get(self._thread_id)
+                self._current.samples[_stack(frame)] += 1
+                del frame
+
+    def report(self):
+        """Stalls grouped by call site, worst total first, as text."""
+        sites = collections.defaultdict(list)
+        for stall in self.stalls:
+            site = stall.stack[-1] if stall.stack else ("?", 0, "?")
+            sites[site].append(stall)
+        total = sum(stall.duration for stall in self.stalls)
+        lines = [
+            "PyQC stall report: {} stalls over {:.0f} ms, {:.2f} s blocked in total".format(
+                len(self.stalls), self.threshold * 1000, total
+            )
+        ]
+        ranked = sorted(sites.items(), key=lambda item: -sum(s.duration for s in item[1]))
+        for (filename, lineno, name), stalls in ranked:
+            worst = max(stalls, key=lambda s: s.duration)
+            lines.append("")
+            lines.append(
+                "{} stalls, {:.2f} s total, {:.0f} ms max at {}:{} in {}".format(
+                    len(stalls),
+                    sum(s.duration for s in stalls),
+                    worst.duration * 1000,
+                    filename,
+                    lineno,
+                    name,
+                )
+            )
+            lines.extend(
+                line.rstrip("\n")
+                for line in traceback.format_list(
+                    [traceback.FrameSummary(*frame) for frame in worst.stack]
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report())
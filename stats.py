@@ -0,0 +1,364 @@
+"""`pyqc stats`: rating summaries and inter-rater agreement, headless.
+
+Rating CSVs are streamed in fixed-size chunks, and all counting is done on
+NumPy string arrays, so memory does not grow with the number of rows. For
+each file the report gives each rating column's value distribution and
+unrated count, plus Cohen's kappa between each pair of its rating columns.
+
+With several files, columns with the same name are compared across files:
+Cohen's kappa for each pair of files, and Fleiss' kappa for all of them. The
+rows are matched by image path. Files listing the same images in the same
+order (the usual case, with every rater starting from one CSV) are streamed
+in lockstep. Otherwise the files are joined on the path, which does take
+memory proportional to the rows. Per-file summaries run in a process pool.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+import csvformat
+
+CHUNK_ROWS = 65536
+
+
+class _RatingCsv:
+    """Chunked reader applying the same header and path rules as loadCSV."""
+
+    def __init__(self, path):
+        self.path = path
+        self._csv_dir = os.path.dirname(os.path.abspath(path))
+        self._file = open(path, "r", newline="")
+        self._reader = csv.reader(self._file)
+        first = next(self._reader, None)
+        self.columns = csvformat.header_columns(first) if first else None
+        self._has_header = self.columns is not None
+        self._pending = [] if self._has_header or first is None else [first]
+        if not self._has_header:
+            # Named after the longest row, which is only known at the end
+            self.columns = csvformat.unknown_columns(len(first) if first else 3)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def chunks(self, size=CHUNK_ROWS):
+        """Yield (paths, cells): resolved image paths and a (rows, columns)
+        string array of ratings, with column 0 left empty."""
+        rows = itertools.chain(self._pending, self._reader)
+        self._pending = []
+        while True:
+            chunk = [r for r in itertools.islice(rows, size) if csvformat.is_data_row(r)]
+            if not chunk:
+                # islice came back empty, or the chunk was all blank lines
+                peek = next(rows, None)
+                if peek is None:
+                    return
+                rows = itertools.chain([peek], rows)
+                continue
+            if not self._has_header:
+                longest = max(len(r) for r in chunk)
+                if longest > len(self.columns):
+                    self.columns = csvformat.unknown_columns(longest)
+            n_cols = len(self.columns)
+            cells = np.array(
+                [[""] + [csvformat.cell(r, c) for c in range(1, n_cols)] for r in chunk],
+                dtype=str,
+            ).reshape(len(chunk), n_cols)
+            paths = [csvformat.resolve_path(r[0], self._csv_dir) for r in chunk]
+            yield paths, cells
+
+
+def _pair_counts(a, b):
+    """{(value_a, value_b): count} over positions where both are rated."""
+    mask = (a != "") & (b != "")
+    a, b = a[mask], b[mask]
+    if not a.size:
+        return {}
+    labels, inverse = np.unique(np.concatenate([a, b]), return_inverse=True)
+    k = len(labels)
+    codes = inverse[: a.size] * k + inverse[a.size :]
+    counts = np.bincount(codes, minlength=k * k)
+    return {
+        (str(labels[i // k]), str(labels[i % k])): int(counts[i])
+        for i in np.flatnonzero(counts)
+    }
+
+
+def cohen_kappa(pairs):
+    """Cohen's kappa from {(a, b): count}; None when nothing was co-rated."""
+    n = sum(pairs.values())
+    if not n:
+        return None
+    observed = sum(c for (a, b), c in pairs.items() if a == b) / n
+    left, right = collections.Counter(), collections.Counter()
+    for (a, b), c in pairs.items():
+        left[a] += c
+        right[b] += c
+    expected = sum(left[v] * right[v] for v in left) / (n * n)
+    if expected == 1:
+        return 1.0
+    return (observed - expected) / (1 - expected)
+
+
+class _Fleiss:
+    """Streaming Fleiss' kappa for a fixed number of raters."""
+
+    def __init__(self, raters):
+        self.raters = raters
+        self.subjects = 0
+        self.sum_squares = 0
+        self.totals = collections.Counter()
+
+    def add(self, matrix):
+        """Add a (subjects, raters) string array; rows with a gap are skipped."""
+        matrix = matrix[(matrix != "").all(axis=1)]
+        if not matrix.size:
+            return
+        labels, inverse = np.unique(matrix, return_inverse=True)
+        k = len(labels)
+        rows = matrix.shape[0]
+        index = (np.arange(rows)[:, None] * k + inverse.reshape(matrix.shape)).ravel()
+        per_subject = np.bincount(index, minlength=rows * k).reshape(rows, k)
+        self.subjects += rows
+        self.sum_squares += int((per_subject.astype(np.int64) ** 2).sum())
+        for label, total in zip(labels, per_subject.sum(axis=0)):
+            self.totals[str(label)] += int(total)
+
+    def kappa(self):
+        n, m = self.subjects, self.raters
+        if not n or m < 2:
+            return None
+        p_bar = (self.sum_squares - n * m) / (n * m * (m - 1))
+        p_e = sum((t / (n * m)) ** 2 for t in self.totals.values())
+        if p_e == 1:
+            return 1.0
+        return (p_bar - p_e) / (1 - p_e)
+
+
+def summarize(path, chunk_rows=CHUNK_ROWS):
+    """Distributions, unrated counts and column-pair agreement for one CSV."""
+    counts = collections.defaultdict(collections.Counter)
+    pairs = collections.defaultdict(collections.Counter)
+    rows = complete = 0
+    with _RatingCsv(path) as f:
+        for _, cells in f.chunks(chunk_rows):
+            rows += len(cells)
+            complete += int((cells[:, 1:] != "").all(axis=1).sum())
+            n_cols = cells.shape[1]
+            for column in range(1, n_cols):
+                values, value_counts = np.unique(cells[:, column], return_counts=True)
+                for value, count in zip(values, value_counts):
+                    counts[column][str(value)] += int(count)
+            for a, b in itertools.combinations(range(1, n_cols), 2):
+                pairs[(a, b)].update(_pair_counts(cells[:, a], cells[:, b]))
+        columns = f.columns
+
+    result = {"path": path, "rows": rows, "fully_rated": complete, "columns": {}}
+    for column, name in enumerate(columns[1:], 1):
+        distribution = dict(counts[column])
+        unrated = distribution.pop("", 0) + rows - sum(counts[column].values())
+        result["columns"][name] = {
+            "unrated": unrated,
+            "distribution": dict(sorted(distribution.items())),
+        }
+    result["column_agreement"] = [
+        {
+            "columns": [columns[a], columns[b]],
+            "n": sum(pairs[(a, b)].values()),
+            "cohen_kappa": cohen_kappa(pairs[(a, b)]),
+        }
+        for a, b in itertools.combinations(range(1, len(columns)), 2)
+    ]
+    return result
+
+
+class _Misaligned(Exception):
+    pass
+
+
+def _lockstep(paths, chunk_rows):
+    """(chunk of cells per file) for files listing the same images in the
+    same order; raises _Misaligned as soon as they diverge."""
+    files = [_RatingCsv(p) for p in paths]
+    try:
+        for group in itertools.zip_longest(*(f.chunks(chunk_rows) for f in files)):
+            if any(g is None for g in group):
+                raise _Misaligned()
+            first = group[0][0]
+            if any(g[0] != first for g in group[1:]):
+                raise _Misaligned()
+            yield [f.columns for f in files], [g[1] for g in group]
+    finally:
+        for f in files:
+            f.close()
+
+
+def _joined(paths, chunk_rows):
+    """Like _lockstep() but matching rows on image path; rows missing from
+    any file are left out."""
+    tables = []
+    columns = []
+    for path in paths:
+        table = {}
+        with _RatingCsv(path) as f:
+            for chunk_paths, cells in f.chunks(chunk_rows):
+                table.update(zip(chunk_paths, cells))
+            columns.append(f.columns)
+        tables.append(table)
+    shared = [p for p in tables[0] if all(p in t for t in tables[1:])]
+    for start in range(0, len(shared), chunk_rows):
+        keys = shared[start : start + chunk_rows]
+        yield columns, [
+            np.array(
+                [_padded(t[k], len(c)) for k in keys], dtype=str
+            ).reshape(len(keys), len(c))
+            for t, c in zip(tables, columns)
+        ]
+
+
+def _padded(cells, width):
+    """A headerless file's early chunks can be narrower than its last."""
+    return list(cells) + [""] * (width - len(cells))
+
+
+def _agreement(paths, chunk_rows):
+    def accumulate(chunks):
+        pairs = collections.defaultdict(collections.Counter)
+        fleiss = {}
+        for columns, cells in chunks:
+            shared = [
+                name
+                for name in columns[0][1:]
+                if all(name in c for c in columns[1:])
+            ]
+            for name in shared:
+                index = [c.index(name) for c in columns]
+                stacked = np.stack(
+                    [
+                        cell[:, i] if i < cell.shape[1] else np.full(len(cell), "")
+                        for cell, i in zip(cells, index)
+                    ],
+                    axis=1,
+                )
+                for a, b in itertools.combinations(range(len(paths)), 2):
+                    pairs[(name, a, b)].update(_pair_counts(stacked[:, a], stacked[:, b]))
+                fleiss.setdefault(name, _Fleiss(len(paths))).add(stacked)
+        return pairs, fleiss
+
+    try:
+        pairs, fleiss = accumulate(_lockstep(paths, chunk_rows))
+        matching = "aligned"
+    except _Misaligned:
+        pairs, fleiss = accumulate(_joined(paths, chunk_rows))
+        matching = "joined on path"
+
+    result = {"matching": matching, "columns": {}}
+    for name, f in fleiss.items():
+        result["columns"][name] = {
+            "fleiss_kappa": f.kappa(),
+            "fleiss_n": f.subjects,
+            "pairs": [
+                {
+                    "files": [paths[a], paths[b]],
+                    "n": sum(pairs[(name, a, b)].values()),
+                    "cohen_kappa": cohen_kappa(pairs[(name, a, b)]),
+                }
+                for a, b in itertools.combinations(range(len(paths)), 2)
+            ],
+        }
+    return result
+
+
+def collect(paths, jobs=None, chunk_rows=CHUNK_ROWS):
+    """Everything `pyqc stats` reports, as a JSON-serialisable dict."""
+    if jobs == 1 or len(paths) == 1:
+        files = [summarize(p, chunk_rows) for p in paths]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            files = list(pool.map(summarize, paths, itertools.repeat(chunk_rows)))
+    report = {"files": files}
+    if len(paths) > 1:
+        report["agreement"] = _agreement(paths, chunk_rows)
+    return report
+
+
+def _kappa(value):
+    return "n/a" if value is None or math.isnan(value) else "{:.3f}".format(value)
+
+
+def format_report(report):
+    lines = []
+    for f in report["files"]:
+        lines.append(
+            "{}: {} rows, {} fully rated".format(f["path"], f["rows"], f["fully_rated"])
+        )
+        for name, column in f["columns"].items():
+            rated = sum(column["distribution"].values())
+            lines.append("  {}: {} rated, {} unrated".format(name, rated, column["unrated"]))
+            for value, count in column["distribution"].items():
+                lines.append(
+                    "    {:>8}  {:>8}  {:5.1f}%".format(value, count, 100 * count / rated)
+                )
+        for pair in f["column_agreement"]:
+            lines.append(
+                "  {} vs {}: Cohen's kappa {} (n={})".format(
+                    *pair["columns"], _kappa(pair["cohen_kappa"]), pair["n"]
+                )
+            )
+    agreement = report.get("agreement")
+    if agreement:
+        lines.append("Agreement between files ({}):".format(agreement["matching"]))
+        for name, column in agreement["columns"].items():
+            lines.append(
+                "  {}: Fleiss' kappa {} (n={})".format(
+                    name, _kappa(column["fleiss_kappa"]), column["fleiss_n"]
+                )
+            )
+            for pair in column["pairs"]:
+                lines.append(
+                    "    {} vs {}: Cohen's kappa {} (n={})".format(
+                        *(os.path.basename(p) for p in pair["files"]),
+                        _kappa(pair["cohen_kappa"]),
+                        pair["n"],
+                    )
+                )
+    return "\n".join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="pyqc stats",
+        description="Summarise rating CSVs and the agreement between them "
+        "without loading them into memory.",
+    )
+    parser.add_argument("csv", nargs="+", help="Rating CSV files")
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of text")
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="Worker processes (default: one per CPU)"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        report = collect(args.csv, args.jobs)
+    except OSError as exc:
+        print("Error: {}".format(exc), file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return 0
@@ -0,0 +1,118 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+from PyQt5.QtCore import QBuffer, QIODevice
+from PyQt5.QtGui import QImage
+
+import archive
+import PyQC
+from image_widget import SaneDefaultsImageLabel
+from session import Session
+
+
+@pytest.fixture(autouse=True)
+def _cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYQC_CACHE_DIR", str(tmp_path / "cache"))
+    archive._cached_index.cache_clear()
+
+
+def _png(value):
+    image = QImage(8, 6, QImage.Format_Grayscale8)
+    image.fill(value)
+    buf = QBuffer()
+    buf.open(QIODevice.WriteOnly)
+    image.save(buf, "PNG")
+    return bytes(buf.data())
+
+
+def _make_zip(path, members, compression=zipfile.ZIP_STORED):
+    with zipfile.ZipFile(path, "w", compression) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+def _make_tar(path, members):
+    with tarfile.open(path, "w") as tf:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+MEMBERS = {"sub-01/qc.png": b"one" * 50, "sub-02/qc.png": b"two" * 70, "README": b"x"}
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_zip_members_read_back(tmp_path, compression):
+    path = _make_zip(tmp_path / "b.zip", MEMBERS, compression)
+    for name, data in MEMBERS.items():
+        assert archive.read_member(archive.member_path(path, name)) == data
+    with pytest.raises(FileNotFoundError):
+        archive.read_member(path + "::missing.png")
+
+
+def test_tar_members_and_listing(tmp_path):
+    path = _make_tar(tmp_path / "b.tar", MEMBERS)
+    assert archive.read_member(path + "::sub-02/qc.png") == MEMBERS["sub-02/qc.png"]
+    assert archive.list_members(path, (".png",)) == [
+        path + "::sub-01/qc.png",
+        path + "::sub-02/qc.png",
+    ]
+    assert archive.list_members(path + "::sub-02/", (".png",)) == [
+        path + "::sub-02/qc.png"
+    ]
+
+
+def test_index_is_persisted_and_reused(tmp_path, monkeypatch):
+    path = _make_tar(tmp_path / "b.tar", MEMBERS)
+    archive.read_member(path + "::README")
+    assert len(os.listdir(os.path.join(str(tmp_path / "cache"), "archives"))) == 1
+
+    archive._cached_index.cache_clear()
+    monkeypatch.setattr(archive, "_scan_tar", lambda p: pytest.fail("rescanned"))
+    assert archive.read_member(path + "::README") == b"x"
+
+
+def test_compressed_tar_is_rejected(tmp_path):
+    path = str(tmp_path / "b.tar")
+    with tarfile.open(path, "w:gz") as tf:
+        info = tarfile.TarInfo("a.png")
+        tf.addfile(info, io.BytesIO(b""))
+    with pytest.raises(ValueError):
+        archive.read_member(path + "::a.png")
+
+
+def test_corrupt_zip_raises_value_error(tmp_path):
+    bad = tmp_path / "bad.zip"
+    bad.write_bytes(b"PK not really a zip")
+    with pytest.raises(ValueError):
+        archive.list_members(str(bad), (".png",))
+    assert not Session().load_directory(str(bad))
+
+    path = _make_zip(tmp_path / "d.zip", {"a.png": _png(9) * 20}, zipfile.ZIP_DEFLATED)
+    offset, size, _ = archive.index(path)._members["a.png"]
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(b"\xff" * size)
+    archive._cached_index.cache_clear()
+    with pytest.raises(ValueError):
+        archive.read_member(path + "::a.png")
+
+
+def test_label_and_window_load_archive_members(qapp, tmp_path):
+    path = _make_zip(
+        tmp_path / "b.zip", {"sub-01/qc.png": _png(10), "sub-02/qc.png": _png(200)}
+    )
+    label = SaneDefaultsImageLabel()
+    label.load(path + "::sub-02/qc.png")
+    assert label.content is not None and label.content.width() == 8
+
+    window = PyQC.MainWindow()
+    window.loadDirectory(path)
+    assert list(window.filelist) == [path + "::sub-01/qc.png", path + "::sub-02/qc.png"]
+    assert window.tableWidget.item(0, 0).text() == "qc"
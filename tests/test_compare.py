@@ -0,0 +1,57 @@
+from PyQt5.QtGui import QImage
+
+import PyQC
+import compare
+
+
+def test_rules_name_siblings():
+    rule = compare.parse_rule("_raw=_pre")
+    assert compare.sibling("/d/_raw/s1_raw.png", rule) == "/d/_raw/s1_pre.png"
+    assert compare.sibling("/d/s1_pre.png", rule) is None
+    rules = compare.parse_rules("_raw=_pre, .png=.jpg")
+    assert compare.format_rules(rules) == "_raw=_pre,.png=.jpg"
+    for bad in ("_raw", "=_pre"):
+        try:
+            compare.parse_rule(bad)
+        except ValueError:
+            continue
+        raise AssertionError(bad)
+
+
+def _save(path, width, value):
+    image = QImage(width, width, QImage.Format_Grayscale8)
+    image.fill(value)
+    image.save(str(path))
+
+
+def test_compare_viewers_share_zoom_scroll_and_cache(qapp, tmp_path):
+    for i in range(3):
+        _save(tmp_path / "s{}_raw.png".format(i), 40, 10)
+        _save(tmp_path / "s{}_pre.png".format(i), 80, 200)
+    window = PyQC.MainWindow(prefetch="off")
+    window.resize(800, 600)
+    window.show()
+    window.loadDirectory(str(tmp_path))  # rows: s0_pre, s0_raw, s1_pre, ...
+    window.setCompareRules([compare.parse_rule("_pre=_raw")])
+    (area, label), = window._compare_viewers
+    assert window.label.content.width() == 80
+    assert label.content.width() == 40
+    assert label.cache is window.label.cache
+    assert window._row_files(0) == [window.filelist[0], str(tmp_path / "s0_raw.png")]
+
+    window.zoomTo1_1()
+    window.scaleImage(4.0)
+    assert window.label.width() == 320 and label.width() == 160
+    qapp.processEvents()
+    area.verticalScrollBar().setValue(area.verticalScrollBar().maximum())
+    main_bar = window.scrollArea.verticalScrollBar()
+    assert main_bar.value() == main_bar.maximum() > 0
+
+    window.navdown()  # s0_raw has no _pre in its name
+    assert label.content is None
+    assert "No _pre=_raw file" in label.text()
+
+    window.setCompareRules([])
+    assert window._compare_viewers == []
+    window._decode_pool.shutdown()
+    window.hide()
@@ -401,3 +401,28 @@ def test_listlocation_lands_on_first_unrated(qapp, tmp_path):
     window.loadCSV(str(csv_path))
 
     assert window.listlocation == 1
+
+
+def test_csv_set_moves_across_files_and_saves_each(qapp, tmp_path):
+    for site in "ab":
+        (tmp_path / f"{site}.csv").write_text(
+            f"File,QC_Raw,QC_Pre\n/{site}0.png,,\n/{site}1.png,,\n"
+        )
+    window = PyQC.MainWindow(prefetch="off")
+    window.loadCsvSet([str(tmp_path / "a.csv"), str(tmp_path / "b.csv")])
+    for key in "1234":
+        window.numpress(key)  # the last cell of a.csv: on to b.csv
+    assert window.path == str(tmp_path / "b.csv")
+    assert window.listlocation == 0 and window.filelist[0] == "/b0.png"
+    window.numpress("5")
+    assert "CSV 2 / 2" in window._status_label.text()
+    window.navup()  # from b.csv's first row back to a.csv's last
+    assert window.path == str(tmp_path / "a.csv") and window.listlocation == 1
+    assert window.tableWidget.item(1, 2).text() == "4"
+    window.navdown()
+    assert window.tableWidget.item(0, 1).text() == "5"
+
+    window.Save()
+    assert not window._unsaved()
+    assert (tmp_path / "a.csv").read_text().splitlines()[1:] == ["/a0.png,1,2", "/a1.png,3,4"]
+    assert (tmp_path / "b.csv").read_text().splitlines()[1] == "/b0.png,5,"
@@ -0,0 +1,130 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from PyQt5.QtGui import QColor, QImage
+
+import decoders
+from image_widget import SaneDefaultsImageLabel
+
+
+def _pngs(tmp_path):
+    gray = QImage(20, 10, QImage.Format_Grayscale8)
+    gray.fill(90)
+    colour = QImage(21, 11, QImage.Format_ARGB32)
+    colour.fill(QColor(10, 120, 230, 200))
+    paths = str(tmp_path / "gray.png"), str(tmp_path / "colour.png")
+    gray.save(paths[0])
+    colour.save(paths[1])
+    return paths
+
+
+@pytest.mark.parametrize("name", decoders.available())
+def test_backends_agree_with_qimagereader(qapp, tmp_path, name):
+    gray, colour = _pngs(tmp_path)
+    decoder = decoders.create(name)
+    try:
+        image, _ = decoder.decode(gray)
+        assert image.format() == QImage.Format_Grayscale8
+        assert image.pixelColor(3, 3) == QColor(90, 90, 90)
+        with open(colour, "rb") as f:
+            image, _ = decoder.decode("", f.read())
+        assert image.size() == QImage(colour).size()
+        assert image.pixelColor(20, 10) == QImage(colour).pixelColor(20, 10)
+        assert decoder.decode(str(tmp_path / "missing.png"))[0].isNull()
+    finally:
+        decoder.close()
+
+
+@pytest.mark.skipif("shm" not in decoders.available(), reason="needs Pillow")
+def test_shm_backend_maps_pixels_without_copying(qapp, tmp_path):
+    gray, _ = _pngs(tmp_path)
+    decoder = decoders.SharedMemoryDecoder(directory=str(tmp_path / "shm"))
+    try:
+        image, _ = decoder.decode(gray)
+    finally:
+        decoder.close()
+    assert not image._array.flags.owndata
+    assert os.listdir(tmp_path / "shm") == []  # unlinked once mapped
+
+
+@pytest.mark.skipif("shm" not in decoders.available(), reason="needs Pillow")
+def test_shm_backend_refuses_a_planted_default_directory(tmp_path, monkeypatch):
+    planted = tmp_path / "planted"
+    (planted / "decode").mkdir(parents=True)
+    os.symlink(planted, tmp_path / "pyqc-link")
+    monkeypatch.setattr(decoders.shared_cache, "default_dir", lambda: str(tmp_path / "pyqc-link"))
+    decoder = decoders.SharedMemoryDecoder()
+    try:
+        assert not decoder.directory.startswith(str(tmp_path / "pyqc-link"))
+        assert os.path.dirname(os.path.dirname(decoder.directory)) == str(tmp_path)
+    finally:
+        decoder.close()
+
+
+def test_label_falls_back_to_qimagereader(qapp, tmp_path):
+    class Refuses:
+        calls = 0
+
+        def decode(self, source, data=None):
+            self.calls += 1
+            return QImage(), "unsupported"
+
+    gray, _ = _pngs(tmp_path)
+    label = SaneDefaultsImageLabel()
+    label.decoder = Refuses()
+    label.load(gray)
+    assert label.decoder.calls == 1
+    assert label.content.width() == 20
+
+
+@pytest.mark.skipif("pillow" not in decoders.available(), reason="needs Pillow")
+@pytest.mark.parametrize("name", ["pillow", "shm"])
+def test_label_finishes_images_decoded_ahead(qapp, tmp_path, monkeypatch, name):
+    monkeypatch.setenv("PYQC_CACHE_DIR", str(tmp_path / "cache"))
+    gray, colour = _pngs(tmp_path)
+    label = SaneDefaultsImageLabel()
+    label.decoder = decoders.create(name)
+    try:
+        label.predecode([gray, colour])
+        jobs = dict(label._decoding)
+        assert set(jobs) == {gray, colour}
+        label.load(gray)
+        assert label.content.pixelColor(3, 3) == QColor(90, 90, 90)
+        label.predecode([])  # moved on: the colour job is dropped
+        assert not label._decoding
+    finally:
+        label.decoder.close()
+
+
+def test_auto_benchmarks_once_per_machine(qapp, tmp_path, monkeypatch):
+    monkeypatch.setenv("PYQC_CACHE_DIR", str(tmp_path))
+    runs = []
+    monkeypatch.setattr(decoders, "_fastest", lambda: runs.append(1) or decoders.QtDecoder())
+    decoder = decoders.create()
+    assert decoder.name == "auto" and decoder.wait(10)
+    assert decoder.chosen == "qt"
+    assert decoders.create().name == "qt"
+    assert len(runs) == 1
+
+
+def test_benchmark_times_each_backend(qapp):
+    timings = decoders.benchmark(["qt"], rounds=1)
+    assert list(timings) == ["qt"] and timings["qt"] > 0
+
+
+def test_unavailable_decoder_is_a_usage_error():
+    code = (
+        "import sys; sys.modules['PIL'] = None; import PyQC; "
+        "sys.argv = ['pyqc', '--decoder', 'shm']; PyQC.main()"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    assert out.returncode == 2
+    assert "--decoder shm: the shm decoder needs Pillow" in out.stderr
+    assert "Traceback" not in out.stderr
@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+
+import dedupe
+import PyQC
+from imageops import array_to_qimage
+
+
+def _image(seed, shape=(120, 160)):
+    y, x = np.mgrid[0 : shape[0], 0 : shape[1]]
+    pixels = 128 + 60 * np.sin(x / (10 + 3 * seed)) + 50 * np.cos(y / (7 + 5 * seed))
+    return array_to_qimage(np.ascontiguousarray(pixels.clip(0, 255), dtype=np.uint8)).copy()
+
+
+def test_hashes_survive_reencoding_and_are_reused(tmp_path):
+    _image(1).save(str(tmp_path / "a.png"))
+    _image(1).save(str(tmp_path / "a.jpg"), "JPEG", 70)
+    _image(2).save(str(tmp_path / "b.png"))
+    (tmp_path / "bad.png").write_bytes(b"not an image")
+
+    a, a_jpg, b, bad = (
+        dedupe.hash_file(str(tmp_path / name)) for name in ("a.png", "a.jpg", "b.png", "bad.png")
+    )
+    assert bin(a["perceptual"] ^ a_jpg["perceptual"]).count("1") <= dedupe.MAX_DISTANCE
+    assert a["content"] != a_jpg["content"]
+    assert bad["perceptual"] is None and bad["content"] and "error" in bad
+
+    index = dedupe.HashIndex(str(tmp_path / "index.jsonl"))
+    for result in (a, b, bad):
+        index.update(result)
+    index.save()
+    again = dedupe.HashIndex(str(tmp_path / "index.jsonl"))
+    assert set(again.entries) == {a["path"], b["path"]}
+    known = again.get(b["path"])
+    fake = known[:2] + ("cached", 7)
+    assert dedupe.hash_file(b["path"], fake)["perceptual"] == 7  # unchanged: not read
+    assert dedupe.hash_file(b["path"], (0,) + known[1:])["content"] == b["content"]
+
+
+def test_group_duplicates():
+    far = 0xFFFF_0000_FFFF_0000
+    groups = dedupe.group_duplicates(
+        ["x", "y", "z", "c", "c", None],
+        [far, 0b1011, 0b0000, None, None, 0b1000],
+    )
+    assert groups == [[1, 2, 5], [3, 4]]
+    assert dedupe.group_duplicates(["x", "y"], [0, 0b111], max_distance=2) == []
+    assert dedupe.group_duplicates([], []) == []
+    # Near matches do not chain: the last hash is 6 bits from the first
+    chain = [0b000000, 0b000111, 0b111111, 0b000111]
+    assert dedupe.group_duplicates(list("abcd"), chain) == [[0, 1, 3]]
+
+
+def test_flat_images_have_no_perceptual_hash(tmp_path):
+    for name, value in (("black.png", 0), ("grey.png", 128)):
+        image = _image(1)
+        image.fill(value)
+        image.save(str(tmp_path / name))
+    black, grey = (dedupe.hash_file(str(tmp_path / n)) for n in ("black.png", "grey.png"))
+    assert black["perceptual"] is None and grey["perceptual"] is None
+    assert "error" not in black and black["content"] != grey["content"]
+    assert dedupe.group_duplicates([black["content"], grey["content"]], [None, None]) == []
+
+    index = dedupe.HashIndex(str(tmp_path / "index.jsonl"))
+    index.update(black)
+    assert index.get(black["path"])[3] is None
+
+
+def test_window_groups_duplicates_and_copies_ratings(qapp, tmp_path, monkeypatch):
+    monkeypatch.setenv("PYQC_CACHE_DIR", str(tmp_path / "cache"))
+    images = tmp_path / "images"
+    images.mkdir()
+    for name, seed in (("a.png", 1), ("b.png", 2), ("c.png", 1), ("d.png", 3)):
+        _image(seed).save(str(images / name))
+    window = PyQC.MainWindow(prefetch="off")
+    window.loadDirectory(str(images))
+    window.findDuplicates()
+    deadline = time.monotonic() + 60
+    while window._hasher is not None and time.monotonic() < deadline:
+        time.sleep(0.05)
+        window._collect_hashes()
+    assert window._hasher is None
+    assert (tmp_path / "cache" / "hashes" / "index.jsonl").exists()
+
+    column = window.column_names.index(PyQC.DUPLICATE_COLUMN)
+    labels = [window.session.cell(row, column) for row in range(4)]
+    assert labels == ["dup-1", "", "dup-1", ""]
+    assert window.tableWidget.item(0, column).toolTip() == "Same file as rows 3"
+    assert column not in window._rating_columns()
+
+    window._go_to_row(0)
+    window.numpress("2")
+    window.numpress("1")
+    window._go_to_row(0)
+    window.rateDuplicates()
+    assert [window.session.cell(2, c) for c in (1, 2)] == ["2", "1"]
+    window.undo()
+    assert [window.session.cell(2, c) for c in (1, 2)] == ["", ""]
+    window._dirty = False
+    window.close()
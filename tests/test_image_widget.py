@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QColor, QImage
+
+from image_cache import DecodedImageCache, image_nbytes
+from image_widget import SaneDefaultsImageLabel, SaneQImage, SaneQPixmap
+from imageops import array_to_qimage, box_downscale, qimage_view
+
+
+def _save(tmp_path, name, fmt, color):
+    image = QImage(203, 101, fmt)
+    image.fill(color)
+    path = str(tmp_path / name)
+    assert image.save(path)
+    return path
+
+
+def test_grayscale_png_stays_single_channel(qapp, tmp_path):
+    path = _save(tmp_path, "gray.png", QImage.Format_Grayscale8, 128)
+    label = SaneDefaultsImageLabel()
+    label.resize(50, 50)
+    label.load(path)
+
+    assert isinstance(label.content, SaneQImage)
+    assert label.content.format() == QImage.Format_Grayscale8
+    assert image_nbytes(label.content) < 203 * 101 * 2
+    assert label.pixmap() is not None and not label.pixmap().isNull()
+
+
+def test_gray_rgb_file_is_converted_colour_file_is_not(qapp, tmp_path):
+    gray_rgb = _save(tmp_path, "rgb_gray.png", QImage.Format_RGB32, QColor(60, 60, 60))
+    colour = _save(tmp_path, "colour.png", QImage.Format_RGB32, QColor(200, 10, 10))
+    label = SaneDefaultsImageLabel()
+
+    label.load(gray_rgb)
+    assert isinstance(label.content, SaneQImage)
+    label.load(colour)
+    assert isinstance(label.content, SaneQPixmap)
+
+
+def test_reload_is_served_from_cache(qapp, tmp_path):
+    path = _save(tmp_path, "gray.png", QImage.Format_Grayscale8, 10)
+    label = SaneDefaultsImageLabel()
+    label.load(path)
+    first = label.content
+    label.load(path)
+
+    assert label.content is first
+    assert label.cache.hits == 1
+
+
+def test_rewritten_file_is_decoded_again(qapp, tmp_path):
+    path = _save(tmp_path, "gray.png", QImage.Format_Grayscale8, 10)
+    label = SaneDefaultsImageLabel()
+    label.load(path)
+    _save(tmp_path, "gray.png", QImage.Format_Grayscale8, 200)
+    os.utime(path, ns=(0, 10**9))  # a different mtime even on coarse clocks
+    label.load(path)
+
+    assert label.cache.hits == 0
+    assert label.content.pixelColor(0, 0).red() == 200
+
+
+def test_grayscale_adapt_scale_keeps_aspect():
+    image = SaneQImage(1000, 500, QImage.Format_Grayscale8)
+    image.fill(200)
+    scaled = image.adaptScale(QSize(100, 100))
+    assert (scaled.width(), scaled.height()) == (100, 50)
+    assert QColor(scaled.pixel(50, 25)).red() == 200
+
+
+def test_qimage_view_respects_row_padding():
+    image = QImage(5, 3, QImage.Format_Grayscale8)  # 5-byte rows padded to 8
+    image.fill(0)
+    image.setPixel(4, 2, QColor(9, 9, 9).rgb())
+    view = qimage_view(image)
+    assert view.shape == (3, 5)
+    assert view[2, 4] == 9
+
+    wrapped = array_to_qimage(np.arange(6, dtype=np.uint8).reshape(2, 3))
+    assert wrapped.format() == QImage.Format_Grayscale8
+    assert qimage_view(wrapped)[1, 2] == 5
+
+
+def test_box_downscale_averages_blocks_and_keeps_dtype():
+    array = np.array([[0, 2, 4, 6, 9], [2, 4, 6, 8, 9]], dtype=np.uint16)
+    out = box_downscale(array, 2)
+    assert out.dtype == np.uint16
+    assert out.tolist() == [[2, 6]]
+
+
+def test_cache_evicts_least_recently_used_by_bytes():
+    def gray(n):
+        image = QImage(n, 1, QImage.Format_Grayscale8)
+        image.fill(0)
+        return image
+
+    cache = DecodedImageCache(budget=100)
+    cache.put("a", gray(40))
+    cache.put("b", gray(40))
+    cache.get("a")
+    cache.put("c", gray(40))  # evicts "b", the least recently used
+
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.nbytes <= 100
+    cache.put("huge", gray(1000))
+    assert "huge" not in cache
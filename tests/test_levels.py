@@ -0,0 +1,82 @@
+import time
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+import levels
+from image_widget import SaneDefaultsImageLabel
+from imageops import array_to_qimage, qimage_view
+
+
+def _ramp16(tmp_path):
+    pixels = np.tile(np.linspace(1000, 2000, 64).astype(np.uint16), (32, 1))
+    path = str(tmp_path / "ramp16.png")
+    array_to_qimage(pixels).save(path)
+    return path
+
+
+def test_window_maps_16_bit_values_through_one_lut():
+    pixels = np.array([[0, 1000, 1500, 2000, 65535]], np.uint16)
+    out = levels.apply(array_to_qimage(pixels), 1000, 2000)
+    assert out.format() == QImage.Format_Grayscale8
+    assert qimage_view(out).tolist() == [[0, 0, 128, 255, 255]]
+    assert levels.lut(1000, 2000, 65536) is levels.lut(1000, 2000, 65536)
+
+
+def test_colour_windowing_keeps_alpha():
+    pixels = np.zeros((2, 2, 4), np.uint8)
+    pixels[..., :3] = 100
+    pixels[..., 3] = 77
+    image = levels.apply(array_to_qimage(pixels), 50, 150)
+    out = qimage_view(image)
+    assert (out[..., :3] == 128).all() and (out[..., 3] == 77).all()
+
+
+def test_stats_give_range_and_percentile_window():
+    pixels = np.arange(1000, dtype=np.uint16).reshape(10, 100)
+    stats = levels.stats(array_to_qimage(pixels))
+    assert stats["levels"] == 65536
+    assert (stats["min"], stats["max"]) == (0, 999)
+    assert (stats["low"], stats["high"]) == (5, 994)
+
+
+def test_label_auto_contrast_uses_background_histogram(qapp, tmp_path):
+    label = SaneDefaultsImageLabel()
+    label.resize(64, 32)
+    label.set_auto_contrast(True)
+    path = _ramp16(tmp_path)
+    label.load(path)
+    deadline = time.monotonic() + 5
+    while label.window is None and time.monotonic() < deadline:
+        qapp.processEvents()
+    low, high = label.window
+    assert 1000 <= low < 1010 and 1990 < high <= 2000
+    shown = qimage_view(label.pixmap().toImage().convertToFormat(QImage.Format_Grayscale8))
+    assert shown.min() < 5 and shown.max() > 250
+
+    label.set_window((1400, 1600))
+    label.set_window((1400, 1600))
+    assert len(label._windowed) == 2  # the auto window and this one
+    label.load(path)  # cached stats: windowed straight away
+    assert label.window == (low, high)
+
+
+def test_stats_are_only_computed_with_auto_contrast(qapp, tmp_path, monkeypatch):
+    calls = []
+
+    def stats(content):
+        calls.append(content)
+        return {"levels": 65536, "min": 1000, "max": 2000, "low": 1100, "high": 1900}
+
+    monkeypatch.setattr(levels, "stats", stats)
+    label = SaneDefaultsImageLabel()
+    label.resize(64, 32)
+    label.load(_ramp16(tmp_path))
+    qapp.processEvents()
+    assert not calls and label.window is None
+
+    label.set_auto_contrast(True)
+    deadline = time.monotonic() + 5
+    while label.window is None and time.monotonic() < deadline:
+        qapp.processEvents()
+    assert len(calls) == 1 and label.window == (1100, 1900)
@@ -0,0 +1,58 @@
+from PyQt5.QtGui import QImage
+
+import memory
+import PyQC
+from image_cache import DecodedImageCache
+
+
+def test_enforce_releases_in_registration_order():
+    first, second = DecodedImageCache(), DecodedImageCache()
+    for cache, keys in ((first, "ab"), (second, "cd")):
+        for key in keys:
+            cache.put(key, QImage(256, 256, QImage.Format_RGB32))  # 256 kB each
+    accounts = memory.MemoryAccounts(budget=3 * 256 * 1024)
+    accounts.register("first", lambda: first.nbytes, first.release)
+    accounts.register("fixed", lambda: 100)
+    accounts.register("second", lambda: second.nbytes, second.release)
+
+    assert accounts.enforce() == 2 * 256 * 1024
+    assert first.nbytes == 0 and second.nbytes == 2 * 256 * 1024
+    assert accounts.counters() == {"first": 0, "fixed": 100, "second": 512 * 1024}
+    assert accounts.enforce() == 0
+    assert accounts.summary() == "mem 512 kB / 768 kB"
+    lines = accounts.report().splitlines()
+    assert lines[0].split() == ["first", "0", "kB"]
+    assert lines[-1] == "budget 768 kB, 512 kB released to stay within it"
+
+
+def test_window_counts_and_releases_its_memory(qapp, tmp_path):
+    for i in range(3):
+        image = QImage(200, 100, QImage.Format_RGB32)
+        image.fill(0xFF204080 + i * 0x300000)
+        image.save(str(tmp_path / f"{i}.png"))
+    window = PyQC.MainWindow(prefetch="off")
+    window.loadDirectory(str(tmp_path))
+    window._go_to_row(1)
+    counters = window.memory.counters()
+    assert counters["decoded images"] >= 2 * 200 * 100 * 4
+    assert counters["table items"] == 3 * PyQC.TABLE_ITEM_BYTES  # paths; empty cells have none
+    assert counters["paths"] > 0 and counters["ratings"] > 0
+    assert "mem " not in window._status_label.text()  # counted by the timer, not per move
+    window._check_memory()
+    assert window._status_label.text().endswith(window.memory.summary(counters))
+    assert "decoded images" in window._status_label.toolTip()
+
+    window.numpress("2")
+    assert window.memory.counters()["table items"] == 4 * PyQC.TABLE_ITEM_BYTES
+
+    window.setMemoryBudget(counters["table items"])
+    assert window.memory.counters()["decoded images"] <= 200 * 100 * 4  # the image shown
+    assert window.memory.released > 0
+    window.setMemoryBudget(None)
+    assert window._memory_timer.isActive()
+
+    window._memory_report = str(tmp_path / "memory.txt")
+    window.writeMemoryReport()
+    assert "decoded images" in (tmp_path / "memory.txt").read_text()
+    window._dirty = False
+    window.close()
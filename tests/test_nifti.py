@@ -0,0 +1,127 @@
+import gzip
+import os
+import struct
+
+import numpy as np
+import pytest
+from PyQt5.QtGui import QImage
+
+import nifti
+from image_widget import SaneDefaultsImageLabel, SaneQImage
+
+
+def _write_nifti(path, data, pixdim=(1.0, 1.0, 1.0), compress=False):
+    """Minimal single-file NIfTI-1 writer (little-endian int16 or float32)."""
+    datatype = {np.dtype(np.int16): 4, np.dtype(np.float32): 16}[data.dtype]
+    header = bytearray(352)
+    struct.pack_into("<i", header, 0, 348)
+    dim = (data.ndim,) + data.shape + (1,) * (7 - data.ndim)
+    struct.pack_into("<8h", header, 40, *dim)
+    struct.pack_into("<hh", header, 70, datatype, data.dtype.itemsize * 8)
+    struct.pack_into("<8f", header, 76, 1.0, *pixdim, 1.0, 1.0, 1.0, 1.0)
+    struct.pack_into("<f", header, 108, 352.0)
+    header[344:348] = b"n+1\0"
+    payload = bytes(header) + data.astype(data.dtype.newbyteorder("<")).tobytes(order="F")
+    opener = gzip.open if compress else open
+    with opener(str(path), "wb") as f:
+        f.write(payload)
+    return str(path)
+
+
+def _volume(shape=(20, 16, 12)):
+    x, y, z = np.indices(shape)
+    return (x * 100 + y * 10 + z).astype(np.int16)
+
+
+def test_slices_are_read_in_voxel_order(tmp_path):
+    data = _volume()
+    volume = nifti.NiftiVolume(_write_nifti(tmp_path / "v.nii", data))
+
+    assert isinstance(volume.data, np.memmap)
+    assert volume.shape == data.shape
+    (axial, _), (coronal, _), (sagittal, _) = volume.slices()
+    np.testing.assert_array_equal(axial, np.flipud(data[:, :, 6].T))
+    np.testing.assert_array_equal(coronal, np.flipud(data[:, 8, :].T))
+    np.testing.assert_array_equal(sagittal, np.flipud(data[10, :, :].T))
+
+
+def test_montage_windows_panels_and_corrects_aspect(tmp_path):
+    data = _volume()
+    path = _write_nifti(tmp_path / "v.nii", data, pixdim=(1.0, 1.0, 2.0))
+    canvas = nifti.montage(path, gap=4)
+
+    assert canvas.dtype == np.uint8 and canvas.flags.c_contiguous
+    # axial is 16 rows; coronal/sagittal are 12 slices of 2mm -> 24 rows
+    assert canvas.shape == (24, 20 + 20 + 16 + 2 * 4)
+    assert canvas.min() == 0 and canvas.max() == 255
+
+
+def test_gz_is_decompressed_once_into_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYQC_CACHE_DIR", str(tmp_path / "cache"))
+    data = _volume().astype(np.float32)
+    path = _write_nifti(tmp_path / "v.nii.gz", data, compress=True)
+
+    first = nifti.NiftiVolume(path)
+    cached = os.listdir(nifti.cache_dir())
+    assert len(cached) == 1
+    stamp = os.stat(os.path.join(nifti.cache_dir(), cached[0])).st_mtime_ns
+
+    second = nifti.NiftiVolume(path)
+    assert os.listdir(nifti.cache_dir()) == cached
+    assert os.stat(os.path.join(nifti.cache_dir(), cached[0])).st_mtime_ns == stamp
+    np.testing.assert_array_equal(first.data, second.data)
+
+
+def test_label_shows_volume_montage_from_cache(qapp, tmp_path):
+    path = _write_nifti(tmp_path / "sub-01_T1w.nii", _volume())
+    label = SaneDefaultsImageLabel()
+    label.resize(60, 60)
+    label.load(path)
+
+    assert isinstance(label.content, SaneQImage)
+    assert label.content.format() == QImage.Format_Grayscale8
+    assert label.pixmap() is not None and not label.pixmap().isNull()
+    content = label.content
+    label.load(path)
+    assert label.content is content and label.cache.hits == 1
+
+
+def test_label_reports_bad_volume(qapp, tmp_path):
+    path = tmp_path / "broken.nii"
+    path.write_bytes(b"\0" * 400)
+    label = SaneDefaultsImageLabel()
+    label.load(str(path))
+
+    assert label.content is None
+    assert "Failed to load" in label.text()
+
+
+def test_label_reports_truncated_gz(qapp, tmp_path, monkeypatch):
+    monkeypatch.setenv("PYQC_CACHE_DIR", str(tmp_path / "cache"))
+    path = _write_nifti(tmp_path / "vol.nii.gz", _volume(), compress=True)
+    data = open(path, "rb").read()
+    with open(path, "wb") as f:
+        f.write(data[: len(data) // 2])
+    label = SaneDefaultsImageLabel()
+    label.load(path)
+
+    assert label.content is None
+    assert "Failed to load" in label.text()
+    assert not os.listdir(nifti.cache_dir())
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="counts fds in /proc")
+def test_failed_gz_open_closes_the_temporary_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYQC_CACHE_DIR", str(tmp_path / "cache"))
+    path = _write_nifti(tmp_path / "vol.nii.gz", _volume(), compress=True)
+
+    def refuse(*args, **kwargs):
+        raise PermissionError("denied")
+
+    monkeypatch.setattr(nifti.gzip, "open", refuse)
+    fds = len(os.listdir("/proc/self/fd"))
+    for _ in range(3):
+        with pytest.raises(PermissionError):
+            nifti._decompressed_path(path)
+    assert len(os.listdir("/proc/self/fd")) == fds
+    assert not os.listdir(nifti.cache_dir())
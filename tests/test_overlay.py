@@ -0,0 +1,67 @@
+import numpy as np
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QImage
+
+import PyQC
+import compare
+import overlay
+from image_widget import SaneQImage
+from imageops import array_to_qimage, qimage_view
+
+
+def test_composites_match_their_definitions():
+    rng = np.random.default_rng(1)
+    a, b = rng.integers(0, 256, (2, 37, 45, 4), dtype=np.uint8)
+    for alpha in (0.0, 0.3, 1.0):
+        expected = a * (1 - alpha) + b * alpha
+        # alpha is applied in 1/128 steps, and rounded down
+        assert np.abs(overlay.blend(a, b, alpha) - expected).max() < 2
+    assert (overlay.blend(a, b, 1.0) == b).all()
+
+    rows, cols = np.indices(a.shape[:2]) // 8
+    from_b = ((rows + cols) % 2 == 1)[:, :, None]
+    assert (overlay.checkerboard(a, b, 8) == np.where(from_b, b, a)).all()
+    assert (overlay.difference(a, b) == np.abs(a.astype(int) - b)).all()
+
+
+def _gray(width, height, value):
+    pixels = np.full((height, width), value, np.uint8)
+    return array_to_qimage(pixels, cls=SaneQImage).copy()
+
+
+def test_renderer_fits_and_caches_per_pair_mode_and_size(qapp):
+    a, b = _gray(40, 20, 100), _gray(80, 40, 200)
+    renderer = overlay.OverlayRenderer()
+    image = renderer.render("a", SaneQImage(a), "b", SaneQImage(b), QSize(20, 20), "difference")
+    assert image.size() == QSize(20, 10)
+    assert image.format() == QImage.Format_Grayscale8
+    assert (qimage_view(image) == 100).all()
+    again = renderer.render("a", SaneQImage(a), "b", SaneQImage(b), QSize(20, 20), "difference")
+    assert again is image
+    half = renderer.render("a", SaneQImage(a), "b", SaneQImage(b), QSize(20, 20), "blend")
+    assert (qimage_view(half) == 150).all()
+
+
+def test_window_cycles_overlays_in_compare_mode(qapp, tmp_path):
+    QImage(_gray(30, 30, 40)).save(str(tmp_path / "s_fixed.png"))
+    QImage(_gray(30, 30, 240)).save(str(tmp_path / "s_moving.png"))
+    window = PyQC.MainWindow(prefetch="off")
+    window.cycleOverlay()
+    assert window._overlay_mode is None  # needs a second viewer
+
+    window.openArgumentFiles([str(tmp_path / "s_fixed.png")])
+    window.setCompareRules([compare.parse_rule("_fixed=_moving")])
+    window.cycleOverlay()
+    assert window.label.overlay[2] == "blend"
+    window.adjustOverlayAlpha(0.5)
+    assert window.label.overlay[3] == 1.0
+    assert (qimage_view(window.label.pixmap().toImage().convertToFormat(
+        QImage.Format_Grayscale8)) == 240).all()
+    assert "blend 100%" in window._status_label.text()
+
+    window.navdown()  # reloading keeps the mode
+    assert window.label.overlay[2] == "blend"
+    for _ in overlay.MODES:
+        window.cycleOverlay()
+    assert window.label.overlay is None
+    window._decode_pool.shutdown()
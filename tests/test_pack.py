@@ -0,0 +1,163 @@
+import os
+import struct
+
+import pytest
+from PyQt5.QtCore import QBuffer, QIODevice
+from PyQt5.QtGui import QColor, QImage
+
+import archive
+import pack
+import PyQC
+
+
+def _png_bytes(width, height, color, fmt=QImage.Format_RGB32):
+    image = QImage(width, height, fmt)
+    image.fill(color)
+    buf = QBuffer()
+    buf.open(QIODevice.WriteOnly)
+    image.save(buf, "PNG")
+    return bytes(buf.data())
+
+
+def test_encoded_members_round_trip_and_append(tmp_path):
+    path = str(tmp_path / "a.pyqcpack")
+    with pack.PackWriter(path) as writer:
+        writer.add("sub-01/qc.png", _png_bytes(4, 3, QColor(200, 0, 0)))
+        writer.add("sub-02/qc.png", b"not an image")
+
+    with pack.PackWriter(path, append=True) as writer:
+        assert "sub-01/qc.png" in writer
+        with pytest.raises(ValueError):
+            writer.add("sub-01/qc.png", b"")
+        writer.add("sub-03/qc.png", _png_bytes(6, 5, QColor(0, 0, 200)))
+
+    reader = pack.PackReader(path)
+    assert reader.names() == ["sub-01/qc.png", "sub-02/qc.png", "sub-03/qc.png"]
+    assert bytes(reader.read("sub-02/qc.png")) == b"not an image"
+    assert reader.image("sub-03/qc.png").size().width() == 6
+    assert reader.image("sub-02/qc.png").isNull()
+    with pytest.raises(FileNotFoundError):
+        reader.read("missing")
+
+
+def test_append_keeps_existing_mappings_valid(tmp_path):
+    path = str(tmp_path / "a.pyqcpack")
+    with pack.PackWriter(path) as writer:
+        writer.add("a.png", b"first")
+    before = pack.PackReader(path)
+    snapshot = bytes(before._map)
+
+    with pack.PackWriter(path, append=True) as writer:
+        writer.add("b.png", b"second")
+
+    assert bytes(before._map) == snapshot  # appended after, never overwritten
+    reader = pack.PackReader(path)
+    assert bytes(reader.read("a.png")) == b"first"
+    assert bytes(reader.read("b.png")) == b"second"
+
+
+def test_rewrite_replaces_the_file_instead_of_truncating_it(tmp_path):
+    path = str(tmp_path / "a.pyqcpack")
+    with pack.PackWriter(path) as writer:
+        writer.add("a.png", b"first")
+    before = pack.PackReader(path)
+    snapshot = bytes(before._map)
+
+    with pack.PackWriter(path) as writer:
+        writer.add("b.png", b"second")
+
+    assert bytes(before._map) == snapshot  # the old file, still intact
+    assert pack.PackReader(path).names() == ["b.png"]
+    assert os.listdir(tmp_path) == ["a.pyqcpack"]
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(path).st_mode & 0o777 == 0o666 & ~umask
+
+
+def test_preview_wraps_mapping_without_copy(tmp_path):
+    path = str(tmp_path / "p.pyqcpack")
+    gray = QImage(300, 100, QImage.Format_Grayscale8)
+    gray.fill(90)
+    with pack.PackWriter(path) as writer:
+        writer.add("g.png", pack.preview_blob(gray, 150), pack.PREVIEW)
+
+    image = pack.PackReader(path).image("g.png")
+    assert (image.width(), image.height()) == (150, 50)
+    assert image.format() == QImage.Format_Grayscale8
+    assert not image._array.flags.owndata
+    assert image.pixelColor(10, 10).red() == 90
+
+
+def test_not_a_pack(tmp_path):
+    path = tmp_path / "x.pyqcpack"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        pack.PackReader(str(path))
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [("table offset", 1 << 40), ("count", 1000), ("blob size", 1 << 20), ("name end", 99)],
+)
+def test_corrupt_table_is_a_value_error(tmp_path, field, value):
+    path = tmp_path / "c.pyqcpack"
+    with pack.PackWriter(str(path)) as writer:
+        writer.add("a.png", b"abc")
+        writer.add("b.png", b"defg")
+    data = bytearray(path.read_bytes())
+    table_offset, count, _ = pack._TRAILER.unpack_from(data, len(data) - pack._TRAILER.size)
+    trailer = len(data) - pack._TRAILER.size
+    if field == "table offset":
+        struct.pack_into("<Q", data, trailer, value)
+    elif field == "count":
+        struct.pack_into("<Q", data, trailer + 8, value)
+    elif field == "blob size":
+        struct.pack_into("<Q", data, table_offset + 8, value)
+    else:
+        struct.pack_into("<I", data, table_offset + pack._ENTRY.size + 20, value)
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="corrupt pack"):
+        pack.PackReader(str(path))
+
+
+def test_pack_cli_from_csv_keeps_ratings_and_loads(qapp, tmp_path, capsys):
+    (tmp_path / "imgs").mkdir()
+    for name in ("a.png", "b.png"):
+        (tmp_path / "imgs" / name).write_bytes(_png_bytes(8, 8, QColor(1, 2, 3)))
+    (tmp_path / "ratings.csv").write_text(
+        "File,QC_Raw,QC_Pre\nimgs/a.png,5,\nimgs/b.png,,\nimgs/gone.png,1,\n"
+    )
+    out = str(tmp_path / "ratings.pyqcpack")
+    assert PyQC.pack_main([str(tmp_path / "ratings.csv"), "-o", out]) == 1
+    assert "2 images" in capsys.readouterr().out
+
+    window = PyQC.MainWindow()
+    window.loadCSV(str(tmp_path / "ratings-packed.csv"))
+    assert window.filelist[0] == str(tmp_path / "ratings.pyqcpack::imgs/a.png")
+    assert window.filelist[2] == str(tmp_path / "imgs" / "gone.png")
+    assert window.tableWidget.item(0, 1).text() == "5"
+    window._go_to_row(1)
+    assert window.label.content is not None and window.label.content.width() == 8
+
+
+def test_pack_cli_directory_previews_and_listing(qapp, tmp_path):
+    for name in ("x.png", "y.png"):
+        (tmp_path / name).write_bytes(_png_bytes(400, 200, QColor(9, 9, 9)))
+    out = str(tmp_path / "out" / "d.pyqcpack")
+    (tmp_path / "out").mkdir()
+    assert PyQC.pack_main([str(tmp_path), "-o", out, "--preview-size", "100"]) == 0
+    assert PyQC.pack_main([str(tmp_path), "-o", out, "--append"]) == 0
+    assert len(pack.PackReader(out)) == 2
+
+    window = PyQC.MainWindow()
+    window.loadDirectory(out)
+    assert list(window.filelist) == [out + "::x.png", out + "::y.png"]
+    assert window.label.content.width() == 100
+    assert archive.read_member(out + "::y.png")
+
+
+def test_pack_cli_missing_source(tmp_path, capsys):
+    out = str(tmp_path / "x.pyqcpack")
+    assert PyQC.pack_main([str(tmp_path / "nowhere"), "-o", out]) == 1
+    assert PyQC.pack_main([str(tmp_path / "nowhere.csv"), "-o", out]) == 1
+    assert capsys.readouterr().err.count("Error:") == 2
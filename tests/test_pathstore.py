@@ -0,0 +1,44 @@
+from pathstore import PathStore
+
+
+def test_pathstore_roundtrips_exact_strings():
+    paths = [
+        "/data/sub-01/anat/sub-01_T1w.jpg",
+        "/data/sub-01/anat/sub-01_T2w.jpg",
+        "/data/sub-02/anat/sub-02_T1w.jpg",
+        "relative//odd/path.png",
+        "no_directory.gif",
+        "/data/sub-03/ünïcødé.png",
+    ]
+    store = PathStore(paths)
+
+    assert len(store) == len(paths)
+    assert list(store) == paths
+    assert store == paths
+    assert store[-1] == paths[-1]
+    assert store[1:3] == paths[1:3]
+
+
+def test_pathstore_interns_shared_prefixes():
+    store = PathStore(f"/data/sub-01/anat/img{i}.png" for i in range(100))
+    assert len(store._dirs) == 1
+    store.append("/data/sub-02/anat/img0.png")
+    assert len(store._dirs) == 2
+
+
+def test_pathstore_display_name_matches_splitext_basename():
+    store = PathStore(["/tmp/img1.jpg", "/tmp/archive.tar.gz", "/tmp/noext"])
+    assert store.display_name(0) == "img1"
+    assert store.display_name(1) == "archive.tar"
+    assert store.display_name(2) == "noext"
+
+
+def test_pathstore_is_smaller_than_a_list_of_strings():
+    import sys
+
+    paths = [
+        f"/project/derivatives/qc/sub-{i // 10:05d}/ses-01/sub-{i // 10:05d}_run-{i % 10}_T1w.jpg"
+        for i in range(5000)
+    ]
+    as_list = sys.getsizeof(paths) + sum(sys.getsizeof(p) for p in paths)
+    assert PathStore(paths).nbytes() < as_list / 2
@@ -0,0 +1,132 @@
+import itertools
+import zipfile
+
+from PyQt5.QtCore import QBuffer, QIODevice
+from PyQt5.QtGui import QImage
+
+import prefetch
+import PyQC
+from prefetch import Prefetcher
+
+
+def _files(tmp_path, n, size=100):
+    paths = []
+    for i in range(n):
+        path = tmp_path / "f{:02}.bin".format(i)
+        path.write_bytes(bytes([i]) * size)
+        paths.append(str(path))
+    return paths
+
+
+def test_reads_window_ahead_and_hands_bytes_over(tmp_path):
+    paths = _files(tmp_path, 10)
+    prefetcher = Prefetcher(min_window=3, max_window=3)
+    try:
+        prefetcher.hint(paths)
+        assert prefetcher.wait(5)
+        assert prefetcher.nbytes == 300
+        assert prefetcher.take(paths[1]) == bytes([1]) * 100
+        assert prefetcher.take(paths[1]) is None
+        assert prefetcher.take(paths[5]) is None
+        assert (prefetcher.hits, prefetcher.misses) == (1, 2)
+
+        # Moving on drops what is no longer ahead of the rater
+        prefetcher.hint(paths[6:])
+        assert prefetcher.wait(5)
+        assert prefetcher.take(paths[0]) is None
+        assert prefetcher.take(paths[7]) == bytes([7]) * 100
+    finally:
+        prefetcher.close()
+
+
+def test_budget_bounds_the_pool(tmp_path):
+    paths = _files(tmp_path, 6, size=1000)
+    prefetcher = Prefetcher(budget=2500, min_window=6, max_window=6)
+    try:
+        prefetcher.hint(paths)
+        assert prefetcher.wait(5)
+        assert prefetcher.nbytes <= 2500
+    finally:
+        prefetcher.close()
+
+
+def test_unexpected_read_errors_leave_the_worker_running(tmp_path, monkeypatch):
+    paths = _files(tmp_path, 3)
+    read = prefetch._read
+
+    def flaky_read(path):
+        if path == paths[0]:
+            raise EOFError("truncated")
+        return read(path)
+
+    monkeypatch.setattr(prefetch, "_read", flaky_read)
+    prefetcher = Prefetcher(workers=1, min_window=3, max_window=3)
+    try:
+        prefetcher.hint(paths)
+        assert prefetcher.wait(5)
+        assert prefetcher.take(paths[0]) is None
+        assert prefetcher.take(paths[2]) == bytes([2]) * 100
+    finally:
+        prefetcher.close()
+
+
+def test_window_tracks_rater_speed_and_storage_latency():
+    ticks = itertools.count()
+    prefetcher = Prefetcher(min_window=2, max_window=32, clock=lambda: next(ticks) * 0.5)
+    try:
+        assert prefetcher.window() == 4
+        prefetcher.hint([])
+        prefetcher.hint([])
+        assert prefetcher.interval == 0.5
+
+        prefetcher.latency = 0.05
+        assert prefetcher.window() == 2
+        prefetcher.interval, prefetcher.latency = 0.2, 1.0
+        assert prefetcher.window() == 6
+        prefetcher.interval = 0.001
+        assert prefetcher.window() == 32
+    finally:
+        prefetcher.close()
+
+
+def test_fadvise_mode_times_storage_and_widens_the_window(tmp_path, monkeypatch):
+    paths = _files(tmp_path, 4)
+    now = [0.0]
+
+    def slow_fadvise(path):
+        now[0] += 1.0  # one second per file
+
+    monkeypatch.setattr(prefetch, "_fadvise", slow_fadvise)
+    monkeypatch.setattr(prefetch.os, "posix_fadvise", lambda *args: None, raising=False)
+    prefetcher = Prefetcher(
+        mode="fadvise", workers=1, min_window=2, max_window=32, clock=lambda: now[0]
+    )
+    try:
+        assert prefetcher.mode == "fadvise"
+        prefetcher.hint(paths)
+        assert prefetcher.wait(5)
+        assert prefetcher.latency == 1.0 and prefetcher.nbytes == 0
+        prefetcher.interval = 0.1
+        assert prefetcher.window() == 11
+    finally:
+        prefetcher.close()
+
+
+def test_window_loads_from_prefetched_bytes(qapp, tmp_path):
+    image = QImage(8, 8, QImage.Format_Grayscale8)
+    image.fill(50)
+    buf = QBuffer()
+    buf.open(QIODevice.WriteOnly)
+    image.save(buf, "PNG")
+    with zipfile.ZipFile(tmp_path / "b.zip", "w") as zf:
+        for i in range(5):
+            zf.writestr("img{}.png".format(i), bytes(buf.data()))
+
+    window = PyQC.MainWindow()
+    window.loadDirectory(str(tmp_path / "b.zip"))
+    assert window._prefetcher.wait(5)
+    window.navdown()
+    window.navdown()
+    assert window._prefetcher.hits == 2
+    assert window.label.content.width() == 8
+    window._prefetcher.close()
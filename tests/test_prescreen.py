@@ -0,0 +1,91 @@
+import time
+
+import numpy as np
+
+import prescreen
+import PyQC
+from imageops import array_to_qimage
+
+
+def _save(tmp_path, name, pixels):
+    path = str(tmp_path / name)
+    assert array_to_qimage(np.ascontiguousarray(pixels, dtype=np.uint8)).save(path)
+    return path
+
+
+def _noise(shape=(64, 80), seed=0):
+    return np.random.default_rng(seed).integers(0, 256, shape)
+
+
+def test_verdicts(tmp_path):
+    ok = _save(tmp_path, "ok.png", _noise())
+    blank = _save(tmp_path, "blank.png", np.full((64, 80), 7))
+    tiny = _save(tmp_path, "tiny.png", _noise((4, 80)))
+    cut = _noise()
+    cut[50:] = 128
+    truncated = _save(tmp_path, "cut.png", cut)
+    garbage = tmp_path / "garbage.png"
+    garbage.write_bytes(b"\x89PNG not really")
+
+    assert prescreen.screen(ok)["verdict"] == "ok"
+    assert prescreen.screen(blank)["verdict"] == "blank"
+    assert prescreen.screen(tiny)["verdict"] == "tiny"
+    assert prescreen.screen(truncated)["verdict"] == "truncated"
+    assert prescreen.screen(str(garbage))["verdict"] == "unreadable"
+    assert prescreen.screen(str(tmp_path / "missing.png"))["verdict"] == "unreadable"
+
+    result = prescreen.screen(ok)
+    assert (result["width"], result["height"]) == (80, 64)
+    assert 100 < result["mean"] < 155
+    assert prescreen.describe(result).startswith("ok: 80x64")
+
+
+def test_truncated_jpeg_is_flagged(tmp_path):
+    path = str(tmp_path / "full.jpg")
+    assert array_to_qimage(_noise((120, 160)).astype(np.uint8)).save(path, quality=95)
+    data = open(path, "rb").read()
+    cut = tmp_path / "cut.jpg"
+    cut.write_bytes(data[: len(data) // 2])
+    assert prescreen.screen(path)["verdict"] == "ok"
+    assert prescreen.screen(str(cut))["verdict"] == "truncated"
+
+
+def test_window_prescreens_in_background_and_prerates(qapp, tmp_path):
+    _save(tmp_path, "a.png", _noise(seed=1))
+    _save(tmp_path, "b.png", np.zeros((64, 80)))
+    _save(tmp_path, "c.png", _noise(seed=2))
+    window = PyQC.MainWindow()
+    window.loadDirectory(str(tmp_path))
+    window.prescreen(prerate="0")
+
+    column = window.column_names.index(PyQC.PRESCREEN_COLUMN)
+    deadline = time.monotonic() + 60
+    while window._prescreener is not None and time.monotonic() < deadline:
+        time.sleep(0.05)
+        window._collect_prescreen()
+    assert window._prescreener is None
+
+    verdicts = [window.tableWidget.item(r, column).text() for r in range(3)]
+    assert verdicts == ["ok", "blank", "ok"]
+    assert "mean 0.0" in window.tableWidget.item(1, column).toolTip()
+    assert window._flagged_rows() == [1]
+    assert window.tableWidget.item(1, 1).text() == "0"
+    assert window.tableWidget.item(0, 1) is None
+
+    # Rating keys skip the derived column
+    assert column not in window._rating_columns()
+    window._go_to_row(0)
+    for key in "123":
+        window.numpress(key)
+    assert window.tableWidget.item(0, column).text() == "ok"
+
+
+def test_menu_prescreen_does_not_prerate(qapp, tmp_path):
+    _save(tmp_path, "a.png", _noise(seed=1))
+    window = PyQC.MainWindow(prefetch="off")
+    window.loadDirectory(str(tmp_path))
+    window.actionPrescreen_Images.trigger()  # triggered(checked=False)
+    assert window._prescreener is not None
+    assert window._prerate_after_prescreen is None
+    window._dirty = False
+    window.close()
@@ -0,0 +1,337 @@
+import random
+
+from PyQt5.QtCore import QModelIndex
+from PyQt5.QtWidgets import QTableWidgetItem, QTableWidgetSelectionRange
+
+import PyQC
+from rating_index import BLOCK_BITS, RatingIndex, RowBitmap
+
+
+def test_rowbitmap_next_prev_rank_match_brute_force():
+    rng = random.Random(0)
+    size = 3 * BLOCK_BITS + 77
+    members = sorted(rng.sample(range(size), 40))
+    bitmap = RowBitmap(size)
+    for row in members:
+        bitmap.add(row)
+
+    assert len(bitmap) == len(members)
+    assert list(bitmap) == members
+    for row in list(range(0, size, 97)) + members + [size - 1]:
+        assert bitmap.next(row) == next((m for m in members if m >= row), None)
+        assert bitmap.prev(row) == next(
+            (m for m in reversed(members) if m <= row), None
+        )
+        assert bitmap.rank(row) == sum(1 for m in members if m < row)
+
+
+def test_rowbitmap_discard_and_resize():
+    bitmap = RowBitmap(10)
+    bitmap.add(3)
+    bitmap.add(9)
+    bitmap.discard(3)
+    bitmap.discard(4)  # not a member: no-op
+    assert list(bitmap) == [9]
+
+    bitmap.resize(12, fill=True)
+    assert list(bitmap) == [9, 10, 11]
+    bitmap.resize(10)
+    assert list(bitmap) == [9]
+
+
+def test_rowbitmap_and_xor_match_sets():
+    rng = random.Random(1)
+    size = 2 * BLOCK_BITS + 13
+    a_rows = set(rng.sample(range(size), 300))
+    b_rows = set(rng.sample(range(size + 20), 300))
+    a = RowBitmap.from_rows(a_rows, size)
+    b = RowBitmap.from_rows(b_rows, size + 20)
+
+    both, either = a & b, a ^ b
+    assert both.size == either.size == size
+    assert list(both) == sorted(a_rows & b_rows)
+    assert list(either) == sorted(r for r in a_rows ^ b_rows if r < size)
+    assert len(either) == len(list(either))
+    assert list(b & RowBitmap(5, fill=True)) == sorted(r for r in b_rows if r < 5)
+    assert list(a | b) == sorted(r for r in a_rows | b_rows if r < size)
+    assert a.to_int() == RowBitmap.from_rows(a_rows, size).to_int()  # operands unchanged
+
+
+def test_rowbitmap_from_ranges_matches_rows():
+    ranges = [(0, 1), (3, 5), (7, 9), (10, 30), (8, 12), (40, 40), (45, 100)]
+    bitmap = RowBitmap.from_ranges(ranges, 60)
+    expected = sorted({r for start, stop in ranges for r in range(start, min(stop, 60))})
+    assert list(bitmap) == expected and len(bitmap) == len(expected)
+
+
+def test_rowbitmap_fill_resize_from_partial_byte():
+    bitmap = RowBitmap(3, fill=True)
+    bitmap.resize(21, fill=True)
+    assert list(bitmap) == list(range(21)) and len(bitmap) == 21
+    assert bitmap.to_int() == (1 << 21) - 1
+    bitmap.resize(16)
+    bitmap.resize(16 + BLOCK_BITS, fill=True)
+    assert len(bitmap) == 16 + BLOCK_BITS
+
+
+def test_rating_index_value_bitmaps_are_live():
+    index = RatingIndex(rows=4, columns=3)
+    zeros = index.rows_with(1, "0")
+    assert len(zeros) == 0
+
+    index.set(0, 1, "0")
+    index.set(2, 1, "0")
+    index.set(2, 2, "5")
+    assert list(zeros) == [0, 2]  # same object, updated in place
+    assert index.value_counts(1) == {"": 2, "0": 2}
+    assert list(index.unrated()) == [0, 1, 3]
+
+    index.set(0, 1, "1")
+    assert list(zeros) == [2]
+    assert index.get(0, 1) == "1"
+
+
+def test_rating_index_columns_and_rows():
+    index = RatingIndex(rows=2, columns=2)
+    index.set(0, 1, "3")
+    index.insert_column(1)
+    assert index.column_count == 3
+    assert index.get(0, 1) == ""
+    assert index.get(0, 2) == "3"
+
+    index.append_rows(2)
+    assert index.row_count == 4
+    assert list(index.rows_with(2, "")) == [1, 2, 3]
+
+    index.remove_column(1)
+    assert index.get(0, 1) == "3"
+    index.set(0, 0, "ignored")  # column 0 holds paths, not ratings
+    index.set(99, 1, "ignored")
+
+
+def _filtered_window(qapp, ratings):
+    window = PyQC.MainWindow()
+    window.openArgumentFiles([f"/tmp/img{i}.png" for i in range(len(ratings))])
+    for row, (raw, pre) in enumerate(ratings):
+        window.tableWidget.setItem(row, 1, QTableWidgetItem(raw))
+        window.tableWidget.setItem(row, 2, QTableWidgetItem(pre))
+    return window
+
+
+def test_table_edits_keep_rating_index_in_sync(qapp):
+    window = _filtered_window(qapp, [("0", "1"), ("", ""), ("0", "0")])
+    assert list(window._rating_index.rows_with(1, "0")) == [0, 2]
+
+    window.listlocation = 1
+    window.insert_column = 1
+    window.numpress("0")
+    assert list(window._rating_index.rows_with(1, "0")) == [0, 1, 2]
+
+    window.tableWidget.removeColumn(1)
+    assert window._rating_index.column_count == 2
+    assert window._rating_index.get(0, 1) == "1"
+
+
+def test_filter_rated_restricts_navigation_and_writes_back(qapp, tmp_path):
+    window = _filtered_window(
+        qapp, [("0", "0"), ("3", "3"), ("0", "0"), ("4", "4"), ("0", "0")]
+    )
+    assert window.filterRated(1, "0")
+    assert [window.tableWidget.isRowHidden(r) for r in range(5)] == [
+        False, True, False, True, False,
+    ]
+    assert "[QC_Raw = 0: 3]" in window._status_label.text()
+
+    window.navdown()
+    assert window.listlocation == 2
+    window.navup()
+    assert window.listlocation == 0
+
+    # Re-rating row 0 writes to row 0 and advances to the next filtered row.
+    window.numpress("2")
+    window.numpress("2")
+    assert window.listlocation == 2
+
+    window.undo()
+    assert window.listlocation == 0
+    assert window.tableWidget.item(0, 2).text() == ""
+
+    out = tmp_path / "out.csv"
+    window._write_csv(str(out))
+    assert out.read_text().splitlines()[1:] == [
+        "/tmp/img0.png,2,",
+        "/tmp/img1.png,3,3",
+        "/tmp/img2.png,0,0",
+        "/tmp/img3.png,4,4",
+        "/tmp/img4.png,0,0",
+    ]
+
+    window.clearFilter()
+    assert not any(window.tableWidget.isRowHidden(r) for r in range(5))
+
+
+def test_filter_unrated_and_empty_filter(qapp):
+    window = _filtered_window(qapp, [("1", "1"), ("2", ""), ("3", "3")])
+    window.listlocation = 0
+    assert window.filterUnrated()
+    assert window.listlocation == 1  # moved onto the only visible row
+
+    assert not window.filterRated(2, "9")  # no such rating: filter unchanged
+    assert window._row_filter_label == "unrated"
+
+    window.openArgumentFiles(["/tmp/x.png"])
+    assert window._row_filter is None
+    assert not window.tableWidget.isRowHidden(0)
+
+
+def test_set_rows_matches_set_per_row():
+    rng = random.Random(1)
+    size = BLOCK_BITS + 300
+    bulk, single = RatingIndex(size, 3), RatingIndex(size, 3)
+    for index in (bulk, single):
+        index.rows_with(1, "0")  # a live bitmap to keep up to date
+        index.set(7, 1, "2")
+    rows = sorted(rng.sample(range(size), 500))
+    values = [rng.choice("012") for _ in rows]
+    bulk.set_rows(1, rows, values)
+    for row, value in zip(rows, values):
+        single.set(row, 1, value)
+    for value in ("", "0", "1", "2"):
+        assert list(bulk.rows_with(1, value)) == list(single.rows_with(1, value))
+    assert bulk.value_counts(1) == single.value_counts(1)
+    assert list(bulk.unrated()) == list(single.unrated())
+
+
+def test_unrated_bitmap_tracks_sets_and_columns():
+    index = RatingIndex(rows=3, columns=3)
+    unrated = index.unrated()
+    assert list(unrated) == [0, 1, 2]
+
+    index.set(1, 1, "4")
+    assert list(unrated) == [0, 1, 2]  # QC_Pre still empty
+    index.set(1, 2, "4")
+    assert list(unrated) == [0, 2]
+    assert index.first_empty_column(0) == 1
+
+    index.insert_column(3)
+    assert list(unrated) == [0, 1, 2]
+    index.remove_column(3)
+    assert list(unrated) == [0, 2]  # same live object throughout
+
+    index.fill_column(1, ["1", "1", "1"])
+    index.fill_column(2, ["2", "", "2"])
+    assert list(unrated) == [1]
+    assert index.first_empty_column(1) == 2
+
+
+def test_next_and_previous_unrated_wrap_around(qapp):
+    window = _filtered_window(
+        qapp, [("1", "1"), ("2", ""), ("3", "3"), ("", ""), ("5", "5")]
+    )
+    window.listlocation = 0
+    window.nextUnrated()
+    assert window.listlocation == 1
+    assert window.insert_column == 2  # lands on the empty QC_Pre cell
+    window.nextUnrated()
+    assert window.listlocation == 3
+    assert window.insert_column == 1
+    window.nextUnrated()
+    assert window.listlocation == 1  # wrapped
+    window.previousUnrated()
+    assert window.listlocation == 3  # wrapped backwards
+
+    window.numpress("4")
+    window.numpress("4")
+    assert "1 unrated" in window._status_label.text()
+
+
+def test_remove_column_updates_unrated_count(qapp, monkeypatch):
+    window = _filtered_window(qapp, [("1", ""), ("2", "")])
+    assert window._count_unrated_rows() == 2
+
+    monkeypatch.setattr(
+        PyQC.QMessageBox, "question", lambda *a, **k: PyQC.QMessageBox.Yes
+    )
+    window._remove_column_at(2)
+    assert window._count_unrated_rows() == 0
+
+    window.tableWidget.insertColumn(2)
+    assert window._count_unrated_rows() == 2
+
+
+def test_bulk_rating_of_selected_rows_undoes_as_one_edit(qapp):
+    window = PyQC.MainWindow(prefetch="off")
+    window.openArgumentFiles([f"/tmp/bulk{i}.png" for i in range(20000)])
+    window.numpress("1")  # row 0, QC_Raw
+    table = window.tableWidget
+    table.clearSelection()
+    table.setRangeSelected(
+        QTableWidgetSelectionRange(5, 0, 14999, table.columnCount() - 1), True
+    )
+    table.setRangeSelected(
+        QTableWidgetSelectionRange(19990, 0, 19994, table.columnCount() - 1), True
+    )
+    window.insert_column = 2
+    rows = window._selected_rows()
+    assert len(rows) == 15000
+
+    window.rateRows(rows, "0")
+    assert table.item(5, 2).text() == "0"
+    assert table.item(19994, 2).text() == "0"
+    assert table.item(4, 2) is None or table.item(4, 2).text() == ""
+    assert window._rating_index.value_counts(2) == {"": 5000, "0": 15000}
+    assert window._dirty
+
+    window.undo()
+    assert window._rating_index.value_counts(2) == {"": 20000}
+    assert table.item(5, 2).text() == ""
+    assert table.item(0, 1).text() == "1"  # earlier single rating untouched
+    window.undo()  # back to ordinary undo of the single rating
+    assert table.item(0, 1).text() == ""
+    window._dirty = False
+
+
+def test_rate_selected_rows_from_the_menu_uses_the_cursor_column(qapp, monkeypatch):
+    window = PyQC.MainWindow(prefetch="off")
+    window.openArgumentFiles([f"/tmp/menu{i}.png" for i in range(4)])
+    table = window.tableWidget
+    table.setRangeSelected(QTableWidgetSelectionRange(1, 0, 2, table.columnCount() - 1), True)
+    window.insert_column = 2
+    monkeypatch.setattr(PyQC.QInputDialog, "getText", lambda *args, **kwargs: ("3", True))
+    window.actionRate_Selected_Rows.trigger()  # triggered(checked=False)
+    assert [table.item(row, 2).text() for row in (1, 2)] == ["3", "3"]
+    assert window._rating_index.value_counts(1) == {"": 4}
+    window._dirty = False
+
+
+def test_large_table_mode_keeps_cells_filter_and_index(qapp, monkeypatch):
+    monkeypatch.setattr(PyQC, "LARGE_TABLE_ROWS", 4)
+    window = _filtered_window(qapp, [("1", ""), ("", "2"), ("1", "1"), ("", ""), ("3", "")])
+    assert window._large_table
+    header = window.tableWidget.horizontalHeader()
+    assert header.sectionResizeMode(0) == PyQC.QHeaderView.Interactive
+    assert window.tableWidget.verticalHeader().sectionResizeMode(0) == PyQC.QHeaderView.Fixed
+    window.filterRated(1, "1")
+    window._go_to_row(2)
+
+    assert window._append_column("QC_Extra") == 3
+    assert window.tableWidget.item(1, 2).text() == "2"
+    assert window.tableWidget.item(4, 3) is None
+    assert window.tableWidget.isRowHidden(1) and not window.tableWidget.isRowHidden(2)
+    assert window.tableWidget.selectionModel().isRowSelected(2, QModelIndex())
+    assert window._rating_index.column_count == 4
+    assert list(window._rating_index.rows_with(2, "2")) == [1]
+
+    monkeypatch.setattr(
+        PyQC.QMessageBox, "question", lambda *a, **k: PyQC.QMessageBox.Yes
+    )
+    window._remove_column_at(1)
+    assert window.tableWidget.item(1, 1).text() == "2"
+    assert window.tableWidget.item(0, 1).text() == ""
+    assert window.tableWidget.item(0, 0).text() == "img0"
+    assert list(window._rating_index.rows_with(1, "1")) == [2]
+    assert window._count_unrated_rows() == 5
+
+    window.openArgumentFiles(["/tmp/a.png"])
+    assert not window._large_table
+    assert header.sectionResizeMode(0) == PyQC.QHeaderView.Stretch
@@ -0,0 +1,66 @@
+from PyQt5.QtCore import QEvent, Qt
+from PyQt5.QtGui import QImage, QKeyEvent
+
+import PyQC
+import replay
+
+
+def _window(tmp_path):
+    for i in range(4):
+        image = QImage(32, 32, QImage.Format_Grayscale8)
+        image.fill(i * 40)
+        image.save(str(tmp_path / "s{}.png".format(i)))
+    window = PyQC.MainWindow(prefetch="off")
+    window.loadDirectory(str(tmp_path))
+    return window
+
+
+def test_recorded_session_replays_to_same_ratings(qapp, tmp_path):
+    trace = tmp_path / "trace.jsonl"
+    window = _window(tmp_path)
+    window.recordTo(str(trace))
+    window.keyPressEvent(QKeyEvent(QEvent.KeyPress, Qt.Key_1, Qt.NoModifier, "1"))
+    window.keyPressEvent(QKeyEvent(QEvent.KeyPress, Qt.Key_S, Qt.NoModifier, "s"))
+    window.tableWidget.cellClicked.emit(3, 1)
+    window.keyPressEvent(QKeyEvent(QEvent.KeyPress, Qt.Key_2, Qt.NoModifier, "2"))
+    recorded = [window.tableWidget.item(row, 1) for row in range(4)]
+    recorded = [item.text() if item else "" for item in recorded]
+    window._dirty = False
+    window.close()
+
+    events = replay.load(str(trace))
+    assert [replay.label(event) for event in events] == [
+        "key 0-9",
+        "key S",
+        "click",
+        "key 0-9",
+    ]
+    assert recorded == ["1", "", "", "2"]
+
+    window = _window(tmp_path)
+    latencies = replay.run(qapp, window, events)
+    replayed = [window.tableWidget.item(row, 1) for row in range(4)]
+    assert [item.text() if item else "" for item in replayed] == recorded
+    summary = replay.summarize(latencies)
+    assert summary["key 0-9"]["n"] == 2
+    assert summary["click"]["max"] >= summary["click"]["p50"] >= 0
+    assert "key 0-9" in replay.format_summary(summary)
+    window._dirty = False
+    window.close()
+
+
+def test_realtime_replay_keeps_recorded_pace():
+    slept = []
+    clock = iter(range(100)).__next__
+    events = [{"t": 0, "type": "wheel", "delta": 120}, {"t": 5, "type": "wheel", "delta": -120}]
+
+    class Window:
+        def wheelEvent(self, event):
+            pass
+
+    class App:
+        def processEvents(self):
+            pass
+
+    replay.run(App(), Window(), events, realtime=True, clock=clock, sleep=slept.append)
+    assert slept == [1]  # t=5 is due one tick after the clock reads 4
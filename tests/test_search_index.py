@@ -0,0 +1,78 @@
+import PyQC
+from pathstore import PathStore
+from search_index import SearchIndex
+
+
+def _index(paths):
+    store = PathStore(paths)
+    index = SearchIndex(store)
+    index.build_async()
+    index.wait()
+    return store, index
+
+
+PATHS = [
+    "/data/sub-01/anat/sub-01_T1w.jpg",
+    "/data/sub-02/anat/sub-02_T1w.jpg",
+    "/data/sub-03/anat/sub-03_T1w.jpg",
+    "/data/sub-01/func/sub-01_bold.jpg",
+]
+
+
+def test_find_substring_wraps_from_start():
+    _, index = _index(PATHS)
+    assert index.find("T1W") == 0  # case-insensitive
+    assert index.find("t1w", start=1) == 1
+    assert index.find("bold", start=0) == 3
+    assert index.find("sub-01", start=1) == 3
+    assert index.find("sub-01", start=4) == 0  # wraps past the end
+    assert index.find("nothing-here") is None
+    assert index.find("   ") is None
+
+
+def test_find_reverse():
+    _, index = _index(PATHS)
+    assert index.find("sub-01", start=2, reverse=True) == 0
+    assert index.find("sub-02", start=0, reverse=True) == 1
+
+
+def test_find_matches_directory_prefixes():
+    _, index = _index(PATHS)
+    # "func" only appears in the directory, not in any display name.
+    assert index.find("func") == 3
+
+
+def test_short_queries_use_prefix_lookup():
+    _, index = _index(PATHS)
+    assert index.find("su", start=2) == 2
+    assert index.find("x") is None
+
+
+def test_index_updates_incrementally_when_rows_are_added():
+    store, index = _index(PATHS)
+    store.append("/data/sub-99/anat/sub-99_T1w.jpg")
+    assert index.find("sub-99") == 4
+    assert index._indexed == 5
+
+
+def test_find_before_index_ready_falls_back_to_scan():
+    store = PathStore(PATHS)
+    index = SearchIndex(store)
+    assert index.ready
+    index._thread = type("Busy", (), {"is_alive": lambda self: True})()
+    assert index.find("bold") == 3
+    assert index._indexed == 0
+
+
+def test_search_box_jumps_to_match(qapp):
+    window = PyQC.MainWindow()
+    window.openArgumentFiles(["/tmp/alpha.png", "/tmp/beta.png", "/tmp/gamma.png"])
+    window._search_index.wait()
+
+    window.searchEdit.setText("gam")
+    window._on_search_edited("gam")
+    assert window.listlocation == 2
+
+    window.searchEdit.setText("a")
+    window.findNext()  # wraps around to the first row starting with "a"
+    assert window.listlocation == 0
@@ -0,0 +1,140 @@
+import asyncio
+import http.client
+import json
+import os
+
+from PyQt5.QtGui import QImage
+
+import serve
+from session import Session
+
+
+def _session(tmp_path, rows=3):
+    for i in range(rows):
+        image = QImage(64, 48, QImage.Format_RGB32)
+        image.fill(0xFF000000 + i * 0x202020)
+        image.save(str(tmp_path / f"s{i}.png"))
+    csv_path = tmp_path / "ratings.csv"
+    csv_path.write_text(
+        "File,QC_Raw,QC_Pre\n" + "".join(f"s{i}.png,,\n" for i in range(rows))
+    )
+    session = Session()
+    session.load_csv(str(csv_path))
+    return session
+
+
+def _run(session, client, **kwargs):
+    """Serve `session` on localhost and run `client(connection)` against it."""
+
+    async def scenario():
+        server = serve.ReviewServer(session, **kwargs)
+        await server.start("127.0.0.1", 0)
+        connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+        try:
+            return await asyncio.to_thread(client, connection)
+        finally:
+            connection.close()
+            await server.close()
+
+    return asyncio.run(scenario())
+
+
+def _request(connection, method, path, body=None, **headers):
+    if body is not None:
+        body = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+    connection.request(method, path, body, headers)
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def test_previews_are_cached_and_revalidated(tmp_path):
+    session = _session(tmp_path)
+
+    def client(connection):
+        response, body = _request(connection, "GET", "/")
+        assert response.status == 200 and b"<html>" in body
+        response, body = _request(connection, "GET", "/api/session")
+        assert json.loads(body)["columns"] == ["File", "QC_Raw", "QC_Pre"]
+        response, body = _request(connection, "GET", "/api/rows/0")
+        assert json.loads(body)["prefetch"] == ["/preview/1", "/preview/2"]
+        assert response.getheader("Link").startswith("</preview/1>; rel=prefetch")
+
+        response, jpeg = _request(connection, "GET", "/preview/1", Accept="image/*")
+        assert response.status == 200 and jpeg[:2] == b"\xff\xd8"
+        etag = response.getheader("ETag")
+        response, body = _request(connection, "GET", "/preview/1", **{"If-None-Match": etag})
+        assert response.status == 304 and body == b""
+        response, webp = _request(connection, "GET", "/preview/1", Accept="image/webp,*/*")
+        assert response.getheader("Content-Type") == "image/webp"
+        assert response.getheader("ETag") != etag
+        response, _ = _request(connection, "GET", "/preview/9")
+        assert response.status == 404
+
+    _run(session, client, cache_dir=str(tmp_path / "cache"), prefetch=2)
+    cached = sorted(os.listdir(tmp_path / "cache"))
+    assert {name.rsplit(".", 1)[1] for name in cached} == {"jpeg", "webp"}
+
+
+def test_ratings_are_saved_to_the_csv(tmp_path):
+    session = _session(tmp_path)
+
+    def client(connection):
+        response, body = _request(
+            connection, "POST", "/api/rows/1", {"column": "QC_Pre", "value": "2"}
+        )
+        assert response.status == 200 and json.loads(body)["cells"] == ["", "2"]
+        response, _ = _request(connection, "POST", "/api/rows/0", {"column": 1, "value": 1})
+        assert response.status == 200
+        response, _ = _request(connection, "POST", "/api/rows/0", {"column": "File", "value": "x"})
+        assert response.status == 400
+        response, body = _request(connection, "POST", "/api/save", {})
+        assert json.loads(body)["saved"] == session.path
+
+    _run(session, client, cache_dir=str(tmp_path / "cache"), save_delay=60)
+    assert (tmp_path / "ratings.csv").read_text().splitlines() == [
+        "File,QC_Raw,QC_Pre",
+        f"{tmp_path}/s0.png,1,",
+        f"{tmp_path}/s1.png,,2",
+        f"{tmp_path}/s2.png,,",
+    ]
+
+
+def test_cross_site_requests_are_refused(tmp_path):
+    session = _session(tmp_path)
+
+    def client(connection):
+        rating = json.dumps({"column": "QC_Raw", "value": "1"})
+        connection.request("POST", "/api/rows/0", rating, {"Content-Type": "text/plain"})
+        response = connection.getresponse()
+        assert response.status == 415 and response.read()
+        rating = {"column": 1, "value": 1}
+        response, _ = _request(
+            connection, "POST", "/api/rows/0", rating, Origin="http://evil.example"
+        )
+        assert response.status == 403
+        response, _ = _request(connection, "GET", "/api/session", Host="evil.example:8000")
+        assert response.status == 403
+        response, _ = _request(connection, "GET", "/api/session", Host="localhost:8000")
+        assert response.status == 200
+
+        os.remove(session.path)
+        os.mkdir(session.path)  # unwritable as a file
+        response, _ = _request(connection, "POST", "/api/rows/0", rating)
+        assert response.status == 200
+        response, body = _request(connection, "POST", "/api/save", {})
+        assert response.status == 500 and "cannot save" in json.loads(body)["error"]
+        os.rmdir(session.path)
+
+    _run(session, client, cache_dir=str(tmp_path / "cache"), save_delay=60)
+    assert session.cell(0, 1) == "1"
+
+
+def test_prune_cache_deletes_least_recently_used(tmp_path):
+    for age, name in enumerate(["new", "middle", "old"]):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (1000 - age, 1000 - age))
+    serve.prune_cache(str(tmp_path), 250)
+    assert sorted(os.listdir(tmp_path)) == ["middle", "new"]
+    serve.prune_cache(str(tmp_path / "missing"), 0)
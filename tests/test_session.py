@@ -0,0 +1,120 @@
+import subprocess
+import sys
+
+import session
+from session import Session
+
+
+def test_session_imports_no_qt():
+    code = "import session, sys; print(any(m.startswith('PyQt5') for m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert out.stdout.strip() == "False"
+
+
+def test_rate_undo_and_save_without_a_window(tmp_path):
+    changed = []
+    s = Session(on_cells_changed=lambda column, rows: changed.append((column, list(rows))))
+    assert s.load_files([f"/data/img{i}.png" for i in range(4)])
+    s.rate("1")
+    s.rate("2")  # last rating column: on to the next row
+    assert (s.row, s.insert_column) == (1, 1)
+    s.rate("3")
+    assert s.undo() == [1]
+    assert s.undo() == [0]
+    assert (s.row, s.insert_column) == (0, 2)
+    assert [s.cell(0, 1), s.cell(0, 2), s.cell(1, 1)] == ["1", "", ""]
+    assert changed[:3] == [(1, [0]), (2, [0]), (1, [1])]
+
+    s.rate_rows([1, 2, 3], "0", column=2)
+    assert len(s.index.unrated()) == 4
+    assert s.undo() == [1, 2, 3]
+    assert s.cell(2, 2) == ""
+
+    s.rate("4")  # row 0, QC_Pre: on to row 1
+    assert s.next_unrated() and s.row == 2
+    column = s.add_column("QC_Extra")
+    assert column == 3 and s.rating_columns() == [1, 2, 3]
+    assert s.rename_column(3, "Notes")
+    assert not s.remove_column(0)
+
+    path = tmp_path / "out.csv"
+    s.save(str(path))
+    assert not s.dirty
+    assert path.read_text().splitlines()[:2] == [
+        "File,QC_Raw,QC_Pre,Notes",
+        "/data/img0.png,1,4,",
+    ]
+
+    again = Session()
+    assert again.load_csv(str(path))
+    assert again.row == 0  # Notes is empty on every row
+    assert again.cell(0, 2) == "4"
+    assert again.column_names == s.column_names
+
+
+def test_filter_limits_cursor_moves_and_derived_columns_are_skipped():
+    s = Session()
+    s.load_files(["/a.png", "/b.png", "/c.png"])
+    s.add_column(session.PRESCREEN_COLUMN)
+    assert s.rating_columns() == [1, 2]
+    s.shown = s.index.rows_with(1, "")
+    s.rate("1")
+    s.rate("1")  # row 0 rated in QC_Raw: no longer shown
+    assert s.row == 1
+    assert s.move(1) and s.row == 2
+    assert not s.move(1)
+    s.fill_empty([2], "0")
+    assert [s.cell(2, c) for c in (1, 2, 3)] == ["0", "0", ""]
+    assert not s.load_files([])
+    assert len(s.files) == 3  # a failed load keeps the session
+
+
+def test_empty_derived_cells_do_not_make_rows_unrated(tmp_path):
+    path = tmp_path / "r.csv"
+    path.write_text(
+        "File,QC_Raw,QC_Pre,Duplicate\n"
+        "a.png,1,1,\nb.png,1,0,group 1\nc.png,0,1,group 1\nd.png,,,\n"
+    )
+    s = Session()
+    s.load_csv(str(path))
+    assert list(s.index.unrated()) == [3]
+    assert s.row == 3
+    s.row = 0
+    assert s.next_unrated() and (s.row, s.insert_column) == (3, 1)
+    s.rate("1")
+    s.rate("1")
+    assert not len(s.index.unrated())
+
+    s.rename_column(3, "Notes")  # now a rating column, empty on rows 0 and 3
+    assert list(s.index.unrated()) == [0, 3]
+    assert s.index.first_empty_column(0) == 3
+    s.add_column(session.PRESCREEN_COLUMN)
+    assert list(s.index.unrated()) == [0, 3]
+
+
+def test_csv_set_loads_lazily_and_saves_only_modified_files(tmp_path, capsys):
+    for site in "abc":
+        (tmp_path / f"site_{site}.csv").write_text(
+            f"File,QC_Raw,QC_Pre\n/{site}0.png,,\n/{site}1.png,1,1\n"
+        )
+    (tmp_path / "site_empty.csv").write_text("File,QC_Raw,QC_Pre\n")
+    paths = session.expand_csv_paths([str(tmp_path / "site_*.csv")])
+    assert [p.rsplit("_", 1)[1] for p in paths] == ["a.csv", "b.csv", "c.csv", "empty.csv"]
+
+    files = session.CsvSet(paths)
+    assert files.advance(1).files[0] == "/a0.png"
+    assert files.open_files() == paths[:1]
+    files.session.rate("2")
+    files.advance(1)
+    files.advance(1)  # b was not changed: dropped; a has unsaved ratings
+    assert files.open_files() == [paths[0], paths[2]]
+    assert files.advance(1) is None  # no data rows
+    assert files.session.files[0] == "/c0.png"
+    assert files.dirty and files.modified() == [paths[0]]
+
+    before = (tmp_path / "site_b.csv").stat().st_mtime_ns
+    assert files.save() == [paths[0]]
+    assert not files.dirty and files.open_files() == [paths[2]]
+    assert (tmp_path / "site_a.csv").read_text().splitlines()[1] == "/a0.png,2,"
+    assert (tmp_path / "site_b.csv").stat().st_mtime_ns == before
+    assert "no data rows" in capsys.readouterr().out
@@ -0,0 +1,111 @@
+import os
+
+from PyQt5.QtGui import QColor, QImage
+
+from image_widget import SaneDefaultsImageLabel
+from imageops import qimage_view
+import shared_cache
+from shared_cache import SharedImageCache
+
+
+def _image(path, width=40, height=30, color=QColor(200, 30, 90)):
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(color)
+    image.save(str(path))
+    return str(path)
+
+
+def test_entry_published_by_one_instance_is_mapped_by_another(qapp, tmp_path):
+    source = _image(tmp_path / "a.png")
+    writer = SharedImageCache(str(tmp_path / "shm"))
+    reader = SharedImageCache(str(tmp_path / "shm"))
+    assert reader.get(source) is None
+
+    writer.put(source, QImage(source))
+    image = reader.get(source)
+    assert image.size() == QImage(source).size()
+    assert image.pixelColor(5, 5) == QColor(200, 30, 90)
+    assert not image._array.flags.owndata  # a view of the mapping, not a copy
+    assert (reader.hits, reader.misses) == (1, 1)
+
+    # A rewritten file is a different entry
+    _image(tmp_path / "a.png", color=QColor(0, 0, 255))
+    os.utime(source, ns=(1, 1))
+    assert reader.get(source) is None
+
+
+def test_group_writable_directory_shares_entries_with_the_group(qapp, tmp_path):
+    source = _image(tmp_path / "a.png")
+    private = SharedImageCache(str(tmp_path / "private"))
+    private.put(source, QImage(source))
+    shared_dir = tmp_path / "shared"
+    shared_dir.mkdir()
+    os.chmod(shared_dir, 0o2770)
+    shared = SharedImageCache(str(shared_dir))
+    shared.put(source, QImage(source))
+
+    def modes(directory):
+        return {
+            name: os.stat(os.path.join(directory, name)).st_mode & 0o777
+            for name in os.listdir(directory)
+        }
+
+    assert set(modes(tmp_path / "private").values()) == {0o600}
+    assert set(modes(shared_dir).values()) == {0o660}
+    assert len(modes(shared_dir)) == 2  # the entry and the lock file
+
+
+def test_least_recently_used_entries_are_evicted_over_budget(qapp, tmp_path):
+    sources = [_image(tmp_path / "{}.png".format(i)) for i in range(3)]
+    entry = QImage(sources[0]).sizeInBytes() + 24
+    cache = SharedImageCache(str(tmp_path / "shm"), budget=2 * entry)
+    cache.put(sources[0], QImage(sources[0]))
+    cache.put(sources[1], QImage(sources[1]))
+    for name in os.listdir(cache.directory):
+        os.utime(os.path.join(cache.directory, name), ns=(1, 1))
+    assert cache.get(sources[0]) is not None  # now the most recently used
+    cache.put(sources[2], QImage(sources[2]))
+
+    assert cache.nbytes() == 2 * entry
+    assert cache.get(sources[1]) is None
+    assert cache.get(sources[0]) is not None
+    cache.clear()
+    assert cache.nbytes() == 0
+
+
+def test_label_reuses_images_decoded_by_another_label(qapp, tmp_path):
+    gray = QImage(32, 16, QImage.Format_Grayscale8)
+    gray.fill(77)
+    source = str(tmp_path / "g.png")
+    gray.save(source)
+
+    first, second = SaneDefaultsImageLabel(), SaneDefaultsImageLabel()
+    first.shared_cache = SharedImageCache(str(tmp_path / "shm"))
+    second.shared_cache = SharedImageCache(str(tmp_path / "shm"))
+    first.load(source)
+    second.load(source)
+
+    assert second.shared_cache.hits == 1
+    assert second.content.format() == QImage.Format_Grayscale8
+    assert (qimage_view(second.content) == 77).all()
+
+
+def test_default_directory_must_be_private(qapp, tmp_path, monkeypatch, capsys):
+    planted = tmp_path / "planted"
+    planted.mkdir()
+    os.symlink(planted, tmp_path / "pyqc-link")
+    open_dir = tmp_path / "pyqc-open"
+    open_dir.mkdir()
+    open_dir.chmod(0o777)
+
+    for unsafe in ("pyqc-link", "pyqc-open"):
+        monkeypatch.setattr(shared_cache, "default_dir", lambda: str(tmp_path / unsafe))
+        cache = SharedImageCache()
+        assert os.path.dirname(cache.directory) == str(tmp_path)
+        assert os.path.basename(cache.directory) not in ("planted", "pyqc-link", "pyqc-open")
+        assert os.stat(cache.directory).st_mode & 0o777 == 0o700
+    assert capsys.readouterr().out.count("not a private directory") == 2
+
+    monkeypatch.setattr(shared_cache, "default_dir", lambda: str(tmp_path / "pyqc-new"))
+    assert SharedImageCache().directory == str(tmp_path / "pyqc-new")
+    assert SharedImageCache(str(open_dir)).directory == str(open_dir)  # passed in: trusted
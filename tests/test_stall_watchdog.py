@@ -0,0 +1,47 @@
+import time
+
+import PyQC
+from stall_watchdog import StallWatchdog
+
+
+def _pump(qapp, seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        qapp.processEvents()
+        time.sleep(0.002)
+
+
+def _slow_handler():
+    time.sleep(0.15)
+
+
+def test_stalls_are_sampled_and_grouped_by_call_site(qapp, tmp_path):
+    watchdog = StallWatchdog(threshold=0.05)
+    watchdog.start()
+    try:
+        _pump(qapp, 0.1)
+        _slow_handler()
+        _slow_handler()
+        _pump(qapp, 0.1)
+    finally:
+        watchdog.stop()
+
+    assert len(watchdog.stalls) == 1  # back to back, no beat in between
+    stall = watchdog.stalls[0]
+    assert stall.duration >= 0.25
+    assert stall.stack[-1][2] == "_slow_handler"
+    report = watchdog.report()
+    assert "1 stalls over 50 ms" in report
+    assert "in _slow_handler" in report
+    assert "test_stall_watchdog.py" in report
+
+
+def test_window_writes_report_on_close(qapp, tmp_path):
+    report = tmp_path / "stalls.txt"
+    window = PyQC.MainWindow(prefetch="off")
+    window.watchForStalls(str(report), threshold=0.05)
+    _pump(qapp, 0.05)
+    _slow_handler()
+    _pump(qapp, 0.05)
+    window.close()
+    assert "in _slow_handler" in report.read_text()
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+import stats
+
+
+def _write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_summary_counts_distributions_and_unrated(tmp_path):
+    path = _write(
+        tmp_path / "r.csv",
+        "File,QC_Raw,QC_Pre\n"
+        "a.jpg,1,1\n"
+        "\n"
+        "b.jpg,0,\n"
+        "c.jpg,1,0\n"
+        "d.jpg,,\n"
+        "e.jpg,1\n",
+    )
+    summary = stats.summarize(path, chunk_rows=2)
+
+    assert summary["rows"] == 5
+    assert summary["fully_rated"] == 2
+    raw = summary["columns"]["QC_Raw"]
+    assert raw == {"unrated": 1, "distribution": {"0": 1, "1": 3}}
+    assert summary["columns"]["QC_Pre"]["unrated"] == 3
+    (pair,) = summary["column_agreement"]
+    assert pair["columns"] == ["QC_Raw", "QC_Pre"] and pair["n"] == 2
+
+
+def test_headerless_file_grows_columns_like_loadCSV(tmp_path):
+    path = _write(tmp_path / "r.csv", "a.jpg,1\nb.jpg,2\nc.jpg,1,3\n")
+    summary = stats.summarize(path, chunk_rows=2)
+    assert list(summary["columns"]) == ["Unknown_QC1", "Unknown_QC2"]
+    assert summary["columns"]["Unknown_QC2"] == {"unrated": 2, "distribution": {"3": 1}}
+
+
+def test_cohen_kappa_matches_textbook_example():
+    # Two raters, 50 items: 20 yes/yes, 5 yes/no, 10 no/yes, 15 no/no -> 0.4
+    pairs = {("y", "y"): 20, ("y", "n"): 5, ("n", "y"): 10, ("n", "n"): 15}
+    assert stats.cohen_kappa(pairs) == pytest.approx(0.4)
+    assert stats.cohen_kappa({("1", "1"): 3}) == 1.0
+    assert stats.cohen_kappa({}) is None
+
+
+def test_fleiss_kappa_matches_reference():
+    import numpy as np
+
+    # Three raters, perfect agreement on half, total split on the rest
+    fleiss = stats._Fleiss(3)
+    fleiss.add(np.array([["a", "a", "a"], ["b", "b", "b"], ["a", "b", "c"], ["", "a", "a"]]))
+    # P_i: 1, 1, 0 -> P = 2/3; p = (4/9, 4/9, 1/9) -> Pe = 33/81
+    assert fleiss.subjects == 3
+    assert fleiss.kappa() == pytest.approx((2 / 3 - 33 / 81) / (1 - 33 / 81))
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_agreement_between_files(tmp_path, shuffle, capsys):
+    rows_a = ["a.jpg,1", "b.jpg,0", "c.jpg,1", "d.jpg,1"]
+    rows_b = ["a.jpg,1", "b.jpg,1", "c.jpg,1", "d.jpg,"]
+    if shuffle:
+        rows_b = rows_b[::-1]
+    a = _write(tmp_path / "a.csv", "File,QC_Raw\n" + "\n".join(rows_a) + "\n")
+    (tmp_path / "sub").mkdir()
+    b = _write(
+        tmp_path / "sub" / "b.csv",
+        "File,QC_Raw\n" + "\n".join("../" + r for r in rows_b) + "\n",
+    )
+
+    assert stats.main([a, b, "--json", "-j", "2"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    agreement = report["agreement"]
+    assert agreement["matching"] == ("joined on path" if shuffle else "aligned")
+    column = agreement["columns"]["QC_Raw"]
+    assert column["fleiss_n"] == 3
+    (pair,) = column["pairs"]
+    assert pair["n"] == 3
+    assert pair["cohen_kappa"] == pytest.approx(0.0)
+
+    assert stats.main([a, b, "-j", "1"]) == 0
+    assert "Fleiss' kappa" in capsys.readouterr().out
@@ -40,6 +40,8 @@ class Ui_MainWindow(object):
         self.tableWidget.setMaximumSize(QtCore.QSize(16777215, 16777215))
         self.tableWidget.setBaseSize(QtCore.QSize(0, 0))
         self.tableWidget.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.tableWidget.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.tableWidget.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
         self.tableWidget.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOn)
         self.tableWidget.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.tableWidget.setSizeAdjustPolicy(QtWidgets.QAbstractScrollArea.AdjustToContents)
@@ -91,6 +93,11 @@ class Ui_MainWindow(object):
         self.label.setObjectName("label")
         self.scrollArea.setWidget(self.label)
         self.gridLayout_2.addWidget(self.splitter_3, 0, 0, 1, 1)
+        self.searchEdit = QtWidgets.QLineEdit(self.centralwidget)
+        self.searchEdit.setFocusPolicy(QtCore.Qt.ClickFocus)
+        self.searchEdit.setClearButtonEnabled(True)
+        self.searchEdit.setObjectName("searchEdit")
+        self.gridLayout_2.addWidget(self.searchEdit, 1, 0, 1, 1)
         MainWindow.setCentralWidget(self.centralwidget)
         self.menubar = QtWidgets.QMenuBar(MainWindow)
         self.menubar.setGeometry(QtCore.QRect(0, 0, 1059, 27))
@@ -101,6 +108,8 @@ class Ui_MainWindow(object):
         self.menu_View.setObjectName("menu_View")
         self.menu_Columns = QtWidgets.QMenu(self.menubar)
         self.menu_Columns.setObjectName("menu_Columns")
+        self.menu_Tools = QtWidgets.QMenu(self.menubar)
+        self.menu_Tools.setObjectName("menu_Tools")
         MainWindow.setMenuBar(self.menubar)
         self.action_Save = QtWidgets.QAction(MainWindow)
         self.action_Save.setObjectName("action_Save")
@@ -128,6 +137,30 @@ class Ui_MainWindow(object):
         self.action_Zoom_In.setObjectName("action_Zoom_In")
         self.action_Zoom_Out = QtWidgets.QAction(MainWindow)
         self.action_Zoom_Out.setObjectName("action_Zoom_Out")
+        self.actionFind = QtWidgets.QAction(MainWindow)
+        self.actionFind.setObjectName("actionFind")
+        self.actionShow_All_Rows = QtWidgets.QAction(MainWindow)
+        self.actionShow_All_Rows.setObjectName("actionShow_All_Rows")
+        self.actionShow_Unrated_Rows = QtWidgets.QAction(MainWindow)
+        self.actionShow_Unrated_Rows.setObjectName("actionShow_Unrated_Rows")
+        self.actionShow_Rows_Rated = QtWidgets.QAction(MainWindow)
+        self.actionShow_Rows_Rated.setObjectName("actionShow_Rows_Rated")
+        self.actionPrescreen_Images = QtWidgets.QAction(MainWindow)
+        self.actionPrescreen_Images.setObjectName("actionPrescreen_Images")
+        self.actionPrerate_Flagged = QtWidgets.QAction(MainWindow)
+        self.actionPrerate_Flagged.setObjectName("actionPrerate_Flagged")
+        self.actionRate_Selected_Rows = QtWidgets.QAction(MainWindow)
+        self.actionRate_Selected_Rows.setObjectName("actionRate_Selected_Rows")
+        self.actionFind_Duplicates = QtWidgets.QAction(MainWindow)
+        self.actionFind_Duplicates.setObjectName("actionFind_Duplicates")
+        self.actionRate_Duplicates = QtWidgets.QAction(MainWindow)
+        self.actionRate_Duplicates.setObjectName("actionRate_Duplicates")
+        self.actionWrite_Stall_Report = QtWidgets.QAction(MainWindow)
+        self.actionWrite_Stall_Report.setObjectName("actionWrite_Stall_Report")
+        self.actionWrite_Memory_Report = QtWidgets.QAction(MainWindow)
+        self.actionWrite_Memory_Report.setObjectName("actionWrite_Memory_Report")
+        self.actionCompare = QtWidgets.QAction(MainWindow)
+        self.actionCompare.setObjectName("actionCompare")
         self.menu_File.addAction(self.action_Save)
         self.menu_File.addAction(self.actionSave_As)
         self.menu_File.addAction(self.actionOpen_Files)
@@ -140,12 +173,30 @@ class Ui_MainWindow(object):
         self.menu_View.addSeparator()
         self.menu_View.addAction(self.action_Zoom_In)
         self.menu_View.addAction(self.action_Zoom_Out)
+        self.menu_View.addSeparator()
+        self.menu_View.addAction(self.actionCompare)
+        self.menu_View.addSeparator()
+        self.menu_View.addAction(self.actionFind)
+        self.menu_View.addSeparator()
+        self.menu_View.addAction(self.actionShow_All_Rows)
+        self.menu_View.addAction(self.actionShow_Unrated_Rows)
+        self.menu_View.addAction(self.actionShow_Rows_Rated)
         self.menu_Columns.addAction(self.actionAdd_Column)
         self.menu_Columns.addAction(self.actionRename_Column)
         self.menu_Columns.addAction(self.actionRemove_Column)
+        self.menu_Tools.addAction(self.actionPrescreen_Images)
+        self.menu_Tools.addAction(self.actionPrerate_Flagged)
+        self.menu_Tools.addAction(self.actionRate_Selected_Rows)
+        self.menu_Tools.addSeparator()
+        self.menu_Tools.addAction(self.actionFind_Duplicates)
+        self.menu_Tools.addAction(self.actionRate_Duplicates)
+        self.menu_Tools.addSeparator()
+        self.menu_Tools.addAction(self.actionWrite_Stall_Report)
+        self.menu_Tools.addAction(self.actionWrite_Memory_Report)
         self.menubar.addAction(self.menu_File.menuAction())
         self.menubar.addAction(self.menu_View.menuAction())
         self.menubar.addAction(self.menu_Columns.menuAction())
+        self.menubar.addAction(self.menu_Tools.menuAction())
 
         self.retranslateUi(MainWindow)
         QtCore.QMetaObject.connectSlotsByName(MainWindow)
@@ -160,9 +211,11 @@ class Ui_MainWindow(object):
         item = self.tableWidget.horizontalHeaderItem(2)
         item.setText(_translate("MainWindow", "QC_Pre"))
         self.label.setText(_translate("MainWindow", "Load Images for QC"))
+        self.searchEdit.setPlaceholderText(_translate("MainWindow", "Search subjects (Ctrl+F)"))
         self.menu_File.setTitle(_translate("MainWindow", "&File"))
         self.menu_View.setTitle(_translate("MainWindow", "&View"))
         self.menu_Columns.setTitle(_translate("MainWindow", "&Columns"))
+        self.menu_Tools.setTitle(_translate("MainWindow", "&Tools"))
         self.action_Save.setText(_translate("MainWindow", "&Save"))
         self.actionSave_As.setText(_translate("MainWindow", "Save &As"))
         self.actionOpen_Files.setText(_translate("MainWindow", "Open &Files"))
@@ -180,4 +233,18 @@ class Ui_MainWindow(object):
         self.action_Zoom_In.setShortcut(_translate("MainWindow", "Ctrl++"))
         self.action_Zoom_Out.setText(_translate("MainWindow", "Zoom Out"))
         self.action_Zoom_Out.setShortcut(_translate("MainWindow", "Ctrl+-"))
+        self.actionFind.setText(_translate("MainWindow", "Find Subject"))
+        self.actionFind.setShortcut(_translate("MainWindow", "Ctrl+F"))
+        self.actionShow_All_Rows.setText(_translate("MainWindow", "Show All Rows"))
+        self.actionShow_Unrated_Rows.setText(_translate("MainWindow", "Show Unrated Rows"))
+        self.actionShow_Rows_Rated.setText(_translate("MainWindow", "Show Rows Rated..."))
+        self.actionPrescreen_Images.setText(_translate("MainWindow", "Prescreen Images"))
+        self.actionPrerate_Flagged.setText(_translate("MainWindow", "Pre-rate Flagged Images..."))
+        self.actionRate_Selected_Rows.setText(_translate("MainWindow", "Rate Selected Rows..."))
+        self.actionFind_Duplicates.setText(_translate("MainWindow", "Find Duplicate Images"))
+        self.actionRate_Duplicates.setText(_translate("MainWindow", "Rate Duplicates Like This Row"))
+        self.actionRate_Duplicates.setShortcut(_translate("MainWindow", "Ctrl+D"))
+        self.actionWrite_Stall_Report.setText(_translate("MainWindow", "Write Stall Report"))
+        self.actionWrite_Memory_Report.setText(_translate("MainWindow", "Write Memory Report"))
+        self.actionCompare.setText(_translate("MainWindow", "Compare With Sibling Files..."))
 from image_widget import SaneDefaultsImageLabel